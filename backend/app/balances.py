@@ -0,0 +1,370 @@
+"""
+Cumuls tenus à jour dans la transaction de chaque écriture (débit, crédit,
+nombre de lignes) :
+- account_balances : par exercice et compte -> balance et à-nouveaux en
+  O(comptes) au lieu de réagréger les écritures de l'exercice ;
+- monthly_rollups : par exercice, mois, journal et compte -> centralisateur en
+  une lecture ; balance d'une période (period_totals) : mois entiers lus dans
+  les cumuls, seuls les jours des mois entamés aux bornes lus dans les écritures ;
+  balances de plusieurs périodes / dates d'arrêté en une passe (period_balances).
+
+- insertions : deltas des lignes (add / row_deltas) appliqués par apply ;
+  importer.insert_entries le fait pour chaque lot inséré ;
+- suppressions : subtract (agrégat des lignes visées, avant le DELETE) ;
+- suppression d'un exercice ou d'un client : ON DELETE CASCADE.
+
+Contrôle (et reconstruction) depuis les écritures :
+
+    DATABASE_URL=sqlite:///app.db python -m app.balances [--exercice ID] [--rebuild]
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Iterable
+import argparse, sys
+
+from sqlalchemy import Date, String, case, cast, delete, func, insert, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from .crud import insert_or_ignore
+from .models import AccountBalance, Entry, MonthlyRollup
+
+# (exercice_id, account_id, mois "YYYY-MM", journal) -> [débit, crédit, lignes]
+Deltas = dict[tuple[int, int, str, str], list[int]]
+
+_balances = AccountBalance.__table__
+_rollups = MonthlyRollup.__table__
+_KEYS = {
+    _balances: ["exercice_id", "account_id"],
+    _rollups: ["exercice_id", "month", "jnl", "account_id"],
+}
+_SUMS = ["debit_minor", "credit_minor", "count"]
+# mois d'une écriture côté SQL (date ISO 'YYYY-MM-DD')
+_entry_month = func.substr(cast(Entry.date, String), 1, 7)
+
+
+def month_of(d: date) -> str:
+    return f"{d.year:04d}-{d.month:02d}"
+
+
+def new_deltas() -> Deltas:
+    return defaultdict(lambda: [0, 0, 0])
+
+
+def add(deltas: Deltas, exercice_id: int, account_id: int, day: date, jnl: str, debit: int, credit: int,
+        sign: int = 1):
+    d = deltas[(exercice_id, account_id, month_of(day), jnl)]
+    d[0] += sign * (debit or 0)
+    d[1] += sign * (credit or 0)
+    d[2] += sign
+
+
+def row_deltas(rows: Iterable[dict], deltas: Deltas | None = None) -> Deltas:
+    """Deltas d'insertion de lignes normalisées (clés = colonnes de entries), cumulés dans `deltas`."""
+    if deltas is None:
+        deltas = new_deltas()
+    for r in rows:
+        add(deltas, r["exercice_id"], r["account_id"], r["date"], r["jnl"], r["debit_minor"], r["credit_minor"])
+    return deltas
+
+
+def _upsert(db: Session, table, params: list[dict]):
+    stmt = insert_or_ignore(db, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=_KEYS[table],
+        set_={col: table.c[col] + stmt.excluded[col] for col in _SUMS},
+    )
+    db.execute(stmt, params)
+    emptied = {p["exercice_id"] for p in params if p["count"] < 0}
+    if emptied:
+        db.execute(delete(table).where(table.c.exercice_id.in_(emptied), table.c["count"] <= 0))
+
+
+def apply(db: Session, deltas: Deltas):
+    """Ajoute les deltas aux cumuls (upserts) ; un cumul retombé à 0 ligne disparaît."""
+    rollups = []
+    by_account = defaultdict(lambda: [0, 0, 0])
+    for (ex, acc, month, jnl), (d, c, n) in deltas.items():
+        if not (d or c or n):
+            continue
+        rollups.append({"exercice_id": ex, "month": month, "jnl": jnl, "account_id": acc,
+                        "debit_minor": d, "credit_minor": c, "count": n})
+        t = by_account[(ex, acc)]
+        t[0] += d
+        t[1] += c
+        t[2] += n
+    if not rollups:
+        return
+    _upsert(db, _rollups, rollups)
+    params = [
+        {"exercice_id": ex, "account_id": acc, "debit_minor": d, "credit_minor": c, "count": n}
+        for (ex, acc), (d, c, n) in by_account.items() if d or c or n
+    ]
+    if params:
+        _upsert(db, _balances, params)
+
+
+def _aggregate(table, *criteria):
+    """Cumuls de `table` recalculés depuis les écritures (colonnes dans l'ordre de la table)."""
+    keys = [Entry.exercice_id, Entry.account_id] if table is _balances \
+        else [Entry.exercice_id, _entry_month, Entry.jnl, Entry.account_id]
+    return (
+        select(*keys, func.sum(Entry.debit_minor), func.sum(Entry.credit_minor), func.count())
+        .where(*criteria)
+        .group_by(*keys)
+    )
+
+
+def subtract(db: Session, *criteria):
+    """Retire des cumuls les écritures qui vérifient `criteria` : à appeler avant leur DELETE."""
+    deltas = new_deltas()
+    for ex, month, jnl, acc, d, c, n in db.execute(_aggregate(_rollups, *criteria)):
+        deltas[(ex, acc, month, jnl)] = [-(d or 0), -(c or 0), -n]
+    apply(db, deltas)
+
+
+def _month_bounds(date_from: date | None, date_to: date | None):
+    """Premier jour du premier mois entier et dernier jour du dernier mois entier de la période."""
+    first = last = None
+    if date_from is not None:
+        first = date_from if date_from.day == 1 else (date_from.replace(day=28) + timedelta(days=4)).replace(day=1)
+    if date_to is not None:
+        last = date_to if (date_to + timedelta(days=1)).day == 1 else date_to.replace(day=1) - timedelta(days=1)
+    return first, last
+
+
+def period_totals(exercice_id: int, date_from: date | None = None, date_to: date | None = None):
+    """
+    Sous-requête (account_id, debit_minor, credit_minor, count) des écritures de
+    l'exercice datées dans [date_from, date_to] (None : borne ouverte).
+    """
+    if date_from is None and date_to is None:
+        return (
+            select(_balances.c.account_id, *(_balances.c[col] for col in _SUMS))
+            .where(_balances.c.exercice_id == exercice_id)
+            .subquery()
+        )
+    first, last = _month_bounds(date_from, date_to)
+    parts = []
+    edges = []  # jours hors mois entiers : lus dans les écritures (ix_entries_ex_date)
+    if first is not None and last is not None and first > last:
+        edges.append((date_from, date_to))
+    else:
+        r = _rollups.c
+        where = [r.exercice_id == exercice_id]
+        if first is not None:
+            where.append(r.month >= month_of(first))
+            if date_from < first:
+                edges.append((date_from, first - timedelta(days=1)))
+        if last is not None:
+            where.append(r.month <= month_of(last))
+            if last < date_to:
+                edges.append((last + timedelta(days=1), date_to))
+        parts.append(
+            select(r.account_id, func.sum(r.debit_minor), func.sum(r.credit_minor), func.sum(r["count"]))
+            .where(*where)
+            .group_by(r.account_id)
+        )
+    for d1, d2 in edges:
+        parts.append(
+            select(Entry.account_id, func.sum(Entry.debit_minor), func.sum(Entry.credit_minor), func.count())
+            .where(Entry.exercice_id == exercice_id, Entry.date >= d1, Entry.date <= d2)
+            .group_by(Entry.account_id)
+        )
+    u = (union_all(*parts) if len(parts) > 1 else parts[0]).subquery()
+    account_id, debit, credit, count = u.c
+    return (
+        select(
+            account_id.label("account_id"),
+            func.sum(debit).label("debit_minor"),
+            func.sum(credit).label("credit_minor"),
+            func.sum(count).label("count"),
+        )
+        .group_by(account_id)
+        .subquery()
+    )
+
+
+def cumulative_totals(db: Session, exercice_id: int, dates: Iterable[date | None]) -> dict:
+    """
+    {d: {account_id: [débit, crédit, lignes]}} des écritures de l'exercice datées
+    jusqu'au jour d inclus (None : toutes), pour toutes les dates en une passe :
+    une lecture des cumuls mensuels jusqu'au dernier mois entier demandé, une
+    lecture des jours des mois entamés, les sommes préfixes en mémoire. Dans un
+    mois entamé, on lit le côté le plus court : les jours jusqu'à d (ajoutés
+    au mois précédent) ou ceux après d (retirés du mois complet).
+    """
+    full = {}  # d -> dernier mois entier jusqu'à d (None : tous)
+    heads = {}  # d -> premier jour du mois entamé : jours [début, d] ajoutés
+    tails = {}  # d -> dernier jour du mois entamé : jours ]d, fin] retirés
+    for d in set(dates):
+        if d is None:
+            full[d] = None
+            continue
+        start = d.replace(day=1)
+        end = (start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        if d == end:
+            full[d] = month_of(d)
+        elif d - start < end - d:
+            full[d] = month_of(start - timedelta(days=1))
+            heads[d] = start
+        else:
+            full[d] = month_of(d)
+            tails[d] = end
+
+    r = _rollups.c
+    where = [r.exercice_id == exercice_id]
+    if None not in full and full:
+        where.append(r.month <= max(full.values()))
+    by_month = defaultdict(list)
+    for month, acc, d, c, n in db.execute(
+        select(r.month, r.account_id, func.sum(r.debit_minor), func.sum(r.credit_minor), func.sum(r["count"]))
+        .where(*where)
+        .group_by(r.month, r.account_id)
+    ):
+        by_month[month].append((acc, d, c, n))
+
+    out = {}
+    running = defaultdict(lambda: [0, 0, 0])
+    months = sorted(by_month)
+    i = 0
+    for d in sorted(full, key=lambda d: full[d] or "\uffff"):
+        while i < len(months) and (full[d] is None or months[i] <= full[d]):
+            for acc, dd, c, n in by_month[months[i]]:
+                t = running[acc]
+                t[0] += dd
+                t[1] += c
+                t[2] += n
+            i += 1
+        out[d] = {acc: list(t) for acc, t in running.items()}
+
+    if heads or tails:
+        # Jours des mois entamés : par mois, une plage de début de mois (jusqu'au dernier
+        # d lu par le début) et une de fin de mois (après le premier d lu par la fin),
+        # disjointes. Chacune est découpée aux dates demandées et agrégée par
+        # (segment, compte), le segment étant désigné par son dernier jour.
+        ranges = defaultdict(set)  # (début, fin) de plage -> fins de segment
+        for d, start in heads.items():
+            ranges[start].add(d)
+        for d, end in tails.items():
+            ranges[end].add(d)
+        parts = []
+        for key, points in ranges.items():
+            points = sorted(points)
+            if key.day == 1:
+                start, bounds = key, points
+            else:
+                start, bounds = points[0] + timedelta(days=1), points[1:] + [key]
+            segment = case(*((Entry.date <= b, b) for b in bounds[:-1]), else_=bounds[-1]) \
+                if len(bounds) > 1 else literal(bounds[0], Date)
+            parts.append(
+                select(segment, Entry.account_id, func.sum(Entry.debit_minor), func.sum(Entry.credit_minor), func.count())
+                .where(Entry.exercice_id == exercice_id, Entry.date >= start, Entry.date <= bounds[-1])
+                .group_by(segment, Entry.account_id)
+            )
+        segments = defaultdict(list)  # (année, mois) -> [(fin de segment, compte, cumuls)]
+        for day, acc, dd, c, n in db.execute(union_all(*parts) if len(parts) > 1 else parts[0]):
+            segments[(day.year, day.month)].append((day, acc, dd, c, n))
+        for d in heads.keys() | tails.keys():
+            totals = out[d]
+            sign = 1 if d in heads else -1
+            for day, acc, dd, c, n in segments[(d.year, d.month)]:
+                if (day <= d) if sign > 0 else (day > d):
+                    t = totals.setdefault(acc, [0, 0, 0])
+                    t[0] += sign * (dd or 0)
+                    t[1] += sign * (c or 0)
+                    t[2] += sign * n
+        for d in tails:
+            out[d] = {acc: t for acc, t in out[d].items() if t[2]}
+    return out
+
+
+def period_balances(db: Session, exercice_id: int, periods: list[tuple[date | None, date | None]]) -> list[dict]:
+    """
+    Pour chaque période [(date_from, date_to)] (bornes incluses, None : ouverte),
+    {account_id: (débit, crédit, lignes)} des comptes mouvementés : différences
+    de cumuls (cumulative_totals), toutes les périodes en une passe.
+    """
+    cumuls = cumulative_totals(
+        db, exercice_id, [b for _, b in periods] + [a - timedelta(days=1) for a, _ in periods if a is not None],
+    )
+    result = []
+    for a, b in periods:
+        before = cumuls[a - timedelta(days=1)] if a is not None else {}
+        totals = {}
+        for acc, (d, c, n) in cumuls[b].items():
+            d0, c0, n0 = before.get(acc, (0, 0, 0))
+            if n - n0:
+                totals[acc] = (d - d0, c - c0, n - n0)
+        result.append(totals)
+    return result
+
+
+def rebuild(db, exercice_id: int | None = None):
+    """Recalcule les cumuls d'un exercice (ou de tous) depuis les écritures."""
+    for table in _KEYS:
+        db.execute(delete(table).where(*([table.c.exercice_id == exercice_id] if exercice_id else [])))
+        db.execute(insert(table).from_select(
+            [*_KEYS[table], *_SUMS],
+            _aggregate(table, *([Entry.exercice_id == exercice_id] if exercice_id else [])),
+        ))
+
+
+def verify(db, exercice_id: int | None = None) -> list[tuple]:
+    """
+    Écarts [(table, clé, cumuls de la table, cumuls des écritures)] ; [] si cohérent.
+    Clé : (exercice_id, account_id) ou (exercice_id, mois, journal, account_id).
+    """
+    diffs = []
+    for table, keys in _KEYS.items():
+        kept = {
+            tuple(r[:-3]): tuple(r[-3:])
+            for r in db.execute(
+                select(*(table.c[col] for col in keys + _SUMS))
+                .where(*([table.c.exercice_id == exercice_id] if exercice_id else []))
+            )
+        }
+        actual = {
+            tuple(r[:-3]): tuple(r[-3:])
+            for r in db.execute(_aggregate(table, *([Entry.exercice_id == exercice_id] if exercice_id else [])))
+        }
+        diffs += [(table.name, key, kept.get(key), actual.get(key)) for key in sorted(kept.keys() | actual.keys())
+                  if kept.get(key) != actual.get(key)]
+    return diffs
+
+
+def install(conn):
+    """Base antérieure aux tables de cumuls : calculés une fois depuis les écritures."""
+    if conn.execute(select(Entry.id).limit(1)).first() is None:
+        return
+    for table in _KEYS:
+        if conn.execute(select(table.c.exercice_id).limit(1)).first() is None:
+            conn.execute(insert(table).from_select([*_KEYS[table], *_SUMS], _aggregate(table)))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Contrôle des cumuls (account_balances, monthly_rollups)")
+    parser.add_argument("--exercice", type=int, help="un seul exercice (défaut : tous)")
+    parser.add_argument("--rebuild", action="store_true", help="recalcule les cumuls en écart depuis les écritures")
+    args = parser.parse_args(argv)
+
+    from .database import SessionLocal
+    db = SessionLocal()
+    try:
+        diffs = verify(db, args.exercice)
+        for table, key, kept, actual in diffs:
+            print(f"{table} {key} : table {kept} / écritures {actual}")
+        print(f"{len(diffs)} écart(s)")
+        if diffs and args.rebuild:
+            for ex in sorted({key[0] for _, key, _, _ in diffs}):
+                rebuild(db, ex)
+            db.commit()
+            remaining = verify(db, args.exercice)
+            print("cumuls reconstruits :", "écarts restants" if remaining else "OK")
+            return 1 if remaining else 0
+        return 1 if diffs else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""
+Banc de mesure des recherches par sous-chaîne (suggestions et filtres de la grille).
+
+    python -m app.bench [--rows 1000000] [--db /tmp/pacioli_bench.db] [--repeat 20] [--plans]
+
+Crée au besoin une base SQLite synthétique (écritures insérées par la même voie
+que les imports), puis affiche médiane / p95 / max en ms par requête.
+--plans vérifie en outre que chaque tri de la grille se lit dans un index
+(EXPLAIN QUERY PLAN sans "TEMP B-TREE"), que les pages suivantes et
+précédentes s'enchaînent sans doublon ni trou chez les ex aequo, et que les filtres par sous-chaîne
+contenant des jokers LIKE (% et _) rendent les mêmes lignes qu'un ILIKE seul ;
+code de sortie 1 sinon.
+--json compare la sérialisation d'une page de 500 lignes et de la balance :
+modèles Pydantic + response_model (ancien chemin) contre app/responses.py.
+"""
+from datetime import date, timedelta
+import argparse, os, statistics, sys, time
+
+JOURNALS = ("VT", "AC", "BQ", "OD")
+
+
+def _populate(db, rows: int):
+    from .importer import insert_entries, resolve_accounts, resolve_journals
+    from .models import Client, Exercice
+    from .search import analyze
+
+    client = Client(name="BENCH")
+    db.add(client)
+    db.flush()
+    ex = Exercice(client_id=client.id, label="2024", date_start=date(2024, 1, 1), date_end=date(2024, 12, 31))
+    db.add(ex)
+    db.flush()
+    accounts = {f"{p}{k:05d}": f"{lib} {k}" for p, lib in (("401", "Fournisseur"), ("411", "Client")) for k in range(1000)}
+    accounts.update({"512000": "Banque", "445710": "TVA collectée", "707000": "Ventes"})
+    acc_ids = resolve_accounts(db, client.id, accounts)
+    resolve_journals(db, client.id, {j: None for j in JOURNALS})
+    accnums = sorted(accounts)
+
+    def gen():
+        for i in range(rows):
+            piece = i // 2
+            jnl = JOURNALS[piece % len(JOURNALS)]
+            d = date(2024, 1, 1) + timedelta(days=piece % 366)
+            amount = (piece * 7919) % 10_000_000 + 1
+            yield {
+                "exercice_id": ex.id, "date": d, "jnl": jnl, "piece_ref": f"{jnl}-{piece // len(JOURNALS):06d}",
+                "account_id": acc_ids[accnums[(piece * 31 + i % 2) % len(accnums)]], "lib": f"Facture {piece}",
+                "debit_minor": amount if i % 2 == 0 else 0, "credit_minor": 0 if i % 2 == 0 else amount,
+                "piece_date": d, "valid_date": d, "montant_minor": None, "i_devise": None,
+                "fingerprint": f"{i:032x}", "batch_id": None,
+            }
+
+    insert_entries(db, gen())
+    analyze(db.connection())
+    db.commit()
+    return client.id, ex.id
+
+
+def check_sort_plans(db, exercice_id: int) -> list[str]:
+    """
+    Pour chaque tri de la grille, dans les deux sens, première page puis pages
+    suivante et précédente : plan de la requête paginée. Retourne les plans
+    qui trient (TEMP B-TREE) au lieu de suivre un index.
+    """
+    from sqlalchemy import event
+    from .routers.entries import _entries_page
+
+    params = dict(journal=None, compte=None, piece_ref=None, min_date=None, max_date=None,
+                  amount_like=None, search=None, page_size=50)
+    captured = []
+
+    page = ""
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if "ORDER BY" in statement and "LIMIT" in statement:
+            captured.append((page, statement, parameters))
+
+    engine = db.get_bind()
+    failures = []
+    for key in ("date", "id", "jnl", "piece_ref", "accnum", "debit", "credit"):
+        for sort in (key, f"-{key}"):
+            event.listen(engine, "before_cursor_execute", capture)
+            try:
+                page = "page 1"
+                first = _entries_page(db, exercice_id, sort=sort, **params)
+                page = "after"
+                nxt = _entries_page(db, exercice_id, sort=sort, after=first["page_info"]["next"], **params)
+                page = "before"
+                _entries_page(db, exercice_id, sort=sort, before=nxt["page_info"]["prev"], **params)
+            finally:
+                event.remove(engine, "before_cursor_execute", capture)
+            for page, statement, parameters in captured:
+                plan = [r[3] for r in db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+                if any("TEMP B-TREE" in step for step in plan):
+                    failures.append(f"{sort} ({page}) : {' / '.join(plan)}")
+            captured.clear()
+    return failures
+
+
+def check_page_continuity(db, exercice_id: int, pages: int = 5, page_size: int = 50) -> list[str]:
+    """
+    Pour chaque tri de la grille, dans les deux sens : les `pages` premières
+    pages enchaînées par `after` doivent donner exactement les premières lignes
+    de l'ordre (clé, id) attendu, id dans le sens de la clé, sans doublon ni
+    trou chez les ex aequo ; `before` depuis chaque page rend la précédente.
+    Retourne les écarts.
+    """
+    from sqlalchemy import select
+    from .models import Account, Entry
+    from .routers.entries import _entries_page
+
+    params = dict(journal=None, compte=None, piece_ref=None, min_date=None, max_date=None,
+                  amount_like=None, search=None, page_size=page_size)
+    cols = {"id": Entry.id, "date": Entry.date, "jnl": Entry.jnl, "piece_ref": Entry.piece_ref,
+            "accnum": Account.accnum, "debit": Entry.debit_minor, "credit": Entry.credit_minor}
+    all_rows = db.execute(
+        select(*cols.values()).join(Account, Account.id == Entry.account_id).where(Entry.exercice_id == exercice_id)
+    ).all()
+    failures = []
+    for i, key in enumerate(cols):
+        for desc in (False, True):
+            sort = f"-{key}" if desc else key
+            want = [r[0] for r in sorted(all_rows, key=lambda r: (r[i], r[0]), reverse=desc)[:pages * page_size]]
+            walked = [_entries_page(db, exercice_id, sort=sort, **params)]
+            while len(walked) < pages and walked[-1]["page_info"]["has_next"]:
+                walked.append(_entries_page(db, exercice_id, sort=sort, after=walked[-1]["page_info"]["next"], **params))
+            got = [r["id"] for page in walked for r in page["rows"]]
+            if got != want:
+                dup = len(got) - len(set(got))
+                missing = len(set(want) - set(got))
+                failures.append(f"{sort} (after) : {dup} doublon(s), {missing} ligne(s) manquante(s)")
+                continue
+            for n in range(1, len(walked)):
+                back = _entries_page(db, exercice_id, sort=sort, before=walked[n]["page_info"]["prev"], **params)
+                if [r["id"] for r in back["rows"]] != [r["id"] for r in walked[n - 1]["rows"]]:
+                    failures.append(f"{sort} (before, page {n + 1}) : la page précédente diffère")
+    return failures
+
+WILDCARD_PATTERNS = ("VT_0001", "t-0%12", "BQ-00077_", "_Q-0007", "a%1x", "%", "_")
+WILDCARD_ACCOUNTS = ("401_001", "41%99", "_1100", "%")
+WILDCARD_AMOUNTS = ("1_3", "%5", "2%,0", "12.3", "1,2,3")
+
+
+def check_wildcards(db, exercice_id: int) -> list[str]:
+    """
+    Filtres pièce, compte et montant de la grille, suggest-piece et
+    accounts/suggest avec des motifs à jokers LIKE : comparés à l'ILIKE seul
+    (sans candidats trigrammes). Retourne les écarts.
+    """
+    from sqlalchemy import func, select
+    from .models import Account, Entry, Exercice
+    from .routers.accounts import suggest_accounts
+    from .routers.entries import _apply_filters, suggest_piece
+    from .search import formatted_amount_expr
+
+    client_id = db.scalar(select(Exercice.client_id).where(Exercice.id == exercice_id))
+    base = select(func.count()).select_from(Entry).join(Account, Account.id == Entry.account_id)
+    failures = []
+    for p in WILDCARD_PATTERNS:
+        got = db.scalar(_apply_filters(base, exercice_id, None, p, None, None, None, None, None, True, db))
+        want = db.scalar(base.where(Entry.exercice_id == exercice_id, Entry.piece_ref.ilike(f"%{p}%")))
+        if got != want:
+            failures.append(f"grille piece_ref={p!r} : {got} lignes au lieu de {want}")
+        got = suggest_piece(exercice_id=exercice_id, q=p, limit=10, db=db)["items"]
+        want = [r for r in db.scalars(
+            select(Entry.piece_ref).where(Entry.exercice_id == exercice_id, Entry.piece_ref.ilike(f"%{p}%"))
+            .group_by(Entry.piece_ref).order_by(Entry.piece_ref).limit(10)
+        ) if r]
+        if got != want:
+            failures.append(f"suggest-piece {p!r} : {got} au lieu de {want}")
+    for p in WILDCARD_ACCOUNTS:
+        got = db.scalar(_apply_filters(base, exercice_id, None, None, p, None, None, None, None, True, db))
+        want = db.scalar(base.where(Entry.exercice_id == exercice_id, Account.accnum.ilike(f"%{p}%")))
+        if got != want:
+            failures.append(f"grille compte={p!r} : {got} lignes au lieu de {want}")
+        got = len(suggest_accounts(client_id=client_id, q=p, limit=50, db=db)["items"])
+        want = min(50, db.scalar(select(func.count()).select_from(Account).where(
+            Account.client_id == client_id, Account.accnum.ilike(f"%{p}%") | Account.acclib.ilike(f"%{p}%"))))
+        if got != want:
+            failures.append(f"accounts/suggest {p!r} : {got} comptes au lieu de {want}")
+    for p in WILDCARD_AMOUNTS:
+        got = db.scalar(_apply_filters(base, exercice_id, None, None, None, None, None, p, None, True, db))
+        want = db.scalar(base.where(Entry.exercice_id == exercice_id, formatted_amount_expr().ilike(f"%{p}%")))
+        if got != want:
+            failures.append(f"grille montant={p!r} : {got} lignes au lieu de {want}")
+    return failures
+
+
+def _json_cases(db, exercice_id: int) -> list:
+    import json
+    from pydantic import TypeAdapter
+    from . import responses
+    from .routers.balance import BALANCE_FIELDS, _balance_query
+    from .routers.entries import _entries_page
+    from .schemas import BalanceResponse, EntriesPage, EntryOut, PageInfo
+
+    page = _entries_page(db, exercice_id, page_size=500)
+    columns = _entries_page(db, exercice_id, page_size=500, layout="columns")
+    balance = db.execute(_balance_query(exercice_id)).all()
+    balance_payload = {"rows": responses.rows_payload(balance, [f for f, _ in BALANCE_FIELDS]), "total_accounts": len(balance)}
+    page_adapter, balance_adapter = TypeAdapter(EntriesPage), TypeAdapter(BalanceResponse)
+
+    def pydantic_page():
+        # ancien chemin : un EntryOut par ligne, puis validation response_model et sérialisation
+        obj = EntriesPage(rows=[EntryOut(**r) for r in page["rows"]], page_info=PageInfo(**page["page_info"]))
+        return page_adapter.dump_json(page_adapter.validate_python(obj, from_attributes=True))
+
+    def pydantic_balance():
+        return balance_adapter.dump_json(balance_adapter.validate_python(balance_payload))
+
+    def stdlib(payload):
+        return lambda: json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=responses._default).encode()
+
+    return [
+        ("page 500 : Pydantic", pydantic_page),
+        ("page 500 : json (repli)", stdlib(page)),
+        ("page 500 : rapide", lambda: responses.dumps(page)),
+        ("page 500 : rapide colonnes", lambda: responses.dumps(columns)),
+        ("balance : Pydantic", pydantic_balance),
+        ("balance : rapide", lambda: responses.dumps(balance_payload)),
+    ]
+
+
+def _time(fn, repeat: int) -> tuple[float, float, float]:
+    fn()  # échauffement (cache de pages)
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(0.95 * (len(samples) - 1))], samples[-1]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--db", default="/tmp/pacioli_bench.db")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--plans", action="store_true", help="vérifie les plans des tris de la grille")
+    parser.add_argument("--json", action="store_true", help="compare les sérialisations des listes")
+    args = parser.parse_args(argv)
+
+    # la base doit être choisie avant l'import de l'application
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    from sqlalchemy import func, select
+    from .database import SessionLocal
+    from . import balances, piece_index
+    from .main import init_db  # noqa: F401  (crée schéma + index de recherche)
+    from .models import Client, Entry, Exercice, MonthlyRollup
+    from .routers.accounts import suggest_accounts
+    from .routers.balance import _balance_query
+    from .routers.entries import _entries_page, _seek_page, suggest_piece
+
+    db = SessionLocal()
+    ex = db.execute(select(Exercice).join(Client).where(Client.name == "BENCH")).scalar_one_or_none()
+    if ex is None:
+        t = time.perf_counter()
+        client_id, ex_id = _populate(db, args.rows)
+        print(f"base créée : {args.rows} écritures en {time.perf_counter() - t:.1f} s")
+    else:
+        client_id, ex_id = ex.client_id, ex.id
+    n = db.scalar(select(func.count()).select_from(Entry).where(Entry.exercice_id == ex_id))
+    print(f"{args.db} : {n} écritures\n")
+
+    if args.plans:
+        failures = check_sort_plans(db, ex_id)
+        for f in failures:
+            print("tri sans index :", f)
+        print("plans de tri :", "KO" if failures else "OK (aucun TEMP B-TREE)")
+        gaps = check_page_continuity(db, ex_id)
+        for f in gaps:
+            print("pagination :", f)
+        print("pages enchaînées :", "KO" if gaps else "OK (ni doublon ni trou, after et before)")
+        wildcards = check_wildcards(db, ex_id)
+        for f in wildcards:
+            print("jokers LIKE :", f)
+        print("motifs à jokers :", "KO" if wildcards else "OK (mêmes lignes que l'ILIKE seul)")
+        if failures or gaps or wildcards:
+            return 1
+
+    # suggest-piece est servi en mémoire : construction à la première frappe
+    t = time.perf_counter()
+    piece_index.suggest(db, ex_id, "", 1)
+    refs = len(piece_index._cache[ex_id].refs)
+    print(f"index des pièces : {refs} références en {(time.perf_counter() - t) * 1000:.0f} ms\n")
+
+    def grid(**filters):
+        return lambda: _entries_page(db, ex_id, **filters)
+
+    cases = [
+        ("suggest-piece 'VT-012345'", lambda: suggest_piece(exercice_id=ex_id, q="VT-012345", limit=10, db=db)),
+        ("suggest-piece '2345'", lambda: suggest_piece(exercice_id=ex_id, q="2345", limit=10, db=db)),
+        ("suggest-piece 'AC-'", lambda: suggest_piece(exercice_id=ex_id, q="AC-", limit=10, db=db)),
+        ("suggest-piece 'zzz' (aucune)", lambda: suggest_piece(exercice_id=ex_id, q="zzz", limit=10, db=db)),
+        ("accounts/suggest '0042'", lambda: suggest_accounts(client_id=client_id, q="0042", limit=10, db=db)),
+        ("accounts/suggest 'fourn'", lambda: suggest_accounts(client_id=client_id, q="fourn", limit=10, db=db)),
+        ("grille piece_ref='BQ-000777'", grid(piece_ref="BQ-000777")),
+        ("grille compte='41100012'", grid(compte="41100012")),
+        ("grille montant='12,34'", grid(amount_like="12,34")),
+        ("grille libellé 'facture 4242'", grid(search="facture 4242")),
+        ("grille tri -date", grid(sort="-date")),
+        ("grille tri accnum", grid(sort="accnum")),
+        ("grille tri -credit", grid(sort="-credit")),
+        ("balance (cumuls par compte)", lambda: db.execute(_balance_query(ex_id)).all()),
+        ("centralisateur (cumuls mensuels)", lambda: db.execute(
+            select(MonthlyRollup.month, MonthlyRollup.jnl, func.sum(MonthlyRollup.count))
+            .where(MonthlyRollup.exercice_id == ex_id).group_by(MonthlyRollup.month, MonthlyRollup.jnl)).all()),
+        ("période T2 (mois entiers)", lambda: db.execute(
+            select(balances.period_totals(ex_id, date(2024, 4, 1), date(2024, 6, 30)))).all()),
+        ("période 10/02 - 20/09 (+ bords)", lambda: db.execute(
+            select(balances.period_totals(ex_id, date(2024, 2, 10), date(2024, 9, 20)))).all()),
+        ("balances aux 12 fins de mois", lambda: balances.period_balances(
+            db, ex_id, [(None, date(2024, m, 1) - timedelta(days=1)) for m in range(2, 13)] + [(None, date(2024, 12, 31))])),
+        ("balances aux 12 mi-mois", lambda: balances.period_balances(
+            db, ex_id, [(None, date(2024, m, 15)) for m in range(1, 13)])),
+        # le premier appel construit l'index de positions du tri (max)
+        ("seek position 777777", lambda: _seek_page(db, ex_id, at_position=777_777)),
+        ("seek -credit position 900000", lambda: _seek_page(db, ex_id, sort="-credit", at_position=900_000)),
+        ("seek date '2024-03-15'", lambda: _seek_page(db, ex_id, at_date="2024-03-15")),
+    ]
+    if args.json:
+        cases += _json_cases(db, ex_id)
+    print(f"{'requête':34} {'médiane':>9} {'p95':>9} {'max':>9}")
+    for label, fn in cases:
+        med, p95, worst = _time(fn, args.repeat)
+        print(f"{label:34} {med:8.2f}ms {p95:8.2f}ms {worst:8.2f}ms")
+    db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
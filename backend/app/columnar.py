@@ -0,0 +1,114 @@
+"""
+Exports colonnes (Parquet, flux Arrow IPC) pour l'analyse (pandas, polars...).
+Montants en entiers (centimes), dates natives. Les lignes sont lues par lots
+(yield_per), converties en RecordBatch puis écrites aussitôt : la mémoire reste
+celle d'un lot quelle que soit la taille de l'exercice.
+pyarrow est optionnel : pip install 'compta-mvp[arrow]'.
+"""
+from typing import Iterator
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from .database import SessionLocal
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # dépendance optionnelle
+    pa = pq = None
+
+# Lignes par RecordBatch (et par row group Parquet)
+BATCH_ROWS = 32_768
+
+FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+def require_arrow():
+    if pa is None:
+        raise HTTPException(501, "Export colonnes indisponible : pyarrow n'est pas installé (pip install 'compta-mvp[arrow]')")
+
+
+def schema(fields: list[tuple[str, str]]):
+    """[(nom, type)] -> pa.schema ; types : int, date, str (tous nullables)."""
+    types = {"int": pa.int64(), "date": pa.date32(), "str": pa.string()}
+    return pa.schema([pa.field(name, types[kind]) for name, kind in fields])
+
+
+class _Sink:
+    """Fichier en écriture seule dont on vide le contenu après chaque lot."""
+
+    def __init__(self):
+        self.parts: list[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def _batches(q, sch) -> Iterator:
+    # session propre : celle de la requête est fermée avant l'envoi du corps
+    db = SessionLocal()
+    try:
+        result = db.connection().execute(q.execution_options(yield_per=BATCH_ROWS))
+        for rows in result.partitions():
+            columns = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, sch)], schema=sch,
+            )
+    finally:
+        db.close()
+
+
+def _row_batches(rows: list, sch) -> Iterator:
+    for start in range(0, len(rows), BATCH_ROWS):
+        columns = list(zip(*rows[start:start + BATCH_ROWS]))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(col, type=field.type) for col, field in zip(columns, sch)], schema=sch,
+        )
+
+
+def _write(batches: Iterator, sch, fmt: str) -> Iterator[bytes]:
+    sink = _Sink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, sch, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, sch)
+    for batch in batches:
+        writer.write_batch(batch)
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()  # pied de page Parquet / marqueur de fin du flux
+    yield sink.drain()
+
+
+def columnar_response(q, fields: list[tuple[str, str]], fmt: str, filename: str) -> StreamingResponse:
+    """
+    StreamingResponse Parquet ou Arrow du select Core `q`, dont les colonnes
+    sont décrites dans l'ordre par `fields` (voir schema). `q` peut aussi être
+    une liste de tuples déjà calculés.
+    """
+    require_arrow()
+    if fmt not in FORMATS:
+        raise HTTPException(400, f"Format inconnu : {fmt} (parquet ou arrow)")
+    media_type, ext = FORMATS[fmt]
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{ext}"'}
+    sch = schema(fields)
+    batches = _row_batches(q, sch) if isinstance(q, list) else _batches(q, sch)
+    return StreamingResponse(_write(batches, sch, fmt), media_type=media_type, headers=headers)
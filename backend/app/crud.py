@@ -1,6 +1,10 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, select
-from .models import Entry, Account, Journal, Exercice, JournalSequence
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from functools import lru_cache
+import re
+from .models import Entry, Account, HistoryEvent, Journal, Exercice, JournalSequence
+from . import piece_index
 
 # Helpers
 
@@ -23,6 +27,7 @@ def find_or_create_journal(db: Session, client_id: int, jnl: str, jnl_lib: str |
     j = Journal(client_id=client_id, jnl=jnl, jnl_lib=jnl_lib or jnl)
     db.add(j)
     db.flush()
+    bump_data_version(db, client_id=client_id)  # listé par le centralisateur de chaque exercice
     return j
 
 
@@ -43,34 +48,143 @@ def list_unbalanced_pieces(db: Session, exercice_id: int, limit: int = 100):
     ]
 
 
+def bump_data_version(db: Session, exercice_id: int | None = None, client_id: int | None = None):
+    """
+    Nouvelle version des données d'un exercice, ou de tous ceux d'un client
+    (comptes et journaux sont partagés) : les ETag des lectures changent (voir
+    responses.exercice_etag). Dans la transaction de l'écriture, donc visible
+    en même temps qu'elle. Les versions sont notées sur la session pour les
+    index en mémoire (piece_index).
+    """
+    where = Exercice.id == exercice_id if exercice_id is not None else Exercice.client_id == client_id
+    rows = db.execute(
+        update(Exercice).where(where)
+        .values(data_version=func.coalesce(Exercice.data_version, 0) + 1)
+        .returning(Exercice.id, Exercice.data_version)
+        .execution_options(synchronize_session=False)
+    ).all()
+    piece_index.note_versions(db, rows)
+
+def begin_batch(db: Session, exercice_id: int, description: str = "") -> HistoryEvent:
+    """
+    Crée (flush) le HistoryEvent d'une opération avant ses écritures : son id
+    sert de batch_id aux lignes créées. Description/compteurs à compléter ensuite.
+    Toute opération par lots passe par ici : la version de l'exercice y est incrémentée.
+    """
+    bump_data_version(db, exercice_id)
+    he = HistoryEvent(exercice_id=exercice_id, description=description)
+    db.add(he)
+    db.flush()
+    return he
+
 def get_exercice(db: Session, exercice_id: int) -> Exercice:
     ex = db.get(Exercice, exercice_id)
     if not ex:
         raise ValueError("Exercice introuvable")
     return ex
 
-def get_next_ref(db: Session, exercice_id: int, journal: str, width: int = 5):
-    # 1) Lire le dernier numéro mémorisé
-    seq = db.execute(
-        select(JournalSequence).where(
-            JournalSequence.exercice_id == exercice_id,
-            JournalSequence.jnl == journal
+# ---- Séquences de pièces ----
+# Les numéros "{jnl}-{n:05d}" sont distribués par journal_sequences.last_number
+# (high-water mark persistant) : une réservation de N numéros = un seul UPDATE.
+
+REF_WIDTH = 5
+
+def format_ref(journal: str, n: int, width: int = REF_WIDTH) -> str:
+    return f"{journal}-{n:0{width}d}"
+
+@lru_cache(maxsize=256)
+def _ref_pattern(journal: str) -> re.Pattern:
+    return re.compile(re.escape(journal) + r"-(\d+)")
+
+def ref_number(journal: str, piece_ref: str) -> int | None:
+    """Numéro n si piece_ref est de la forme "{journal}-{n}", sinon None."""
+    m = _ref_pattern(journal).fullmatch(piece_ref or "")
+    return int(m.group(1)) if m else None
+
+def _max_used_number(db: Session, exercice_id: int, journal: str) -> int:
+    refs = db.execute(
+        select(Entry.piece_ref).distinct().where(
+            Entry.exercice_id == exercice_id,
+            Entry.jnl == journal,
+            Entry.piece_ref.like(f"{journal}-%"),
         )
-    ).scalar_one_or_none()
-    start = (seq.last_number if seq else 0) + 1
+    ).scalars()
+    return max((n for n in (ref_number(journal, r) for r in refs) if n is not None), default=0)
+
+def _sequence_where(exercice_id: int, journal: str):
+    return (JournalSequence.exercice_id == exercice_id, JournalSequence.jnl == journal)
 
-    # 2) Trouver le premier suffixe libre à partir de start
-    #    (on vérifie l'existence dans entries)
-    n = start
+def insert_or_ignore(db: Session, table):
+    """INSERT ... ON CONFLICT DO NOTHING selon le dialecte (SQLite / PostgreSQL)."""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+def _ensure_sequence(db: Session, exercice_id: int, journal: str) -> None:
+    # Création paresseuse, amorcée sur le plus grand numéro déjà utilisé ;
+    # ON CONFLICT : un worker concurrent a pu la créer entre-temps
+    exists = db.execute(select(JournalSequence.id).where(*_sequence_where(exercice_id, journal))).first()
+    if exists is None:
+        db.execute(
+            insert_or_ignore(db, JournalSequence.__table__)
+            .values(exercice_id=exercice_id, jnl=journal, last_number=_max_used_number(db, exercice_id, journal))
+            .on_conflict_do_nothing(index_elements=["exercice_id", "jnl"])
+        )
+
+def bump_sequence(db: Session, exercice_id: int, journal: str, number: int) -> None:
+    """Remonte le high-water mark à `number` s'il est plus grand (jamais de recul)."""
+    _ensure_sequence(db, exercice_id, journal)
+    db.execute(
+        update(JournalSequence)
+        .where(*_sequence_where(exercice_id, journal))
+        .values(last_number=case(
+            (JournalSequence.last_number < number, number),
+            else_=JournalSequence.last_number,
+        ))
+    )
+
+def reserve_refs(db: Session, exercice_id: int, journal: str, count: int = 1) -> int:
+    """
+    Réserve `count` numéros consécutifs pour (exercice, journal) et retourne le premier.
+    L'incrément + lecture est un seul UPDATE ... RETURNING : deux workers concurrents
+    obtiennent toujours des plages disjointes (verrou d'écriture SQLite / verrou de ligne).
+    """
+    _ensure_sequence(db, exercice_id, journal)
     while True:
-        cand = f"{journal}-{n:0{width}d}"
-        exists = db.execute(
-            select(func.count(Entry.id)).where(
+        last = db.execute(
+            update(JournalSequence)
+            .where(*_sequence_where(exercice_id, journal))
+            .values(last_number=JournalSequence.last_number + count)
+            .returning(JournalSequence.last_number)
+        ).scalar_one()
+        first = last - count + 1
+        # Garde-fou pour les séquences héritées (jamais avancées) : une requête par plage
+        taken = db.execute(
+            select(Entry.piece_ref).where(
                 Entry.exercice_id == exercice_id,
                 Entry.jnl == journal,
-                Entry.piece_ref == cand
-            )
-        ).scalar_one()
-        if exists == 0:
-            return {"next_ref": cand, "next_number": n}
-        n += 1
+                Entry.piece_ref.in_([format_ref(journal, n) for n in range(first, last + 1)]),
+            ).limit(1)
+        ).first()
+        if taken is None:
+            return first
+        bump_sequence(db, exercice_id, journal, _max_used_number(db, exercice_id, journal))
+
+def get_next_ref(db: Session, exercice_id: int, journal: str, width: int = REF_WIDTH):
+    """
+    Aperçu de la prochaine référence, sans la réserver : la pièce est numérotée
+    au commit (référence vide -> reserve_refs), seule garantie entre utilisateurs.
+    """
+    seq = db.execute(
+        select(JournalSequence.last_number).where(*_sequence_where(exercice_id, journal))
+    ).scalar_one_or_none()
+    n = (seq if seq is not None else _max_used_number(db, exercice_id, journal)) + 1
+    # Séquence héritée en retard : repartir du plus grand numéro utilisé (une lecture, pas un sondage par numéro)
+    if seq is not None and db.execute(
+        select(Entry.id).where(
+            Entry.exercice_id == exercice_id,
+            Entry.jnl == journal,
+            Entry.piece_ref == format_ref(journal, n, width),
+        ).limit(1)
+    ).first() is not None:
+        n = _max_used_number(db, exercice_id, journal) + 1
+    return {"next_ref": format_ref(journal, n, width), "next_number": n}
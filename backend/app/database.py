@@ -10,6 +10,9 @@ if DATABASE_URL.startswith("sqlite"):
     @event.listens_for(engine, "connect")
     def set_sqlite_pragma(dbapi_connection, connection_record):
         dbapi_connection.execute("PRAGMA foreign_keys=ON")
+        # cache de pages (2 Mo par défaut) : les index de la grille sont mis à jour
+        # en ordre dispersé pendant les imports en masse
+        dbapi_connection.execute("PRAGMA cache_size=-65536")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
 Base = declarative_base()
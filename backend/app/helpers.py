@@ -19,12 +19,10 @@ def fmt_cents_fr(cents: Optional[int], with_symbol: bool = True) -> str:
     Ex: 123456 -> '1 234,56 €'
     Ex: -123456 -> '-1 234,56 €'
     """
-    euros = (Decimal(cents or 0) / Decimal(100)).quantize(Decimal("0.01"))
-    # D'abord un format US '1,234.56', puis on permute séparateurs et insère NBSP
-    s = f"{euros:,.2f}"              # '1,234.56' ou '-1,234.56'
-    s = s.replace(",", "§")          # gardien provisoire
-    s = s.replace(".", ",")          # décimale FR
-    s = s.replace("§", NBSP)         # milliers = NBSP
+    # en entiers (appelé deux fois par ligne dans les exports)
+    cents = int(cents or 0)
+    euros, rest = divmod(abs(cents), 100)
+    s = f"{'-' if cents < 0 else ''}{euros:,}".replace(",", NBSP) + f",{rest:02d}"  # milliers = NBSP
     if with_symbol:
         # espace insécable avant le symbole (typo FR)
         s = f"{s}{NBSP}€"
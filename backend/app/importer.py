@@ -0,0 +1,879 @@
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from decimal import ROUND_HALF_UP, Decimal
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import groupby, islice
+from typing import BinaryIO, Callable, Iterable, NamedTuple
+import calendar, codecs, csv, hashlib, io, multiprocessing, os, re, time
+
+from sqlalchemy import Column, MetaData, String, Table, select
+from sqlalchemy.orm import Session
+
+from . import balances, piece_index
+from .crud import begin_batch, bump_data_version, bump_sequence, format_ref, ref_number, reserve_refs
+from .search import analyze, index_bulk_inserted
+from .models import Account, Entry, Exercice, HistoryEvent, Journal
+from .validators import ValidationError, ensure_dates_in_exercice, ensure_totals_balanced_minor
+
+# Taille des lots pour l'insertion (executemany) et pour les IN (...) de résolution
+CHUNK_SIZE = 5000
+IN_CHUNK_SIZE = 500
+# Échantillon de tête (octets) pour la détection du dialecte CSV
+HEAD_SAMPLE_BYTES = 64 * 1024
+ENCODINGS = ("utf-8", "latin-1")
+
+# Étape de parsing parallèle (processus) : au-delà de PARALLEL_MIN_BYTES, le fichier
+# est découpé en blocs alignés sur les fins de ligne, parsés par IMPORT_PARSE_WORKERS
+# processus ; le processus principal garde la résolution et l'insertion.
+PARSE_WORKERS = int(os.getenv("IMPORT_PARSE_WORKERS", "0")) or (os.cpu_count() or 1)
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+BLOCK_BYTES = 2 * 1024 * 1024
+# Validation à blanc : nombre d'erreurs / pièces / comptes détaillés dans le rapport
+DRY_RUN_MAX_ITEMS = 500
+
+# progress(phase, lignes analysées, lignes insérées)
+Progress = Callable[[str, int, int], None]
+
+REQUIRED_COLUMNS = {
+    "jnl", "accnum", "acclib", "date", "lib", "pieceRef",
+    "debit", "credit", "pieceDate", "validDate", "montant", "iDevise"
+}
+
+_amount_clean_re = re.compile(r"[\s\u00A0]\s*")
+_simple_amount_re = re.compile(r"(\d+)(?:[.,](\d{1,2}))?")
+
+# ---- parsing ----
+
+def to_minor(d: Decimal | int | str | float) -> int:
+    d = Decimal(str(d)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    return int((d * 100).to_integral_value())
+
+def parse_amount(s: str) -> Decimal:
+    s = s.strip()
+    s = _amount_clean_re.sub("", s)
+    s = s.replace("\u00A0", "").replace(" ", "")
+    s = s.replace(",", ".")
+    return Decimal(s)
+
+def parse_amount_minor(s: str) -> int:
+    """
+    Équivalent de to_minor(parse_amount(s)) : voie rapide en entiers pour les
+    montants simples ('1234', '1234,5', '1234.56'), Decimal sinon.
+    """
+    m = _simple_amount_re.fullmatch(s.strip())
+    if m:
+        cents = m.group(2) or "0"
+        return int(m.group(1)) * 100 + int(cents.ljust(2, "0"))
+    return to_minor(parse_amount(s))
+
+@lru_cache(maxsize=8192)
+def parse_date(s: str):
+    # mémoïsé : un grand livre ne compte que quelques centaines de dates distinctes
+    s = s.strip()
+    if "/" in s:
+        return datetime.strptime(s, "%d/%m/%Y").date()
+    return datetime.strptime(s, "%Y-%m-%d").date()
+
+# ---- résolution comptes / journaux (ensemblistes) ----
+
+def _chunks(it: Iterable, size: int):
+    it = iter(it)
+    while True:
+        part = list(islice(it, size))
+        if not part:
+            return
+        yield part
+
+def resolve_accounts(db: Session, client_id: int, accounts: dict[str, str]) -> dict[str, int]:
+    """
+    Retourne {accnum: account_id} pour tous les comptes demandés.
+    Les comptes absents sont créés en une seule passe (acclib fourni, sinon accnum) ;
+    un compte existant n'est jamais modifié.
+    """
+    ids: dict[str, int] = {}
+    for part in _chunks(accounts.keys(), IN_CHUNK_SIZE):
+        ids.update(db.execute(
+            select(Account.accnum, Account.id).where(Account.client_id == client_id, Account.accnum.in_(part))
+        ).all())
+
+    missing = [a for a in accounts if a not in ids]
+    if missing:
+        db.execute(Account.__table__.insert(), [
+            {"client_id": client_id, "accnum": a, "acclib": accounts[a] or a} for a in missing
+        ])
+        for part in _chunks(missing, IN_CHUNK_SIZE):
+            ids.update(db.execute(
+                select(Account.accnum, Account.id).where(Account.client_id == client_id, Account.accnum.in_(part))
+            ).all())
+    return ids
+
+def resolve_journals(db: Session, client_id: int, journals: dict[str, str | None]) -> None:
+    """Crée en une passe les journaux absents (jnl_lib fourni, sinon jnl)."""
+    existing: set[str] = set()
+    for part in _chunks(journals.keys(), IN_CHUNK_SIZE):
+        existing.update(db.execute(
+            select(Journal.jnl).where(Journal.client_id == client_id, Journal.jnl.in_(part))
+        ).scalars())
+
+    missing = [j for j in journals if j not in existing]
+    if missing:
+        db.execute(Journal.__table__.insert(), [
+            {"client_id": client_id, "jnl": j, "jnl_lib": journals[j] or j} for j in missing
+        ])
+        # le centralisateur de chaque exercice du client liste tous ses journaux
+        bump_data_version(db, client_id=client_id)
+
+# ---- insertion ----
+
+_ENTRY_COLUMNS = (
+    "exercice_id", "date", "jnl", "piece_ref", "account_id", "lib", "debit_minor", "credit_minor",
+    "piece_date", "valid_date", "montant_minor", "i_devise", "fingerprint", "batch_id",
+)
+
+def _sqlite_entry_params(rows: list[dict]) -> list[tuple]:
+    # Ordre de _ENTRY_COLUMNS ; dates stockées comme le type Date de SQLAlchemy sous SQLite ('YYYY-MM-DD')
+    return [
+        (
+            r["exercice_id"], r["date"].isoformat(), r["jnl"], r["piece_ref"], r["account_id"], r["lib"],
+            r["debit_minor"], r["credit_minor"], r["piece_date"].isoformat(), r["valid_date"].isoformat(),
+            r["montant_minor"], r["i_devise"], r["fingerprint"], r["batch_id"],
+        )
+        for r in rows
+    ]
+
+def insert_entries(db: Session, rows: Iterable[dict], chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Insère des lignes déjà normalisées (clés = colonnes de `entries`) via
+    un executemany par lots de `chunk_size`. Retourne le nombre de lignes.
+    Sous SQLite, les paramètres sont passés directement au driver (sans
+    traitement de type ligne à ligne côté SQLAlchemy) et les index de
+    recherche sont alimentés par lot (voir search). Les cumuls (voir
+    balances) sont mis à jour une fois pour tous les lots.
+    """
+    n = 0
+    deltas = balances.new_deltas()
+    table = Entry.__table__
+    conn = db.connection()
+    if conn.dialect.name == "sqlite":
+        sql = f"INSERT INTO {table.name} ({', '.join(_ENTRY_COLUMNS)}) VALUES ({', '.join('?' * len(_ENTRY_COLUMNS))})"
+        for part in _chunks(rows, chunk_size):
+            last_id = conn.exec_driver_sql(f"SELECT max(id) FROM {table.name}").scalar() or 0
+            conn.exec_driver_sql(sql, _sqlite_entry_params(part))
+            index_bulk_inserted(conn, last_id)
+            balances.row_deltas(part, deltas)
+            n += len(part)
+    else:
+        for part in _chunks(rows, chunk_size):
+            db.execute(table.insert(), part)
+            balances.row_deltas(part, deltas)
+            n += len(part)
+    balances.apply(db, deltas)
+    return n
+
+class ImportTimer:
+    """Mesure le débit d'un import (lignes/seconde)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+
+    def stats(self, rows: int) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "rows": rows,
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": int(rows / elapsed) if elapsed > 0 else rows,
+        }
+
+
+# ---- import CSV en flux ----
+
+class _DefaultDialect(csv.excel):
+    delimiter = "\t"  # par défaut FR
+
+def _sniff_dialect(binary: BinaryIO, encoding: str):
+    """Détecte le dialecte sur les 10 premières lignes ; lève UnicodeDecodeError si l'encodage ne convient pas."""
+    binary.seek(0)
+    head = codecs.getincrementaldecoder(encoding)().decode(binary.read(HEAD_SAMPLE_BYTES), final=False)
+    if not head.strip() and not binary.read(1):
+        raise ValidationError("Fichier vide")
+    sample = "\n".join(head.splitlines()[:10])
+    try:
+        return csv.Sniffer().sniff(sample)
+    except Exception:
+        return _DefaultDialect
+
+def _cell(row: dict, key: str) -> str:
+    return (row.get(key) or "").strip()
+
+class ExerciceBounds(NamedTuple):
+    """Ce dont _normalize_row a besoin d'un Exercice (picklable pour les workers)."""
+    id: int
+    date_start: date
+    date_end: date
+
+def _normalize_row(row: dict, i: int, ex: Exercice | ExerciceBounds) -> dict:
+    """Parse + normalise une ligne CSV (numéro de ligne `i`) ; lève ValidationError."""
+    try:
+        jnl = _cell(row, "jnl")
+        accnum = _cell(row, "accnum")
+        acclib = _cell(row, "acclib") or accnum
+
+        date_obj = parse_date(_cell(row, "date"))
+        # logique hors-exercice: JNL="DATE" et date remplacée
+        if not (ex.date_start <= date_obj <= ex.date_end):
+            date_obj = parse_date("1/1/2022")
+            jnl = "DATE"
+
+        lib = _cell(row, "lib")
+        piece_ref = _cell(row, "pieceRef")
+
+        debit = parse_amount_minor(_cell(row, "debit") or "0")
+        credit = parse_amount_minor(_cell(row, "credit") or "0")
+
+        piece_date_raw = _cell(row, "pieceDate")
+        valid_date_raw = _cell(row, "validDate")
+        piece_date = parse_date(piece_date_raw) if piece_date_raw else date_obj
+        valid_date = parse_date(valid_date_raw) if valid_date_raw else date_obj
+        if jnl == "AN":
+            piece_date = ex.date_start
+            valid_date = ex.date_start
+
+        montant_raw = _cell(row, "montant")
+        montant = parse_amount_minor(montant_raw) if montant_raw else None
+
+        i_devise = _cell(row, "iDevise") or None
+    except Exception as e:
+        raise ValidationError(f"Erreur parsing ligne {i}: {e}", "parse", i)
+
+    if debit < 0 or credit < 0:
+        raise ValidationError(f"Ligne {i}: montants négatifs interdits", "negative", i)
+    if (debit != 0 and credit != 0) or (debit == 0 and credit == 0):
+        raise ValidationError(f"Ligne {i}: chaque ligne doit avoir soit un débit soit un crédit (exclusif)", "one_side", i)
+
+    return {
+        "exercice_id": ex.id,
+        "date": date_obj,
+        "jnl": jnl,
+        "piece_ref": piece_ref,
+        "accnum": accnum,
+        "acclib": acclib,
+        "lib": lib,
+        "debit_minor": debit,
+        "credit_minor": credit,
+        "piece_date": piece_date,
+        "valid_date": valid_date,
+        "montant_minor": montant,
+        "i_devise": i_devise,
+    }
+
+def _check_columns(fieldnames: list[str]) -> list[str]:
+    fieldnames = [(h or "").strip() for h in fieldnames]
+    missing = REQUIRED_COLUMNS - set(fieldnames)
+    if missing:
+        raise ValidationError(f"Colonnes manquantes: {', '.join(sorted(missing))}", "missing_columns")
+    return fieldnames
+
+def _iter_csv_chunks(binary: BinaryIO, encoding: str, ex: Exercice, chunk_size: int, dialect):
+    """Décode le flux binaire au fil de l'eau et produit des lots de lignes normalisées."""
+    binary.seek(0)
+    text = io.TextIOWrapper(binary, encoding=encoding, newline="")
+    try:
+        reader = csv.DictReader(text, dialect=dialect)
+        reader.fieldnames = _check_columns(reader.fieldnames or [])
+
+        bounds = ExerciceBounds(ex.id, ex.date_start, ex.date_end)
+        chunk: list[dict] = []
+        for row in reader:
+            # ligne physique (comme parse_block) : lignes vides et champs multilignes comptent
+            chunk.append(_normalize_row(row, reader.line_num, bounds))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        text.detach()  # ne pas fermer le fichier sous-jacent
+
+# ---- parsing parallèle ----
+
+_TEXT_COLUMNS = ("jnl", "accnum", "acclib", "lib", "piece_ref", "i_devise", "montant_minor")
+_INT_COLUMNS = ("debit_minor", "credit_minor", "line")
+_DATE_COLUMNS = ("date", "piece_date", "valid_date")
+
+def _dialect_kwargs(dialect) -> dict:
+    # les dialectes produits par Sniffer ne sont pas picklables : on passe leurs attributs
+    return {k: getattr(dialect, k) for k in (
+        "delimiter", "quotechar", "escapechar", "doublequote", "skipinitialspace", "quoting",
+    ) if hasattr(dialect, k)}
+
+def parse_block(block: bytes, first_line: int, encoding: str, dialect_kw: dict,
+                fieldnames: list[str], bounds: ExerciceBounds, keep_errors: int = 0) -> dict:
+    """
+    Worker : parse un bloc de lignes complètes en colonnes compactes (montants en
+    centimes dans des array('q'), dates en ordinaux dans des array('l'), numéro
+    de ligne d'origine dans `line`).
+    keep_errors=0 : arrêt à la première erreur (import). Sinon le bloc est parsé
+    en entier, les lignes fautives sont écartées, `error_count` les compte toutes
+    et `errors` garde les `keep_errors` premières (line, code, message).
+    """
+    cols: dict = {k: [] for k in _TEXT_COLUMNS}
+    cols.update({k: array("q") for k in _INT_COLUMNS})
+    cols.update({k: array("l") for k in _DATE_COLUMNS})
+    errors: list[tuple] = []
+    error_count = 0
+    reader = csv.reader(io.StringIO(block.decode(encoding), newline=""), **dialect_kw)
+    for fields in reader:
+        if not fields:
+            continue
+        line = first_line + reader.line_num - 1
+        try:
+            r = _normalize_row(dict(zip(fieldnames, fields)), line, bounds)
+        except ValidationError as e:
+            error_count += 1
+            if len(errors) < max(keep_errors, 1):
+                errors.append((e.line, e.code, str(e)))
+            if not keep_errors:
+                break
+            continue
+        r["line"] = line
+        for k in _TEXT_COLUMNS:
+            cols[k].append(r[k])
+        for k in _INT_COLUMNS:
+            cols[k].append(r[k])
+        for k in _DATE_COLUMNS:
+            cols[k].append(r[k].toordinal())
+    return {"n": len(cols["debit_minor"]), "cols": cols, "errors": errors, "error_count": error_count}
+
+def _block_rows(result: dict, exercice_id: int) -> list[dict]:
+    """Fusion côté processus principal : colonnes -> lignes normalisées."""
+    c = result["cols"]
+    fromordinal = date.fromordinal
+    rows = [
+        {
+            "exercice_id": exercice_id,
+            "date": fromordinal(c["date"][k]),
+            "jnl": c["jnl"][k],
+            "piece_ref": c["piece_ref"][k],
+            "accnum": c["accnum"][k],
+            "acclib": c["acclib"][k],
+            "lib": c["lib"][k],
+            "debit_minor": c["debit_minor"][k],
+            "credit_minor": c["credit_minor"][k],
+            "piece_date": fromordinal(c["piece_date"][k]),
+            "valid_date": fromordinal(c["valid_date"][k]),
+            "montant_minor": c["montant_minor"][k],
+            "i_devise": c["i_devise"][k],
+        }
+        for k in range(result["n"])
+    ]
+    if result["errors"]:
+        line, code, message = result["errors"][0]
+        raise ValidationError(message, code, line)
+    return rows
+
+_parse_pool: ProcessPoolExecutor | None = None
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        # spawn : pas de fork d'un serveur multi-thread
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _parse_pool
+
+def _iter_blocks(binary: BinaryIO):
+    """Blocs d'environ BLOCK_BYTES, toujours coupés après une fin de ligne."""
+    while True:
+        block = binary.read(BLOCK_BYTES)
+        if not block:
+            return
+        if not block.endswith(b"\n"):
+            block += binary.readline()
+        yield block
+
+def _map_ordered(tasks: Iterable[tuple], parallel: bool):
+    """
+    Applique parse_block à chaque (clé, args) et produit (clé, résultat) dans
+    l'ordre des tâches. En parallèle, une fenêtre bornée de 2×PARSE_WORKERS
+    blocs est en cours dans le pool ; sinon parsing dans le processus courant.
+    """
+    if not parallel:
+        for key, args in tasks:
+            yield key, parse_block(*args)
+        return
+    pool = _get_parse_pool()
+    window: deque = deque()
+    try:
+        for key, args in tasks:
+            window.append((key, pool.submit(parse_block, *args)))
+            if len(window) >= 2 * PARSE_WORKERS:
+                key, fut = window.popleft()
+                yield key, fut.result()
+        while window:
+            key, fut = window.popleft()
+            yield key, fut.result()
+    finally:
+        for _, fut in window:
+            fut.cancel()
+
+def _read_header(binary: BinaryIO, encoding: str, dialect) -> list[str]:
+    binary.seek(0)
+    header = binary.readline()
+    return _check_columns(next(csv.reader([header.decode(encoding)], dialect=dialect), []))
+
+def _block_tasks(binary: BinaryIO, encoding: str, dialect, bounds: ExerciceBounds,
+                 keep_errors: int = 0, key=None, fieldnames: list[str] | None = None):
+    """En-tête contrôlé (sauf si `fieldnames` déjà lus) puis une tâche parse_block par bloc."""
+    if fieldnames is None:
+        fieldnames = _read_header(binary, encoding, dialect)
+    else:
+        binary.seek(0)
+        binary.readline()
+    kw = _dialect_kwargs(dialect)
+    line = 2
+    for block in _iter_blocks(binary):
+        yield key, (block, line, encoding, kw, fieldnames, bounds, keep_errors)
+        line += block.count(b"\n")
+
+def _iter_csv_chunks_parallel(binary: BinaryIO, encoding: str, ex: Exercice, dialect):
+    """
+    Variante parallèle de _iter_csv_chunks : les blocs sont parsés dans le pool
+    et les résultats consommés dans l'ordre du fichier (la première erreur
+    rencontrée reste celle de la plus petite ligne).
+    Suppose un enregistrement par ligne physique (pas de retour chariot entre guillemets).
+    """
+    bounds = ExerciceBounds(ex.id, ex.date_start, ex.date_end)
+    for _, result in _map_ordered(_block_tasks(binary, encoding, dialect, bounds), parallel=True):
+        yield _block_rows(result, ex.id)
+
+def _iter_import_chunks(binary: BinaryIO, encoding: str, ex: Exercice, chunk_size: int, parallel: bool | None):
+    dialect = _sniff_dialect(binary, encoding)
+    if parallel is None:
+        binary.seek(0, io.SEEK_END)
+        parallel = PARSE_WORKERS > 1 and binary.tell() >= PARALLEL_MIN_BYTES
+    if parallel:
+        return _iter_csv_chunks_parallel(binary, encoding, ex, dialect)
+    return _iter_csv_chunks(binary, encoding, ex, chunk_size, dialect)
+
+def _load_chunk(db: Session, ex: Exercice, chunk: list[dict], acc_ids: dict[str, int], known_jnl: set[str],
+                batch_id: int) -> int:
+    """Résout les comptes/journaux encore inconnus du lot puis l'insère."""
+    new_acc: dict[str, str] = {}
+    new_jnl: dict[str, None] = {}
+    for r in chunk:
+        if r["accnum"] not in acc_ids:
+            new_acc.setdefault(r["accnum"], r["acclib"])
+        if r["jnl"] and r["jnl"] not in known_jnl:
+            new_jnl.setdefault(r["jnl"], r.get("jnl_lib"))
+    if new_acc:
+        acc_ids.update(resolve_accounts(db, ex.client_id, new_acc))
+    if new_jnl:
+        resolve_journals(db, ex.client_id, new_jnl)
+        known_jnl.update(new_jnl)
+
+    for r in chunk:
+        r["account_id"] = acc_ids[r.pop("accnum")]
+        r["batch_id"] = batch_id
+        del r["acclib"]
+        r.pop("jnl_lib", None)
+    return insert_entries(db, chunk, chunk_size=len(chunk))
+
+def assign_piece_refs(db: Session, exercice_id: int, chunk: list[dict], open_groups: dict[str, dict]) -> None:
+    """
+    Numérote les lignes sans piece_ref. Dans l'ordre du fichier, les lignes sans
+    référence d'un même journal forment une pièce jusqu'à ce qu'elle s'équilibre
+    (Σdébit = Σcrédit). Les numéros sont réservés en une plage par journal et par
+    lot ; `open_groups` porte les pièces encore ouvertes d'un lot au suivant.
+    Les références explicites "{jnl}-{n}" remontent la séquence.
+    """
+    pending: dict[str, list[dict]] = {}
+    explicit_max: dict[str, int] = {}
+    for r in chunk:
+        jnl = r["jnl"]
+        if r["piece_ref"]:
+            n = ref_number(jnl, r["piece_ref"])
+            if n is not None and n > explicit_max.get(jnl, 0):
+                explicit_max[jnl] = n
+            continue
+        group = open_groups.get(jnl)
+        if group is None:
+            group = open_groups[jnl] = {"ref": None, "delta": 0, "rows": []}
+            pending.setdefault(jnl, []).append(group)
+        if group["ref"] is None:
+            group["rows"].append(r)
+        else:
+            r["piece_ref"] = group["ref"]
+        group["delta"] += r["debit_minor"] - r["credit_minor"]
+        if group["delta"] == 0:
+            del open_groups[jnl]
+
+    for jnl, n in explicit_max.items():
+        bump_sequence(db, exercice_id, jnl, n)
+    for jnl, groups in pending.items():
+        first = reserve_refs(db, exercice_id, jnl, len(groups))
+        for k, group in enumerate(groups):
+            group["ref"] = format_ref(jnl, first + k)
+            for r in group["rows"]:
+                r["piece_ref"] = group["ref"]
+            group["rows"] = []
+
+# ---- empreintes (ré-import idempotent) ----
+
+# Ensemble des empreintes du fichier en cours, pour la suppression des lignes disparues
+_import_fingerprints = Table(
+    "import_fingerprints", MetaData(),
+    Column("fingerprint", String(32), primary_key=True),
+    prefixes=["TEMPORARY"],
+)
+
+def fingerprint_rows(chunk: list[dict], occurrences: dict[bytes, int]) -> None:
+    """
+    Empreinte du contenu normalisé de chaque ligne (avant numérotation des
+    pièces : une référence vide reste vide). `occurrences` compte les lignes
+    identiques sur tout le fichier, pour que des doublons légitimes aient des
+    empreintes distinctes et stables d'un import à l'autre.
+    """
+    blake2b = hashlib.blake2b
+    for r in chunk:
+        content = "\x1f".join((
+            r["jnl"], r["date"].isoformat(), r["piece_ref"], r["accnum"], r["lib"],
+            str(r["debit_minor"]), str(r["credit_minor"]), r["piece_date"].isoformat(),
+            r["valid_date"].isoformat(), str(r["montant_minor"]), str(r["i_devise"]),
+        ))
+        digest = blake2b(content.encode("utf-8"), digest_size=16).digest()
+        n = occurrences.get(digest, 0)
+        occurrences[digest] = n + 1
+        r["fingerprint"] = digest.hex() if n == 0 else blake2b(
+            digest + n.to_bytes(4, "big"), digest_size=16
+        ).hexdigest()
+
+def _existing_fingerprints(db: Session, exercice_id: int, fps: list[str]) -> set[str]:
+    existing: set[str] = set()
+    for part in _chunks(fps, IN_CHUNK_SIZE):
+        existing.update(db.scalars(
+            select(Entry.fingerprint).where(Entry.exercice_id == exercice_id, Entry.fingerprint.in_(part))
+        ))
+    return existing
+
+def _delete_missing(db: Session, exercice_id: int, scopes: set[tuple[str, int, int]]) -> int:
+    """
+    Supprime les lignes importées (empreinte non nulle) des couples
+    (journal, mois) présents dans le fichier mais absentes de celui-ci.
+    """
+    table = Entry.__table__
+    in_file = select(_import_fingerprints.c.fingerprint)
+    deleted = 0
+    for jnl, year, month in sorted(scopes):
+        first = date(year, month, 1)
+        last = date(year, month, calendar.monthrange(year, month)[1])
+        where = (
+            table.c.exercice_id == exercice_id,
+            table.c.jnl == jnl,
+            table.c.date.between(first, last),
+            table.c.fingerprint.is_not(None),
+            table.c.fingerprint.not_in(in_file),
+        )
+        balances.subtract(db, *where)
+        deleted += db.execute(table.delete().where(*where)).rowcount
+    return deleted
+
+# ---- chargement ----
+
+class BatchLoader:
+    """
+    Étape de chargement commune aux formats d'import, dans la transaction
+    courante. Un lot peut couvrir plusieurs fichiers : comptes/journaux résolus
+    une seule fois, un seul HistoryEvent dont l'id est le batch_id des lignes
+    insérées (voir record_import), empreintes calculées sur l'ensemble.
+    Par fichier (load) : contrôle des dates, totaux courants et équilibre,
+    numérotation des pièces, insertion par lots.
+    skip_existing : les lignes dont l'empreinte existe déjà dans l'exercice sont
+    ignorées. delete_missing (implique skip_existing) : à la fin du lot, les
+    lignes importées des (journal, mois) couverts qui n'y figurent plus sont
+    supprimées.
+    """
+
+    def __init__(self, db: Session, ex: Exercice, progress: Progress | None = None,
+                 skip_existing: bool = False, delete_missing: bool = False):
+        self.db = db
+        self.ex = ex
+        self.progress = progress
+        self.skip_existing = skip_existing or delete_missing
+        self.delete_missing = delete_missing
+        self.acc_ids: dict[str, int] = {}
+        self.known_jnl: set[str] = set()
+        self.occurrences: dict[bytes, int] = {}
+        self.scopes: set[tuple[str, int, int]] = set()
+        self.parsed = self.added = self.unchanged = 0
+        self.batch = begin_batch(db, ex.id)
+        if delete_missing:
+            _import_fingerprints.create(db.connection(), checkfirst=True)
+            db.execute(_import_fingerprints.delete())
+
+    def load(self, chunks: Iterable[list[dict]]) -> dict:
+        """
+        Charge un fichier (flux de lots normalisés) ; équilibre vérifié sur tout
+        le fichier, lignes ignorées comprises. Retourne {"rows", "added", "unchanged"}.
+        """
+        db, ex = self.db, self.ex
+        open_groups: dict[str, dict] = {}
+        total_debit = total_credit = 0
+        rows = added = unchanged = 0
+        for chunk in chunks:
+            rows += len(chunk)
+            self.parsed += len(chunk)
+            if self.progress:
+                self.progress("parsing", self.parsed, self.added)
+            ensure_dates_in_exercice(chunk, ex.date_start, ex.date_end)
+            for r in chunk:
+                total_debit += r["debit_minor"]
+                total_credit += r["credit_minor"]
+            fingerprint_rows(chunk, self.occurrences)
+            if self.delete_missing:
+                db.execute(_import_fingerprints.insert(), [{"fingerprint": r["fingerprint"]} for r in chunk])
+                self.scopes.update((r["jnl"], r["date"].year, r["date"].month) for r in chunk)
+            if self.skip_existing:
+                existing = _existing_fingerprints(db, ex.id, [r["fingerprint"] for r in chunk])
+                if existing:
+                    chunk = [r for r in chunk if r["fingerprint"] not in existing]
+                    unchanged += len(existing)
+            if chunk:
+                if self.progress:
+                    self.progress("inserting", self.parsed, self.added)
+                assign_piece_refs(db, ex.id, chunk, open_groups)
+                n = _load_chunk(db, ex, chunk, self.acc_ids, self.known_jnl, self.batch.id)
+                piece_index.note_added(db, ex.id, {r["piece_ref"] for r in chunk})
+                added += n
+                self.added += n
+                if self.progress:
+                    self.progress("inserting", self.parsed, self.added)  # compteur à jour pour le dernier lot
+        ensure_totals_balanced_minor(total_debit, total_credit)
+        self.unchanged += unchanged
+        return {"rows": rows, "added": added, "unchanged": unchanged}
+
+    def finish(self) -> dict:
+        """Suppression des lignes disparues ; retourne {"added", "unchanged", "deleted", "batch_id"}."""
+        deleted = 0
+        if self.delete_missing:
+            deleted = _delete_missing(self.db, self.ex.id, self.scopes)
+            if deleted:
+                piece_index.note_removed(self.db, self.ex.id)
+            _import_fingerprints.drop(self.db.connection())
+        analyze(self.db.connection(), self.added + deleted)
+        return {"added": self.added, "unchanged": self.unchanged, "deleted": deleted, "batch_id": self.batch.id}
+
+def load_chunks(db: Session, ex: Exercice, chunks: Iterable[list[dict]], progress: Progress | None = None,
+                skip_existing: bool = False, delete_missing: bool = False) -> dict:
+    """Charge un fichier comme un lot à lui seul (voir BatchLoader)."""
+    loader = BatchLoader(db, ex, progress, skip_existing, delete_missing)
+    loader.load(chunks)
+    return loader.finish()
+
+def import_stream(db: Session, ex: Exercice, chunks_for: Callable[[str], Iterable[list[dict]]],
+                  progress: Progress | None = None, **options) -> dict:
+    """
+    Charge les lots produits par `chunks_for(encoding)` en essayant utf-8 puis latin-1.
+    Sur UnicodeDecodeError en cours de flux, la transaction est annulée et le
+    fichier rejoué avec l'encodage suivant. `options` : voir load_chunks.
+    """
+    for encoding in ENCODINGS:
+        try:
+            return load_chunks(db, ex, chunks_for(encoding), progress, **options)
+        except UnicodeDecodeError:
+            # des lots ont pu être insérés avant l'octet fautif : on repart de zéro
+            db.rollback()
+            if progress:
+                progress("parsing", 0, 0)
+    raise ValidationError("Encodage du fichier non reconnu")
+
+def import_csv_stream(db: Session, ex: Exercice, binary: BinaryIO, chunk_size: int = CHUNK_SIZE,
+                      progress: Progress | None = None, parallel: bool | None = None, **options) -> dict:
+    """
+    Importe un CSV en flux dans la transaction courante (sans commit) : décodage
+    incrémental (utf-8 puis repli latin-1), validation et insertion par lots,
+    contrôle d'équilibre sur totaux courants. La mémoire reste bornée par
+    `chunk_size` quelle que soit la taille du fichier. `parallel` force (ou
+    interdit) l'étape de parsing multi-processus ; None = selon la taille.
+    `options` : skip_existing / delete_missing (voir load_chunks).
+    Retourne {"added", "unchanged", "deleted", "batch_id"}. Lève ValidationError ;
+    l'appelant doit alors faire un rollback.
+    """
+    return import_stream(
+        db, ex, lambda encoding: _iter_import_chunks(binary, encoding, ex, chunk_size, parallel),
+        progress, **options,
+    )
+
+def detect_encoding(binary: BinaryIO) -> str:
+    """utf-8 si tout le flux se décode, sinon latin-1 (décodage incrémental, sans rien garder)."""
+    binary.seek(0)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        while block := binary.read(BLOCK_BYTES):
+            decoder.decode(block)
+        decoder.decode(b"", final=True)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+def import_csv_files(db: Session, ex: Exercice, files: list[tuple[str, BinaryIO]],
+                     progress: Progress | None = None, parallel: bool | None = None, **options) -> dict:
+    """
+    Importe plusieurs CSV en un seul lot, dans la transaction courante (sans
+    commit). L'encodage de chaque fichier est déterminé avant chargement (pas
+    de rejeu possible en cours de lot), les blocs de tous les fichiers passent
+    par la même fenêtre du pool de parsing, puis chaque fichier est chargé
+    dans l'ordre par un BatchLoader commun. Les erreurs sont préfixées du nom
+    du fichier. Retourne les compteurs du lot et un détail "files" par fichier.
+    """
+    if parallel is None:
+        parallel = PARSE_WORKERS > 1 and len(files) > 1
+    bounds = ExerciceBounds(ex.id, ex.date_start, ex.date_end)
+    prepared = []
+    for name, binary in files:
+        try:
+            encoding = detect_encoding(binary)
+            dialect = _sniff_dialect(binary, encoding)
+            prepared.append((name, binary, encoding, dialect, _read_header(binary, encoding, dialect)))
+        except ValidationError as e:
+            raise ValidationError(f"{name}: {e}", e.code, e.line)
+
+    def tasks():
+        for k, (name, binary, encoding, dialect, fieldnames) in enumerate(prepared):
+            yield from _block_tasks(binary, encoding, dialect, bounds, key=k, fieldnames=fieldnames)
+
+    loader = BatchLoader(db, ex, progress, **options)
+    reports = [{"file": name, "rows": 0, "added": 0, "unchanged": 0} for name, *_ in prepared]
+    for k, results in groupby(_map_ordered(tasks(), parallel), key=lambda t: t[0]):
+        try:
+            reports[k].update(loader.load(_block_rows(result, ex.id) for _, result in results))
+        except ValidationError as e:
+            raise ValidationError(f"{prepared[k][0]}: {e}", e.code, e.line)
+    return {**loader.finish(), "files": reports}
+
+def _iter_dry_run_blocks(binary: BinaryIO, encoding: str, ex: Exercice, parallel: bool | None):
+    """Résultats de parse_block (mode collecte) dans l'ordre du fichier, en pool si gros fichier."""
+    dialect = _sniff_dialect(binary, encoding)
+    if parallel is None:
+        binary.seek(0, io.SEEK_END)
+        parallel = PARSE_WORKERS > 1 and binary.tell() >= PARALLEL_MIN_BYTES
+    bounds = ExerciceBounds(ex.id, ex.date_start, ex.date_end)
+    tasks = _block_tasks(binary, encoding, dialect, bounds, DRY_RUN_MAX_ITEMS)
+    for _, result in _map_ordered(tasks, parallel):
+        yield result
+
+def _known_accnums(db: Session, client_id: int, accnums: Iterable[str]) -> set[str]:
+    known: set[str] = set()
+    for part in _chunks(accnums, IN_CHUNK_SIZE):
+        known.update(db.scalars(
+            select(Account.accnum).where(Account.client_id == client_id, Account.accnum.in_(part))
+        ))
+    return known
+
+def _dry_run_report(db: Session, ex: Exercice, blocks: Iterable[dict]) -> dict:
+    errors: list[dict] = []
+    error_count = invalid_lines = 0
+    lines = total_debit = total_credit = 0
+    pieces: dict[tuple[str, str], int] = {}
+    open_groups: dict[str, int] = {}
+    blank_pieces = 0
+    accnums: set[str] = set()
+    journals: set[str] = set()
+    start, end = ex.date_start.toordinal(), ex.date_end.toordinal()
+
+    def add_error(line, code, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < DRY_RUN_MAX_ITEMS:
+            errors.append({"line": line, "code": code, "message": message})
+
+    for result in blocks:
+        c = result["cols"]
+        error_count += result["error_count"] - len(result["errors"])
+        for line, code, message in result["errors"]:
+            add_error(line, code, message)
+        lines += result["n"] + result["error_count"]
+        invalid_lines += result["error_count"]
+
+        # colonnes : contrôles agrégés sans repasser par des dicts de lignes
+        debit, credit = c["debit_minor"], c["credit_minor"]
+        total_debit += sum(debit)
+        total_credit += sum(credit)
+        accnums.update(c["accnum"])
+        journals.update(c["jnl"])
+        for k, d in enumerate(c["date"]):
+            if not (start <= d <= end):
+                invalid_lines += 1
+                add_error(c["line"][k], "date_out_of_range",
+                          f"Ligne {c['line'][k]}: date hors exercice: {date.fromordinal(d)} "
+                          f"(attendu {ex.date_start}..{ex.date_end})")
+        for jnl, ref, d, cr in zip(c["jnl"], c["piece_ref"], debit, credit):
+            if ref:
+                key = (jnl, ref)
+                pieces[key] = pieces.get(key, 0) + d - cr
+            else:
+                # même regroupement que assign_piece_refs
+                delta = open_groups.get(jnl, 0) + d - cr
+                if jnl not in open_groups:
+                    blank_pieces += 1
+                if delta:
+                    open_groups[jnl] = delta
+                else:
+                    open_groups.pop(jnl, None)
+
+    if total_debit != total_credit:
+        add_error(None, "batch_unbalanced", f"Lot non équilibré (Δ={total_debit - total_credit} cents)")
+
+    unbalanced = [
+        {"jnl": jnl, "piece_ref": ref, "delta_minor": delta}
+        for (jnl, ref), delta in pieces.items() if delta
+    ]
+    unbalanced += [
+        {"jnl": jnl, "piece_ref": None, "delta_minor": delta}
+        for jnl, delta in open_groups.items()
+    ]
+    unknown = sorted(accnums - _known_accnums(db, ex.client_id, accnums))
+    return {
+        "dry_run": True,
+        "valid": error_count == 0,
+        "summary": {
+            "lines": lines,
+            "invalid_lines": invalid_lines,
+            "errors": error_count,
+            "total_debit_minor": total_debit,
+            "total_credit_minor": total_credit,
+            "delta_minor": total_debit - total_credit,
+            "pieces": len(pieces) + blank_pieces,
+            "unbalanced_pieces": len(unbalanced),
+            "accounts": len(accnums),
+            "unknown_accounts": len(unknown),
+            "journals": len(journals),
+        },
+        "errors": errors,
+        "unbalanced_pieces": unbalanced[:DRY_RUN_MAX_ITEMS],
+        "unknown_accounts": unknown[:DRY_RUN_MAX_ITEMS],
+    }
+
+def validate_csv_stream(db: Session, ex: Exercice, binary: BinaryIO, parallel: bool | None = None) -> dict:
+    """
+    Validation à blanc d'un CSV : une passe complète en colonnes, sans écriture.
+    Toutes les erreurs sont collectées (détail borné à DRY_RUN_MAX_ITEMS) avec
+    ligne, code et message : parsing, montants, dates hors exercice, équilibre
+    du lot ; plus les pièces déséquilibrées et les comptes qui seraient créés.
+    Les erreurs bloquantes (fichier vide, colonnes manquantes, encodage) lèvent
+    ValidationError comme à l'import.
+    """
+    for encoding in ENCODINGS:
+        try:
+            return _dry_run_report(db, ex, _iter_dry_run_blocks(binary, encoding, ex, parallel))
+        except UnicodeDecodeError:
+            continue
+    raise ValidationError("Encodage du fichier non reconnu")
+
+def record_import(db: Session, counts: dict, description: str | None = None) -> HistoryEvent:
+    """Complète le HistoryEvent du lot (sans commit) ; `counts` tel que retourné par load_chunks."""
+    added, unchanged, deleted = counts["added"], counts["unchanged"], counts["deleted"]
+    he = db.get(HistoryEvent, counts["batch_id"])
+    he.description = description or f"Importer {added} écritures"
+    he.counts_json = f'{{"added":{added},"unchanged":{unchanged},"deleted":{deleted}}}'
+    return he
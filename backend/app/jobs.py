@@ -0,0 +1,114 @@
+"""
+Imports en tâche de fond : le fichier est copié sur disque, un pool de threads
+exécute l'import avec sa propre session, et l'état est consultable par id.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os, threading, time, uuid
+
+from .crud import get_exercice, list_unbalanced_pieces
+from .database import SessionLocal
+from .importer import ImportTimer, import_csv_stream, record_import
+from .validators import ValidationError
+
+# SQLite sérialise les écritures : un worker par défaut
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "1"))
+# Durée de rétention des jobs terminés (secondes)
+JOB_TTL = 3600
+
+_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="import")
+_jobs: dict[str, "ImportJob"] = {}
+_lock = threading.Lock()
+
+
+class ImportJob:
+    def __init__(self, exercice_id: int, path: str, filename: str | None, options: dict | None = None):
+        self.id = uuid.uuid4().hex
+        self.exercice_id = exercice_id
+        self.path = path
+        self.filename = filename
+        self.options = options or {}  # skip_existing / delete_missing
+        self.phase = "queued"  # queued -> parsing/inserting -> finalizing -> done | failed
+        self.rows_parsed = 0
+        self.rows_inserted = 0
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.result: dict | None = None
+        self.error: str | None = None
+
+    def progress(self, phase: str, parsed: int, inserted: int):
+        self.phase = phase
+        self.rows_parsed = parsed
+        self.rows_inserted = inserted
+
+    def snapshot(self) -> dict:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "id": self.id,
+            "exercice_id": self.exercice_id,
+            "filename": self.filename,
+            "phase": self.phase,
+            "rows_parsed": self.rows_parsed,
+            "rows_inserted": self.rows_inserted,
+            "elapsed_seconds": round(elapsed, 3) if elapsed is not None else None,
+            "rows_per_sec": int(self.rows_inserted / elapsed) if elapsed else 0,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+def _run(job: ImportJob):
+    job.started_at = time.time()
+    job.phase = "parsing"
+    timer = ImportTimer()
+    db = SessionLocal()
+    try:
+        ex = get_exercice(db, job.exercice_id)
+        with open(job.path, "rb") as f:
+            counts = import_csv_stream(db, ex, f, progress=job.progress, **job.options)
+        job.phase = "finalizing"
+        record_import(db, counts)
+        db.commit()
+        warnings = {"unbalanced_pieces": list_unbalanced_pieces(db, job.exercice_id, limit=50)}
+        job.result = {**counts, "warnings": warnings, "stats": timer.stats(counts["added"] + counts["unchanged"])}
+        job.phase = "done"
+    except (ValidationError, ValueError) as e:
+        db.rollback()
+        job.error = str(e)
+        job.phase = "failed"
+        job.rows_inserted = 0  # transaction annulée
+    except Exception as e:
+        db.rollback()
+        job.error = f"Erreur lors de l'insertion: {e}"
+        job.phase = "failed"
+        job.rows_inserted = 0
+    finally:
+        db.close()
+        job.finished_at = time.time()
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+
+def _prune():
+    limit = time.time() - JOB_TTL
+    for job_id in [j.id for j in _jobs.values() if j.finished_at and j.finished_at < limit]:
+        del _jobs[job_id]
+
+
+def submit_import(exercice_id: int, path: str, filename: str | None, **options) -> ImportJob:
+    """Enregistre le job et le confie au pool ; `path` est supprimé à la fin."""
+    job = ImportJob(exercice_id, path, filename, options)
+    with _lock:
+        _prune()
+        _jobs[job.id] = job
+    _executor.submit(_run, job)
+    return job
+
+
+def get_job(job_id: str) -> ImportJob | None:
+    with _lock:
+        return _jobs.get(job_id)
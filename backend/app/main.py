@@ -1,12 +1,14 @@
 from fastapi import FastAPI
 from .database import Base, engine
+from .migrations import upgrade
 from .routers import entries, balance, piece, imports, checks, accounts, journals, clients, exercices, history, fec, chart, centralisateur
 
 app = FastAPI(title="Compta MVP")
 
-# Créer les tables
+# Créer les tables (+ colonnes/index ajoutés depuis sur une base existante)
 def init_db():
     Base.metadata.create_all(bind=engine)
+    upgrade(engine)
 
 init_db()
 
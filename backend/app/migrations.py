@@ -0,0 +1,54 @@
+"""
+Mise à niveau du schéma d'une base existante : create_all crée les tables
+manquantes mais pas les colonnes ni les index ajoutés aux modèles depuis,
+ni ne supprime les index retirés.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
+
+from .database import Base
+from . import balances, search
+
+
+# Index retirés des modèles (à supprimer des bases existantes)
+OBSOLETE_INDEXES = (
+    # remplacés par les index (exercice_id, clé, id) de la grille ; toutes les
+    # requêtes sont bornées à un exercice, et chaque index ralentit les imports
+    "ix_entries_date", "ix_entries_jnl", "ix_entries_piece_ref", "ix_entries_valid_date",
+)
+
+
+def _add_missing_columns(conn):
+    # Uniquement des colonnes nullables : pas de valeur par défaut à reporter
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in existing:
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(conn.dialect)}"
+                )
+
+
+def _create_missing_indexes(conn):
+    # IF NOT EXISTS plutôt que checkfirst : la réflexion ignore les index d'expression
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _drop_obsolete_indexes(conn):
+    for name in OBSOLETE_INDEXES:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+
+def upgrade(engine: Engine):
+    with engine.begin() as conn:
+        _add_missing_columns(conn)
+        _drop_obsolete_indexes(conn)
+        _create_missing_indexes(conn)
+        search.install(conn)
+        balances.install(conn)
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Integer, String, Date, ForeignKey, UniqueConstraint, DateTime, func
+from sqlalchemy import Integer, String, Date, ForeignKey, Index, UniqueConstraint, DateTime, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .database import Base
 
@@ -30,6 +30,8 @@ class Exercice(Base):
     date_start: Mapped[datetime.date] = mapped_column(Date, nullable=False)
     date_end: Mapped[datetime.date] = mapped_column(Date, nullable=False)
     status: Mapped[str] = mapped_column(String(16), default="OPEN")
+    # Incrémentée par chaque écriture touchant l'exercice (voir crud.bump_data_version)
+    data_version: Mapped[int | None] = mapped_column(Integer, nullable=True, default=0)
 
     client: Mapped["Client"] = relationship(back_populates="exercices")
 
@@ -75,24 +77,62 @@ class JournalSequence(Base):
 
 class Entry(Base):
     __tablename__ = "entries"
+    __table_args__ = (
+        Index("ix_entries_ex_fingerprint", "exercice_id", "fingerprint"),
+        # pagination par curseur de la grille : un index (exercice_id, clé de tri, id) par
+        # tri proposé, la page se lit dans l'index sans tri préalable (aussi utilisé
+        # par les suggestions de pièces). Tri par id : ix_entries_exercice_id, qui
+        # sous SQLite se termine implicitement par le rowid.
+        Index("ix_entries_ex_date", "exercice_id", "date", "id"),
+        Index("ix_entries_ex_jnl", "exercice_id", "jnl", "id"),
+        Index("ix_entries_ex_piece_ref", "exercice_id", "piece_ref", "id"),
+        Index("ix_entries_ex_debit", "exercice_id", "debit_minor", "id"),
+        Index("ix_entries_ex_credit", "exercice_id", "credit_minor", "id"),
+        # tri par compte : écritures d'un compte par id, comptes parcourus dans l'ordre de accnum
+        Index("ix_entries_ex_account", "exercice_id", "account_id", "id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     exercice_id: Mapped[int] = mapped_column(ForeignKey("exercices.id", ondelete="CASCADE"), nullable=False, index=True)
-    date: Mapped[datetime.date] = mapped_column(Date, nullable=False, index=True)
-    jnl: Mapped[str] = mapped_column(String(32), nullable=False, index=True)
-    piece_ref: Mapped[str] = mapped_column(String(128), nullable=False, index=True)
+    date: Mapped[datetime.date] = mapped_column(Date, nullable=False)
+    jnl: Mapped[str] = mapped_column(String(32), nullable=False)
+    piece_ref: Mapped[str] = mapped_column(String(128), nullable=False)
     account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"), nullable=False, index=True)
     lib: Mapped[str] = mapped_column(String(255), nullable=False)
     debit_minor: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     credit_minor: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
 
     piece_date: Mapped[datetime.date] = mapped_column(Date, nullable=False)
-    valid_date: Mapped[datetime.date] = mapped_column(Date, nullable=False, index=True)
+    valid_date: Mapped[datetime.date] = mapped_column(Date, nullable=False)
     montant_minor: Mapped[int] = mapped_column(Integer, nullable=True)
     i_devise: Mapped[str] = mapped_column(String(32), nullable=True)
+    # Empreinte du contenu des lignes importées (NULL pour la saisie manuelle)
+    fingerprint: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    # Lot d'origine = id du HistoryEvent (import, AN, saisie de pièce)
+    batch_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
 
     exercice: Mapped["Exercice"] = relationship(back_populates="entries")
     account: Mapped["Account"] = relationship(back_populates="entries")
 
+class AccountBalance(Base):
+    """Cumuls des écritures d'un compte sur un exercice, tenus à jour à chaque écriture (voir balances)."""
+    __tablename__ = "account_balances"
+    exercice_id: Mapped[int] = mapped_column(ForeignKey("exercices.id", ondelete="CASCADE"), primary_key=True)
+    account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    debit_minor: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    credit_minor: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+class MonthlyRollup(Base):
+    """Cumuls par exercice, mois ("YYYY-MM"), journal et compte, tenus à jour à chaque écriture (voir balances)."""
+    __tablename__ = "monthly_rollups"
+    exercice_id: Mapped[int] = mapped_column(ForeignKey("exercices.id", ondelete="CASCADE"), primary_key=True)
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)
+    jnl: Mapped[str] = mapped_column(String(32), primary_key=True)
+    account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    debit_minor: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    credit_minor: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
 class HistoryEvent(Base):
     __tablename__ = "history_events"
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -102,3 +142,7 @@ class HistoryEvent(Base):
     counts_json: Mapped[str | None] = mapped_column(String(2048), nullable=True)
 
     exercice: Mapped["Exercice"] = relationship(back_populates="history_events")
+
+
+# Recherche par montant (routers/entries) : égalités / plages sur |débit - crédit| par exercice
+Index("ix_entries_ex_amount", Entry.exercice_id, func.abs(Entry.debit_minor - Entry.credit_minor))
@@ -0,0 +1,171 @@
+"""
+Autocomplétion des références de pièce en mémoire (GET /api/entries/suggest-piece).
+
+Par exercice : la liste triée des piece_ref distinctes et, pour la recherche
+"contient", ces mêmes références concaténées en minuscules dans un seul buffer
+(séparateur \\x00) avec la position de départ de chacune. Une recherche est un
+str.find sur le buffer (boucle C) : les occurrences sortent dans l'ordre du tri,
+on s'arrête dès `limit` références trouvées.
+
+- Construit à la première demande (un SELECT DISTINCT sur ix_entries_ex_piece_ref).
+- Associé à Exercice.data_version : toute écriture non suivie ici invalide
+  l'index, reconstruit à la demande suivante.
+- Les saisies de pièce et les imports déclarent les références ajoutées
+  (note_added) : appliquées au commit, sans relecture, si l'index était à jour.
+  Les suppressions (note_removed, annulation, suppression de mois...) invalident.
+- Au plus MAX_EXERCICES index gardés (LRU).
+
+Mêmes résultats que la requête SQL (ILIKE '%q%', GROUP BY / ORDER BY piece_ref,
+limit) sous SQLite : tri binaire, casse ignorée sur l'ASCII seulement. Les
+motifs contenant % ou _ (jokers LIKE) et les autres bases restent en SQL.
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+from heapq import merge
+from itertools import accumulate, islice
+import threading
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from .models import Exercice
+
+# Exercices gardés en mémoire (LRU)
+MAX_EXERCICES = 16
+# Références ajoutées gardées à part avant de refondre le buffer
+MAX_PENDING = 1024
+
+_SEP = "\x00"
+# lower() de SQLite (sans ICU) : A-Z seulement
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def fold(s: str) -> str:
+    return s.lower() if s.isascii() else s.translate(_ASCII_LOWER)
+
+
+class PieceRefIndex:
+    def __init__(self, refs: list[str], version: int):
+        self.version = version
+        self.has_blank = "" in refs  # groupe '' : occupe une place du limit puis est écarté
+        self._set_refs([r for r in refs if r])
+        self.pending: list[str] = []  # ajouts triés, hors buffer
+
+    def _set_refs(self, refs: list[str]):
+        self.refs = refs
+        self.known = set(refs)
+        self.blob = fold(_SEP.join(refs))
+        self.starts = [0, *accumulate(len(r) + 1 for r in refs[:-1])] if refs else []
+
+    def add(self, refs):
+        new = sorted({r for r in refs if r and r not in self.known} - set(self.pending))
+        if "" in refs:
+            self.has_blank = True
+        if not new:
+            return
+        self.pending = list(merge(self.pending, new))
+        if len(self.pending) > MAX_PENDING:
+            self._set_refs(list(merge(self.refs, self.pending)))
+            self.pending = []
+
+    def _find(self, needle: str):
+        blob, starts, refs = self.blob, self.starts, self.refs
+        pos = 0
+        while (hit := blob.find(needle, pos)) >= 0:
+            i = bisect_right(starts, hit) - 1
+            yield refs[i]
+            if i + 1 == len(starts):
+                return
+            pos = starts[i + 1]
+
+    def search(self, q: str, limit: int) -> list[str]:
+        if not q:
+            if self.has_blank:
+                limit -= 1
+            return list(islice(merge(self.refs, self.pending), max(limit, 0)))
+        needle = fold(q)
+        pending = (r for r in self.pending if needle in fold(r))
+        return list(islice(merge(self._find(needle), pending), limit))
+
+
+_lock = threading.Lock()
+_cache: OrderedDict[int, PieceRefIndex] = OrderedDict()
+
+
+def _build(db: Session, exercice_id: int, version: int) -> PieceRefIndex:
+    # curseur DBAPI : sans objets Row, deux fois plus rapide sur des centaines de milliers de références
+    cur = db.connection().connection.cursor()
+    try:
+        cur.execute("SELECT DISTINCT piece_ref FROM entries WHERE exercice_id = ?", (exercice_id,))
+        refs = sorted(r for (r,) in cur)
+    finally:
+        cur.close()
+    return PieceRefIndex(refs, version)
+
+
+def suggest(db: Session, exercice_id: int, q: str, limit: int) -> list[str] | None:
+    """Références contenant q, triées, au plus `limit` ; None : passer par SQL."""
+    if db.get_bind().dialect.name != "sqlite" or "%" in q or "_" in q or _SEP in q:
+        return None
+    version = db.execute(select(Exercice.data_version).where(Exercice.id == exercice_id)).first()
+    if version is None:
+        return None
+    version = version[0] or 0
+    with _lock:
+        idx = _cache.get(exercice_id)
+        if idx is not None and idx.version == version:
+            _cache.move_to_end(exercice_id)
+            return idx.search(q, limit)
+    idx = _build(db, exercice_id, version)
+    with _lock:
+        _cache[exercice_id] = idx
+        _cache.move_to_end(exercice_id)
+        while len(_cache) > MAX_EXERCICES:
+            _cache.popitem(last=False)
+        return idx.search(q, limit)
+
+
+# ---- Suivi des écritures (par transaction, dans session.info) ----
+
+def note_versions(db: Session, rows):
+    """[(exercice_id, nouvelle version)] : appelé par crud.bump_data_version."""
+    versions = db.info.setdefault("data_versions", {})
+    for exercice_id, version in rows:
+        versions.setdefault(exercice_id, [version - 1, version])[1] = version
+
+
+def note_added(db: Session, exercice_id: int, refs):
+    """Références de pièce insérées dans la transaction courante."""
+    db.info.setdefault("piece_refs_added", {}).setdefault(exercice_id, set()).update(refs)
+
+
+def note_removed(db: Session, exercice_id: int):
+    """Des lignes ont été supprimées : l'index sera reconstruit."""
+    db.info.setdefault("piece_refs_removed", set()).add(exercice_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session: Session):
+    added = session.info.get("piece_refs_added")
+    if not added:
+        return
+    versions = session.info.get("data_versions", {})
+    removed = session.info.get("piece_refs_removed", set())
+    with _lock:
+        for exercice_id, refs in added.items():
+            idx = _cache.get(exercice_id)
+            if idx is None or exercice_id not in versions:
+                continue
+            before, after = versions[exercice_id]
+            if exercice_id in removed or idx.version != before:
+                del _cache[exercice_id]
+                continue
+            idx.add(refs)
+            idx.version = after
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _after_transaction_end(session: Session, transaction):
+    if transaction.parent is None:
+        for key in ("data_versions", "piece_refs_added", "piece_refs_removed"):
+            session.info.pop(key, None)
@@ -0,0 +1,105 @@
+"""
+Réponses JSON rapides des listes (grille, balance, comptes, journaux) : les
+tuples SQL sont sérialisés directement (orjson si disponible), sans instancier
+de modèle Pydantic ni revalider contre response_model, qui reste la
+documentation de l'API. Compression négociée sur Accept-Encoding : br (si le
+module brotli est installé) puis gzip.
+Les lectures d'un exercice portent un ETag tiré de sa version de données
+(Exercice.data_version) : If-None-Match -> 304 sans calcul.
+orjson et brotli sont optionnels : pip install 'compta-mvp[fast]'.
+"""
+from datetime import date, datetime
+from typing import Iterable, Literal, Sequence
+import gzip, json
+
+from fastapi import Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import Exercice
+
+try:
+    import orjson
+except ImportError:  # dépendance optionnelle
+    orjson = None
+try:
+    import brotli
+except ImportError:  # dépendance optionnelle
+    brotli = None
+
+# En dessous, la compression coûte plus qu'elle ne rapporte
+MIN_COMPRESS_BYTES = 1024
+
+Layout = Literal["rows", "columns"]
+
+
+def _default(o):
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    raise TypeError(f"Type non sérialisable : {type(o).__name__}")
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=_default).encode("utf-8")
+
+
+def rows_payload(rows: Iterable[Sequence], fields: Sequence[str], layout: Layout = "rows"):
+    """
+    Tuples (dans l'ordre de `fields`) -> liste d'objets, ou, en layout
+    "columns", un objet {champ: [valeurs]} (plus compact, sans clés répétées).
+    """
+    if layout == "columns":
+        rows = list(rows)
+        columns = zip(*rows) if rows else ((),) * len(fields)
+        return {f: list(col) for f, col in zip(fields, columns)}
+    return [dict(zip(fields, r)) for r in rows]
+
+
+def _accepted(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+def exercice_etag(db: Session, exercice_id: int) -> str | None:
+    """ETag faible des lectures de l'exercice ; None s'il n'existe pas."""
+    row = db.execute(select(Exercice.data_version).where(Exercice.id == exercice_id)).first()
+    if row is None:
+        return None
+    return f'W/"ex{exercice_id}-v{row[0] or 0}"'
+
+
+def cache_headers(etag: str | None) -> dict:
+    # no-cache : le navigateur garde la réponse mais la revalide à chaque fois (If-None-Match)
+    return {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+
+
+def not_modified(request: Request, etag: str | None) -> Response | None:
+    """Réponse 304 si le client a déjà cette version (If-None-Match), sinon None."""
+    if not etag:
+        return None
+    header = request.headers.get("if-none-match", "")
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    if "*" in tags or etag.removeprefix("W/") in tags:
+        return Response(status_code=304, headers=cache_headers(etag))
+    return None
+
+
+def json_response(request: Request, payload, status_code: int = 200, etag: str | None = None) -> Response:
+    body = dumps(payload)
+    headers = {"Vary": "Accept-Encoding", **cache_headers(etag)}
+    if len(body) >= MIN_COMPRESS_BYTES:
+        accepted = _accepted(request.headers.get("accept-encoding", ""))
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=4)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+    return Response(body, status_code, headers=headers, media_type="application/json")
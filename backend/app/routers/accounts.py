@@ -1,24 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from sqlalchemy import func, select
 
 from ..schemas import AccountOut
 from ..database import get_db
+from ..crud import bump_data_version
 from ..models import Account, Entry
+from ..responses import Layout, json_response, rows_payload
+from ..search import substring_filter
 
 router = APIRouter(prefix="/api/accounts", tags=["accounts"])
 
 @router.get("", response_model=list[AccountOut])
-def list_accounts(client_id: int, db: Session = Depends(get_db)):
-    rows = db.execute(select(Account).where(Account.client_id==client_id).order_by(Account.accnum)).scalars().all()
-    return rows
+def list_accounts(request: Request, client_id: int, layout: Layout = "rows", db: Session = Depends(get_db)):
+    rows = db.execute(select(Account.id, Account.accnum, Account.acclib).where(Account.client_id==client_id).order_by(Account.accnum)).all()
+    return json_response(request, rows_payload(rows, ("id", "accnum", "acclib"), layout))
 
 @router.post("", response_model=AccountOut)
 def create_account(client_id: int, accnum: str, acclib: str, db: Session = Depends(get_db)):
     if db.execute(select(Account).where(Account.client_id==client_id, Account.accnum==accnum)).scalar_one_or_none():
         raise HTTPException(400, "Compte déjà existant")
     a = Account(client_id=client_id, accnum=accnum, acclib=acclib)
-    db.add(a); db.commit(); db.refresh(a)
+    db.add(a)
+    bump_data_version(db, client_id=client_id)
+    db.commit(); db.refresh(a)
     return a
 
 @router.patch("/{id}", response_model=AccountOut)
@@ -27,6 +32,7 @@ def update_account(id: int, acclib: str, db: Session = Depends(get_db)):
     if not a:
         raise HTTPException(404)
     a.acclib = acclib
+    bump_data_version(db, client_id=a.client_id)
     db.commit()
     return a
 
@@ -38,7 +44,9 @@ def delete_account(id: int, db: Session = Depends(get_db)):
     cnt = db.scalar(select(func.count()).where(Entry.account_id == id)) or 0
     if cnt:
         raise HTTPException(400, "Impossible de supprimer: des écritures existent sur ce compte")
-    db.delete(a); db.commit()
+    db.delete(a)
+    bump_data_version(db, client_id=a.client_id)
+    db.commit()
     return {"ok": True}
 
 
@@ -60,7 +68,9 @@ def suggest_accounts(client_id: int, q: str = "", limit: int = 10, db: Session =
     stmt = select(Account).where(Account.client_id == client_id)
     if q:
         like = f"%{q}%"
-        stmt = stmt.where((Account.accnum.ilike(like)) | (Account.acclib.ilike(like)))
+        stmt = stmt.where(substring_filter(
+            db, (Account.accnum.ilike(like)) | (Account.acclib.ilike(like)), Account.id, q, "accounts_fts",
+        ))
     stmt = stmt.limit(min(limit, 50))
     items = db.execute(stmt).scalars().all()
     return {
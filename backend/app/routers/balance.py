@@ -1,105 +1,226 @@
-from fastapi import APIRouter, Depends, Query, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from sqlalchemy import case, select, func
+from typing import Literal
+import datetime as dt
 
+from .. import balances
+from ..columnar import columnar_response, require_arrow
 from ..helpers import FS_ROOT, fmt_cents_fec
-from ..schemas import BalanceResponse
-from ..database import get_db
-from ..models import Client, Entry, Account, Exercice
+from ..responses import Layout, exercice_etag, json_response, not_modified, rows_payload
+from ..schemas import BalanceCompareResponse, BalanceCutoffsResponse, BalanceResponse
+from ..database import SessionLocal, get_db
+from ..models import Client, Account, AccountBalance, Exercice
 
 router = APIRouter(prefix="/api/balance", tags=["balance"])
 
-@router.get("", response_model=BalanceResponse)
-def balance(exercice_id: int = Query(...), db: Session = Depends(get_db)):
-    # Agrégats par account_id
-    sub = (
-        select(
-            Entry.account_id.label("account_id"),
-            func.sum(Entry.debit_minor).label("debit_minor"),
-            func.sum(Entry.credit_minor).label("credit_minor"),
-            func.count().label("count"),
-        )
-        .where(Entry.exercice_id == exercice_id)
-        .group_by(Entry.account_id)
-        .subquery()
-    )
+# Export colonnes : montants en centimes
+BALANCE_FIELDS = [
+    ("accnum", "str"), ("acclib", "str"), ("debit_minor", "int"), ("credit_minor", "int"),
+    ("solde_minor", "int"), ("count", "int"),
+]
+# Mode hiérarchique : profondeur du préfixe des lignes de sous-total (None : compte)
+LEVEL_FIELD = ("level", "int")
+MAX_LEVEL = 10
+
+PCG_CLASSES = {
+    "1": "Comptes de capitaux",
+    "2": "Comptes d'immobilisations",
+    "3": "Comptes de stocks et en-cours",
+    "4": "Comptes de tiers",
+    "5": "Comptes financiers",
+    "6": "Comptes de charges",
+    "7": "Comptes de produits",
+    "8": "Comptes spéciaux",
+}
 
+def _balance_query(exercice_id: int, date_from: dt.date | None = None, date_to: dt.date | None = None):
+    # Cumuls tenus à jour (voir balances) : une ligne par compte mouvementé sur la période
+    totals = balances.period_totals(exercice_id, date_from, date_to)
     q = (
         select(
             Account.accnum.label("accnum"),
             func.coalesce(Account.acclib, Account.accnum).label("acclib"),
-            sub.c.debit_minor,
-            sub.c.credit_minor,
-            (sub.c.debit_minor - sub.c.credit_minor).label("solde_minor"),
-            sub.c.count,
+            totals.c.debit_minor,
+            totals.c.credit_minor,
+            (totals.c.debit_minor - totals.c.credit_minor).label("solde_minor"),
+            totals.c.count,
         )
-        .join(Account, Account.id == sub.c.account_id)
+        .join(Account, Account.id == totals.c.account_id)
         .order_by(Account.accnum)
     )
+    return q
 
-    rows = db.execute(q).all()
-    out = [
-        {
-            "accnum": r.accnum,
-            "acclib": r.acclib,
-            "debit_minor": r.debit_minor or 0,
-            "credit_minor": r.credit_minor or 0,
-            "solde_minor": r.solde_minor or 0,
-            "count": r.count,
-        }
-        for r in rows
-    ]
-    return {"rows": out, "total_accounts": len(out)}
+def _check_period(date_from: dt.date | None, date_to: dt.date | None, cutoffs: list[dt.date] | None):
+    if cutoffs and date_to is not None:
+        raise HTTPException(400, "Préciser date_to ou cutoffs, pas les deux")
+    for d in ([date_to] if date_to is not None else []) + (cutoffs or []):
+        if date_from is not None and d < date_from:
+            raise HTTPException(400, f"Période invalide : {d.isoformat()} antérieure à date_from")
 
-@router.get("/export")
-def export_balance_txt(
+def _cutoff_balances(db: Session, exercice_id: int, date_from: dt.date | None, cutoffs: list[dt.date]):
+    """[(date d'arrêté, lignes de balance)] : toutes les dates calculées en une passe (balances.period_balances)."""
+    cutoffs = sorted(set(cutoffs))
+    periods = balances.period_balances(db, exercice_id, [(date_from, d) for d in cutoffs])
+    client_id = select(Exercice.client_id).where(Exercice.id == exercice_id).scalar_subquery()
+    accounts = {
+        r.id: (r.accnum, r.acclib)
+        for r in db.execute(
+            select(Account.id, Account.accnum, func.coalesce(Account.acclib, Account.accnum).label("acclib"))
+            .where(Account.client_id == client_id)
+        )
+    }
+    result = []
+    for d, totals in zip(cutoffs, periods):
+        rows = sorted(
+            (*accounts[acc], debit, credit, debit - credit, n) for acc, (debit, credit, n) in totals.items()
+        )
+        result.append((d, rows))
+    return result
+
+def _subtotal_label(prefix: str) -> str:
+    if not prefix:
+        return "Total général"
+    if len(prefix) == 1 and prefix in PCG_CLASSES:
+        return f"Total classe {prefix} - {PCG_CLASSES[prefix]}"
+    return f"Total {prefix}"
+
+def _with_subtotals(rows, levels: list[int]):
+    """
+    Lignes de balance (triées par accnum) et, à la fin de chaque groupe, le
+    sous-total du préfixe de chaque profondeur de `levels` (0 : total général).
+    Un seul parcours : les comptes d'un même préfixe sont contigus dans l'ordre
+    du tri, une pile garde les groupes ouverts du moins au plus profond. Un
+    compte plus court qu'une profondeur n'entre pas dans ses sous-totaux.
+    """
+    levels = sorted(set(levels))
+    stack: list[tuple[int, str, list[int]]] = []  # (profondeur, préfixe, [débit, crédit, lignes])
+
+    def close(keep: int):
+        while len(stack) > keep:
+            depth, prefix, (debit, credit, n) = stack.pop()
+            yield (prefix, _subtotal_label(prefix), debit, credit, debit - credit, n, depth)
+
+    for r in rows:
+        accnum, _, debit, credit, _, n = r
+        chain = [(k, accnum[:k]) for k in levels if len(accnum) >= k]
+        keep = 0
+        while keep < len(stack) and keep < len(chain) and stack[keep][:2] == chain[keep]:
+            keep += 1
+        yield from close(keep)
+        stack.extend((k, prefix, [0, 0, 0]) for k, prefix in chain[keep:])
+        for _, _, t in stack:
+            t[0] += debit
+            t[1] += credit
+            t[2] += n
+        yield (*r, None)
+    yield from close(0)
+
+def _check_levels(levels: list[int] | None):
+    if levels and not all(0 <= k <= MAX_LEVEL for k in levels):
+        raise HTTPException(400, f"levels : profondeurs de préfixe entre 0 et {MAX_LEVEL}")
+
+def _compute(db: Session, exercice_id: int, date_from: dt.date | None, date_to: dt.date | None,
+             cutoffs: list[dt.date] | None, levels: list[int] | None):
+    """[(date d'arrêté ou None, lignes)] ; avec levels, sous-totaux intercalés (colonne level)."""
+    if cutoffs:
+        result = _cutoff_balances(db, exercice_id, date_from, cutoffs)
+    else:
+        result = [(None, db.execute(_balance_query(exercice_id, date_from, date_to)).all())]
+    if levels:
+        result = [(d, list(_with_subtotals(rows, levels))) for d, rows in result]
+    return result
+
+@router.get("", response_model=BalanceResponse | BalanceCutoffsResponse)
+def balance(
+    request: Request,
     exercice_id: int = Query(...),
+    date_from: dt.date | None = None,
+    date_to: dt.date | None = None,
+    cutoffs: list[dt.date] | None = Query(None, description="dates d'arrêté : une balance [date_from, date] par date"),
+    levels: list[int] | None = Query(None, description="balance hiérarchique : sous-totaux par préfixe de n chiffres"),
+    layout: Layout = "rows",
     db: Session = Depends(get_db),
 ):
-    sub = (
-        select(
-            Entry.account_id.label("account_id"),
-            func.sum(Entry.debit_minor).label("debit_minor"),
-            func.sum(Entry.credit_minor).label("credit_minor"),
-        )
-        .where(Entry.exercice_id == exercice_id)
-        .group_by(Entry.account_id)
-        .subquery()
-    )
+    _check_period(date_from, date_to, cutoffs)
+    _check_levels(levels)
+    etag = exercice_etag(db, exercice_id)
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+    fields = [name for name, _ in BALANCE_FIELDS] + ([LEVEL_FIELD[0]] if levels else [])
 
-    q = (
-        select(
-            Account.accnum.label("accnum"),
-            func.coalesce(Account.acclib, Account.accnum).label("acclib"),
-            sub.c.debit_minor,
-            sub.c.credit_minor,
-        )
-        .join(Account, Account.id == sub.c.account_id)
-        .order_by(Account.accnum)
-    )
+    def payload(rows):
+        accounts = sum(1 for r in rows if r[-1] is None) if levels else len(rows)
+        return {"rows": rows_payload(rows, fields, layout), "total_accounts": accounts}
 
-    rows = db.execute(q).all()
+    result = _compute(db, exercice_id, date_from, date_to, cutoffs, levels)
+    if cutoffs:
+        return json_response(request, {"balances": [{"date_to": d, **payload(rows)} for d, rows in result]}, etag=etag)
+    return json_response(request, payload(result[0][1]), etag=etag)
 
+@router.get("/export/columnar")
+def export_balance_columnar(
+    exercice_id: int = Query(...),
+    date_from: dt.date | None = None,
+    date_to: dt.date | None = None,
+    cutoffs: list[dt.date] | None = Query(None),
+    levels: list[int] | None = Query(None),
+    format: Literal["parquet", "arrow"] = "parquet",
+    db: Session = Depends(get_db),
+):
+    _check_period(date_from, date_to, cutoffs)
+    _check_levels(levels)
+    if not (cutoffs or levels):
+        return columnar_response(_balance_query(exercice_id, date_from, date_to), BALANCE_FIELDS, format, f"balance_{exercice_id}")
+    require_arrow()
+    fields = BALANCE_FIELDS + ([LEVEL_FIELD] if levels else [])
+    result = _compute(db, exercice_id, date_from, date_to, cutoffs, levels)
+    if cutoffs:
+        # format long : une colonne date_to, les balances à la suite
+        rows = [(d, *r) for d, part in result for r in part]
+        return columnar_response(rows, [("date_to", "date"), *fields], format, f"balance_{exercice_id}")
+    return columnar_response(list(result[0][1]), fields, format, f"balance_{exercice_id}")
 
+def _balance_txt(rows) -> str:
     lines: list[str] = [
         "N° de compte\tIntitulé du compte\tCumul débit\tCumul crédit\tSolde débit\tSolde crédit"
     ]
 
-    for r in rows:
-        debit_minor = r.debit_minor
-        credit_minor = r.credit_minor
-        solde = debit_minor - credit_minor
+    for accnum, acclib, debit_minor, credit_minor, solde, *_ in rows:
         solde_debit_minor = solde if solde > 0 else 0
         solde_credit_minor = -solde if solde < 0 else 0
 
-        accnum = r.accnum or ""
-        acclib = (r.acclib or "").replace("\t", " ").replace("\n", " ")
+        accnum = accnum or ""
+        acclib = (acclib or "").replace("\t", " ").replace("\n", " ")
 
         lines.append(
             f"{accnum}\t{acclib}\t{fmt_cents_fec(debit_minor)}\t{fmt_cents_fec(credit_minor)}\t{fmt_cents_fec(solde_debit_minor)}\t{fmt_cents_fec(solde_credit_minor)}"
         )
 
-    content = "\n".join(lines) + ("\n" if lines else "")
+    return "\n".join(lines) + ("\n" if lines else "")
+
+def _file_name(date_from: dt.date | None, date_to: dt.date | None) -> str:
+    if date_from is None and date_to is None:
+        return "balance.csv"
+    return f"balance_{date_from or 'debut'}_{date_to or 'fin'}.csv"
+
+@router.get("/export")
+def export_balance_txt(
+    exercice_id: int = Query(...),
+    date_from: dt.date | None = None,
+    date_to: dt.date | None = None,
+    cutoffs: list[dt.date] | None = Query(None),
+    levels: list[int] | None = Query(None),
+    db: Session = Depends(get_db),
+):
+    _check_period(date_from, date_to, cutoffs)
+    _check_levels(levels)
+    # un fichier par date d'arrêté
+    files = [
+        (_file_name(date_from, d if cutoffs else date_to), _balance_txt(rows))
+        for d, rows in _compute(db, exercice_id, date_from, date_to, cutoffs, levels)
+    ]
 
     exo = db.execute(
         select(Exercice.id, Exercice.label, Exercice.client_id).where(Exercice.id == exercice_id)
@@ -113,10 +234,13 @@ def export_balance_txt(
     folder = FS_ROOT / f"{client_name}_{exo.label}" / "output_pacioli"
     folder.mkdir(parents=True, exist_ok=True)
 
-    file_path = folder / "balance.csv"
-    file_path.write_text(content, encoding="utf-8")
+    saved = []
+    for name, content in files:
+        file_path = folder / name
+        file_path.write_text(content, encoding="utf-8")
+        saved.append(str(file_path))
 
-    return {"saved_to": str(file_path)}
+    return {"saved_to": saved if cutoffs else saved[0]}
 
     # default: stream for browser download
     # download_filename = "balance.csv"
@@ -125,3 +249,109 @@ def export_balance_txt(
     #     "Content-Disposition": f'attachment; filename="{download_filename}"',
     # }
     # return Response(content=content, media_type="text/plain", headers=headers)
+
+
+# -------- Balance comparative (N / N-1...) --------
+# Lignes lues (et écrites) par lot pendant l'export en flux
+COMPARE_BATCH_ROWS = 1000
+
+def _compare_exercices(db: Session, exercice_ids: list[int]) -> list[Exercice]:
+    if len(exercice_ids) < 2:
+        raise HTTPException(400, "Comparer au moins deux exercices")
+    if len(set(exercice_ids)) != len(exercice_ids):
+        raise HTTPException(400, "Exercice en double dans la comparaison")
+    found = {e.id: e for e in db.execute(select(Exercice).where(Exercice.id.in_(exercice_ids))).scalars()}
+    missing = [i for i in exercice_ids if i not in found]
+    if missing:
+        raise HTTPException(400, f"Exercice introuvable : {missing[0]}")
+    exercices = [found[i] for i in exercice_ids]
+    if len({e.client_id for e in exercices}) > 1:
+        raise HTTPException(400, "Les exercices doivent appartenir au même client")
+    return exercices
+
+def _compare_query(exercice_ids: list[int]):
+    """
+    Une requête groupée sur les cumuls par compte (voir balances), pivotée par
+    exercice : pour chacun débit, crédit, solde et lignes (0 si le compte n'y est
+    pas mouvementé), puis l'écart de solde du premier exercice avec chaque autre.
+    Une ligne par compte mouvementé dans au moins un des exercices.
+    """
+    debits, credits, counts = [], [], []
+    for ex_id in exercice_ids:
+        of_ex = AccountBalance.exercice_id == ex_id
+        debits.append(func.sum(case((of_ex, AccountBalance.debit_minor), else_=0)))
+        credits.append(func.sum(case((of_ex, AccountBalance.credit_minor), else_=0)))
+        counts.append(func.sum(case((of_ex, AccountBalance.count), else_=0)))
+    soldes = [d - c for d, c in zip(debits, credits)]
+    return (
+        select(
+            Account.accnum.label("accnum"),
+            func.coalesce(Account.acclib, Account.accnum).label("acclib"),
+            *debits, *credits, *soldes, *counts,
+            *(soldes[0] - s for s in soldes[1:]),
+        )
+        .join(Account, Account.id == AccountBalance.account_id)
+        .where(AccountBalance.exercice_id.in_(exercice_ids))
+        .group_by(Account.id)
+        .order_by(Account.accnum)
+    )
+
+def _compare_row(r, k: int) -> dict:
+    values = list(r[2:])
+    return {
+        "accnum": r[0], "acclib": r[1],
+        "debit_minor": values[:k], "credit_minor": values[k:2 * k], "solde_minor": values[2 * k:3 * k],
+        "count": values[3 * k:4 * k], "variance_minor": values[4 * k:],
+    }
+
+@router.get("/compare", response_model=BalanceCompareResponse)
+def compare_balances(request: Request, exercice_ids: list[int] = Query(...), db: Session = Depends(get_db)):
+    """Balance comparative : le premier exercice est la référence des écarts (N, puis N-1...)."""
+    exercices = _compare_exercices(db, exercice_ids)
+    etag = 'W/"cmp-' + "-".join(f"ex{e.id}-v{e.data_version or 0}" for e in exercices) + '"'
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+    k = len(exercices)
+    rows = [_compare_row(r, k) for r in db.execute(_compare_query(exercice_ids))]
+    payload = {
+        "exercices": [{"id": e.id, "label": e.label} for e in exercices],
+        "rows": rows,
+        "total_accounts": len(rows),
+    }
+    return json_response(request, payload, etag=etag)
+
+def _compare_txt_chunks(q, labels: list[str]):
+    """TSV par lot de COMPARE_BATCH_ROWS comptes ; session propre (celle de la requête est fermée avant le corps)."""
+    k = len(labels)
+    header = ["N° de compte", "Intitulé du compte"]
+    for label in labels:
+        header += [f"Cumul débit {label}", f"Cumul crédit {label}", f"Solde débit {label}", f"Solde crédit {label}"]
+    header += [f"Écart {labels[0]} / {label}" for label in labels[1:]]
+    yield ("\t".join(header) + "\n").encode("utf-8")
+    db = SessionLocal()
+    try:
+        result = db.connection().execute(q.execution_options(yield_per=COMPARE_BATCH_ROWS))
+        for rows in result.partitions():
+            lines = []
+            for r in rows:
+                row = _compare_row(r, k)
+                cells = [row["accnum"] or "", (row["acclib"] or "").replace("\t", " ").replace("\n", " ")]
+                for d, c, s in zip(row["debit_minor"], row["credit_minor"], row["solde_minor"]):
+                    cells += [fmt_cents_fec(d), fmt_cents_fec(c),
+                              fmt_cents_fec(s if s > 0 else 0), fmt_cents_fec(-s if s < 0 else 0)]
+                cells += [fmt_cents_fec(v) for v in row["variance_minor"]]
+                lines.append("\t".join(cells) + "\n")
+            yield "".join(lines).encode("utf-8")
+    finally:
+        db.close()
+
+@router.get("/compare/export")
+def export_compare_txt(exercice_ids: list[int] = Query(...), db: Session = Depends(get_db)):
+    exercices = _compare_exercices(db, exercice_ids)
+    labels = [e.label for e in exercices]
+    filename = "balance_comparee_" + "_".join(str(i) for i in exercice_ids) + ".csv"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    return StreamingResponse(
+        _compare_txt_chunks(_compare_query(exercice_ids), labels),
+        media_type="text/tab-separated-values; charset=utf-8", headers=headers,
+    )
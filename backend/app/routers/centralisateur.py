@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import select, func, delete
 import datetime as dt
 
+from .. import balances
 from ..database import get_db
-from ..models import Entry, Journal
-from ..crud import get_exercice
+from ..models import Entry, Journal, MonthlyRollup
+from ..crud import bump_data_version, get_exercice
+from ..responses import cache_headers, exercice_etag, not_modified
 
 router = APIRouter(prefix="/api/centralisateur", tags=["centralisateur"])
 
@@ -40,38 +42,44 @@ def iter_months_in_range(start: dt.date, end: dt.date):
 
 
 @router.get("")
-def get_centralisateur(client_id: int = Query(...), exercice_id: int = Query(...), db: Session = Depends(get_db)):
+def get_centralisateur(request: Request, response: Response, client_id: int = Query(...),
+                       exercice_id: int = Query(...), db: Session = Depends(get_db)):
     ex = get_exercice(db, exercice_id)
     if ex.client_id != client_id:
         # sécurité simple: l'exercice doit appartenir au client passé
         raise HTTPException(status_code=400, detail="exercice/client mismatch")
+    etag = exercice_etag(db, exercice_id)
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+    response.headers.update(cache_headers(etag))
 
     # Liste de référence des journaux du client
     jrows = db.execute(select(Journal).where(Journal.client_id == client_id).order_by(Journal.jnl)).scalars().all()
     journals = [{"jnl": j.jnl, "jnl_lib": j.jnl_lib} for j in jrows]
 
-    months = []
-    # Pour chaque mois, agréger entries et compléter avec tous les journaux
-    for label, d1, d2 in iter_months_in_range(ex.date_start, ex.date_end):
-        q = (
-            select(
-                Entry.jnl.label("jnl"),
-                func.count().label("count"),
-                func.coalesce(func.sum(Entry.debit_minor), 0).label("debit_minor"),
-                func.coalesce(func.sum(Entry.credit_minor), 0).label("credit_minor"),
-            )
-            .where(
-                Entry.exercice_id == exercice_id,
-                Entry.date >= d1,
-                Entry.date <= d2,
-            )
-            .group_by(Entry.jnl)
+    # Une lecture des cumuls mensuels (balances.monthly_rollups), par mois et journal
+    q = (
+        select(
+            MonthlyRollup.month.label("month"),
+            MonthlyRollup.jnl.label("jnl"),
+            func.sum(MonthlyRollup.count).label("count"),
+            func.sum(MonthlyRollup.debit_minor).label("debit_minor"),
+            func.sum(MonthlyRollup.credit_minor).label("credit_minor"),
         )
-        by_jnl = {r.jnl: {"count": r.count or 0, "debit_minor": int(r.debit_minor or 0), "credit_minor": int(r.credit_minor or 0)} for r in db.execute(q)}
+        .where(MonthlyRollup.exercice_id == exercice_id)
+        .group_by(MonthlyRollup.month, MonthlyRollup.jnl)
+    )
+    totals = {
+        (r.month, r.jnl): {"count": int(r.count or 0), "debit_minor": int(r.debit_minor or 0), "credit_minor": int(r.credit_minor or 0)}
+        for r in db.execute(q)
+    }
 
+    months = []
+    # Pour chaque mois, compléter avec tous les journaux
+    for label, d1, d2 in iter_months_in_range(ex.date_start, ex.date_end):
         rows = []
         for j in journals:
-            cur = by_jnl.get(j["jnl"], {"count": 0, "debit_minor": 0, "credit_minor": 0})
+            cur = totals.get((label, j["jnl"]), {"count": 0, "debit_minor": 0, "credit_minor": 0})
             diff = cur["debit_minor"] - cur["credit_minor"]
             rows.append({
                 "jnl": j["jnl"],
@@ -119,14 +127,16 @@ def delete_entries_for_month(
     if d1 > d2:
         return {"deleted_count": 0}
 
-    res = db.execute(
-        delete(Entry).where(
-            Entry.exercice_id == exercice_id,
-            Entry.jnl == jnl,
-            Entry.date >= d1,
-            Entry.date <= d2,
-        )
+    where = (
+        Entry.exercice_id == exercice_id,
+        Entry.jnl == jnl,
+        Entry.date >= d1,
+        Entry.date <= d2,
     )
+    balances.subtract(db, *where)
+    res = db.execute(delete(Entry).where(*where))
     deleted = res.rowcount or 0
+    if deleted:
+        bump_data_version(db, exercice_id)
     db.commit()
     return {"deleted_count": int(deleted)}
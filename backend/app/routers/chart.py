@@ -1,17 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 from ..database import get_db
+from ..crud import bump_data_version
 from ..models import Account, Journal
+from ..responses import Layout, json_response, rows_payload
 from ..schemas import AccountOut, JournalOut
 import json
 
 router = APIRouter(prefix="/api/chart", tags=["chart"])
 
 @router.get("/accounts", response_model=list[AccountOut])
-def list_accounts(client_id: int = Query(...), db: Session = Depends(get_db)):
-    q = select(Account).where(Account.client_id == client_id).order_by(Account.accnum)
-    return db.execute(q).scalars().all()
+def list_accounts(request: Request, client_id: int = Query(...), layout: Layout = "rows", db: Session = Depends(get_db)):
+    q = select(Account.id, Account.accnum, Account.acclib).where(Account.client_id == client_id).order_by(Account.accnum)
+    return json_response(request, rows_payload(db.execute(q).all(), ("id", "accnum", "acclib"), layout))
 
 @router.patch("/accounts/{id}", response_model=AccountOut)
 def update_account(id: int, acclib: str = Query(...), db: Session = Depends(get_db)):
@@ -19,14 +21,15 @@ def update_account(id: int, acclib: str = Query(...), db: Session = Depends(get_
     if not acc:
         raise HTTPException(404)
     acc.acclib = acclib
+    bump_data_version(db, client_id=acc.client_id)
     db.commit()
     db.refresh(acc)
     return acc
 
 @router.get("/journals", response_model=list[JournalOut])
-def list_journals(client_id: int = Query(...), db: Session = Depends(get_db)):
-    q = select(Journal).where(Journal.client_id == client_id).order_by(Journal.jnl)
-    return db.execute(q).scalars().all()
+def list_journals(request: Request, client_id: int = Query(...), layout: Layout = "rows", db: Session = Depends(get_db)):
+    q = select(Journal.id, Journal.jnl, Journal.jnl_lib).where(Journal.client_id == client_id).order_by(Journal.jnl)
+    return json_response(request, rows_payload(db.execute(q).all(), ("id", "jnl", "jnl_lib"), layout))
 
 @router.patch("/journals/{id}", response_model=JournalOut)
 def update_journal(id: int, jnl_lib: str = Query(...), db: Session = Depends(get_db)):
@@ -34,6 +37,7 @@ def update_journal(id: int, jnl_lib: str = Query(...), db: Session = Depends(get
     if not jnl:
         raise HTTPException(404)
     jnl.jnl_lib = jnl_lib
+    bump_data_version(db, client_id=jnl.client_id)
     db.commit()
     db.refresh(jnl)
     return jnl
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Request, Response
 from sqlalchemy.orm import Session
 from ..database import get_db
 from ..crud import list_unbalanced_pieces
+from ..responses import cache_headers, exercice_etag, not_modified
 
 router = APIRouter(prefix="/api/checks", tags=["checks"])
 
 @router.get("/exercice")
-def checks_exercice(exercice_id: int = Query(...), limit: int = 100, db: Session = Depends(get_db)):
+def checks_exercice(request: Request, response: Response, exercice_id: int = Query(...), limit: int = 100,
+                    db: Session = Depends(get_db)):
+    etag = exercice_etag(db, exercice_id)
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+    response.headers.update(cache_headers(etag))
     return {"unbalanced_pieces": list_unbalanced_pieces(db, exercice_id, limit=limit)}
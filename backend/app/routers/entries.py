@@ -1,15 +1,22 @@
 import re
-from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import String, cast, func, literal, select, and_, or_
+from sqlalchemy import String, cast, func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Join
 from datetime import date
-from typing import Optional, Tuple
-import base64, json, csv, io
+from typing import Literal, Optional, Tuple
+import base64, json, csv, io, zlib
 
+from .. import piece_index, seek_index
+from ..columnar import columnar_response
 from ..helpers import fmt_cents_fr
-from ..database import get_db
-from ..models import Entry, Account
-from ..schemas import EntriesPage, EntryOut, PageInfo
+from ..database import SessionLocal, get_db
+from ..models import Entry, Account, Exercice
+from ..responses import Layout, exercice_etag, json_response, not_modified, rows_payload
+from ..schemas import EntriesPage
+from ..search import amount_predicate, substring_filter, text_predicate
 
 router = APIRouter(prefix="/api/entries", tags=["entries"])
 
@@ -45,7 +52,7 @@ def _filters_signature(
         "search": (search or None),
     }
 
-# ---- tri autorisé (clé primaire de tri + tiebreaker id ASC) ----
+# ---- tri autorisé (clé primaire de tri + tiebreaker id dans le même sens) ----
 def _parse_sort(sort: Optional[str]) -> Tuple[str, bool]:
     # retourne (clé, desc)
     s = (sort or "date,id").split(",")[0].strip()
@@ -76,55 +83,86 @@ def _primary_expr(key: str):
         return Entry.credit_minor
     return Entry.date
 
-def _cursor_predicate(primary_col, desc: bool, after_cursor: Optional[dict], before_cursor: Optional[dict]):
-    # Construit le WHERE (> cursor) ou (< cursor) en respectant l'ordre
-    # Tie-breaker: Entry.id ASC en ordre normal
-    if after_cursor:
-        pv = after_cursor["pv"]
-        pid = after_cursor["id"]
-        op_main = primary_col < pv if desc else primary_col > pv
-        op_eq = and_(primary_col == pv, Entry.id > pid)
-        return or_(op_main, op_eq)
-    if before_cursor:
-        pv = before_cursor["pv"]
-        pid = before_cursor["id"]
-        op_main = primary_col > pv if desc else primary_col < pv
-        op_eq = and_(primary_col == pv, Entry.id < pid)
-        return or_(op_main, op_eq)
-    return None
+def _order_cols(primary_col, desc: bool, reverse: bool = False):
+    # id suit le sens de la clé : l'ordre est celui de l'index (exercice_id, clé, id), lu
+    # dans un sens ou dans l'autre, sans tri temporaire
+    if desc != reverse:
+        return [primary_col.desc(), Entry.id.desc()]
+    return [primary_col.asc(), Entry.id.asc()]
 
-def _sanitize_amount_like(s: str) -> str:
-    # enlève uniquement les espaces (on garde la virgule)
-    return (s or "").replace(" ", "")
-
-def _formatted_delta_expr():
+def _keyset_parts(q, key: str, desc: bool, cursor: Optional[dict], forward: bool = True) -> list:
     """
-    Retourne une expression SQL (SQLite-compatible) qui produit une chaîne
-    'euros,cents' à partir de ABS(debit_minor - credit_minor) (en cents).
-    Ex: 735600 -> '7356,00', 5 -> '0,05', 3550 -> '35,50'
+    Lignes après (forward) ou avant la clé `cursor` dans l'ordre du tri, en deux
+    requêtes lues l'une après l'autre : les ex aequo de la clé (clé = pv, id
+    au-delà), puis les clés strictement au-delà. Chacune est un intervalle direct
+    de l'index (exercice_id, clé, id) ; comparée d'un bloc, la paire (clé, id)
+    ne borne l'index que sur la clé et les ex aequo (500 000 crédits à 0...)
+    seraient écartés un à un.
     """
-    delta = func.abs(Entry.debit_minor - Entry.credit_minor)
-
-    # Assure au moins 2 digits pour pouvoir prendre les cents
-    # printf('%02d', N) existe en SQLite
-    digits2 = func.printf('%02d', delta)  # '05', '3550', '735600', etc.
-
-    # euros = tout sauf les 2 derniers digits ; si vide -> '0'
-    euros_raw = func.substr(digits2, 1, func.length(digits2) - 2)
-    euros = func.coalesce(func.nullif(euros_raw, ''), literal('0'))
-
-    # cents = 2 derniers digits
-    cents = func.substr(digits2, -2, 2)
+    if not cursor:
+        return [q]
+    primary_col = _primary_expr(key)
+    pv = cursor["pv"]
+    if key == "date" and isinstance(pv, str):
+        pv = _parse_date(pv)
+    up = forward != desc
+    after_id = Entry.id > cursor["id"] if up else Entry.id < cursor["id"]
+    if key == "id":
+        return [q.where(after_id)]
+    return [q.where(primary_col == pv, after_id), q.where(primary_col > pv if up else primary_col < pv)]
+
+def _fetch_parts(db: Session, parts: list, order, limit: int, offset: int = 0) -> list:
+    # parties dans l'ordre : on ne lit la suivante que si la page n'est pas pleine
+    rows = []
+    for part in parts:
+        if offset:
+            # ex aequo moins nombreux que l'offset : le reste se saute dans la partie suivante
+            got = db.execute(part.order_by(*order).offset(offset).limit(limit - len(rows))).all()
+            if not got:
+                offset -= db.execute(select(func.count()).select_from(part.limit(offset).subquery())).scalar_one()
+                continue
+            offset = 0
+        else:
+            got = db.execute(part.order_by(*order).limit(limit - len(rows))).all()
+        rows += got
+        if len(rows) >= limit:
+            break
+    return rows
+
+class _AccountsFirstJoin(Join):
+    inherit_cache = True
+
+@compiles(_AccountsFirstJoin, "sqlite")
+def _compile_accounts_first(join, compiler, **kw):
+    # CROSS JOIN : jointure interne dont SQLite conserve l'ordre des tables
+    return compiler.visit_join(join, **kw).replace(" JOIN ", " CROSS JOIN ", 1)
+
+def _join_accounts(q, db: Session, exercice_id: int, key: str, entry_filtered: bool):
+    """
+    Jointure écritures / comptes. Trié par compte sans filtre sur les écritures,
+    on parcourt les comptes du client dans l'ordre (index unique client_id,
+    accnum) puis leurs écritures par id (index exercice_id, account_id, id) :
+    la page sort sans trier tout l'exercice. Sinon le planificateur choisit.
+    """
+    ex = db.get(Exercice, exercice_id) if key == "accnum" and not entry_filtered else None
+    if ex is None:
+        return q.join(Account, Account.id == Entry.account_id)
+    return q.select_from(
+        _AccountsFirstJoin(Account.__table__, Entry.__table__, Account.id == Entry.account_id)
+    ).where(Account.client_id == ex.client_id)
 
-    # euros || ',' || cents
-    return func.concat(euros, literal(','), cents)
+def _sanitize_amount_like(s: str) -> str:
+    # enlève uniquement les espaces (on garde la virgule)
+    return (s or "").replace(" ", "")
 
-def _apply_filters(q, exercice_id, journal, piece_ref, compte, min_date, max_date, amount_like, search, join_account: bool):
+def _apply_filters(q, exercice_id, journal, piece_ref, compte, min_date, max_date, amount_like, search, join_account: bool, db: Session):
     q = q.where(Entry.exercice_id == exercice_id)
     if journal:
         q = q.where(Entry.jnl == journal)
     if piece_ref:
-        q = q.where(Entry.piece_ref.ilike(f"%{piece_ref}%"))
+        q = q.where(substring_filter(
+            db, Entry.piece_ref.ilike(f"%{piece_ref}%"), Entry.id, piece_ref, "entries_piece_fts", "piece_ref",
+        ))
     if min_date:
         q = q.where(Entry.date >= _parse_date(min_date))
     if max_date:
@@ -132,17 +170,24 @@ def _apply_filters(q, exercice_id, journal, piece_ref, compte, min_date, max_dat
     if amount_like:
         needle = _sanitize_amount_like(amount_like)  # retire juste les espaces
         if needle:  # garde virgule si présente
-            formatted = _formatted_delta_expr()
-            q = q.where(formatted.ilike(f"%{needle}%"))
+            q = q.where(amount_predicate(db, exercice_id, needle))
     if search:
-        like = f"%{search}%"
-        q = q.where(Entry.lib.ilike(like))
+        q = q.where(text_predicate(search))
     if compte:
-        q = q.where(Account.accnum.ilike(f"%{compte}%"))
+        # candidats posés sur entries.account_id : l'index (exercice_id, account_id, id) borne la lecture
+        q = q.where(substring_filter(
+            db, Account.accnum.ilike(f"%{compte}%"), Entry.account_id, compte, "accounts_fts", "accnum",
+        ))
     return q
 
+# Colonnes d'une ligne de la grille (= EntryOut), dans l'ordre du select
+GRID_FIELDS = ("id", "date", "jnl", "piece_ref", "account_id", "accnum", "acclib", "lib", "debit_minor", "credit_minor")
+# Position dans la ligne de la valeur de chaque clé de tri
+_SORT_FIELD = {"date": 1, "id": 0, "jnl": 2, "piece_ref": 3, "accnum": 5, "debit": 8, "credit": 9}
+
 @router.get("", response_model=EntriesPage)
 def list_entries_keyset(
+    request: Request,
     exercice_id: int = Query(...),
     journal: Optional[str] = None,
     compte: Optional[str] = None,   # accnum
@@ -155,28 +200,43 @@ def list_entries_keyset(
     page_size: int = Query(100, ge=1, le=500),
     after: Optional[str] = None,
     before: Optional[str] = None,
+    layout: Layout = "rows",
     db: Session = Depends(get_db),
 ):
+    etag = exercice_etag(db, exercice_id)
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+    # layout=columns : rows devient {champ: [valeurs]}
+    page = _entries_page(db, exercice_id, journal, compte, piece_ref, min_date, max_date, amount_like, search,
+                         sort, page_size, after, before, layout)
+    return json_response(request, page, etag=etag)
+
+def _entries_page(db: Session, exercice_id: int, journal=None, compte=None, piece_ref=None, min_date=None,
+                  max_date=None, amount_like=None, search=None, sort="date,id", page_size=100,
+                  after=None, before=None, layout: Layout = "rows") -> dict:
     if after and before:
         raise HTTPException(400, "after et before sont exclusifs")
 
     key, desc = _parse_sort(sort)
     join_account = bool(compte) or key == "accnum"
+    entry_filtered = any((journal, piece_ref, min_date, max_date, amount_like, search))
 
-    # base select avec JOIN (si besoin) et colonnes nécessaires
-    # on sélectionne Entry + accnum/acclib pour éviter N+1
+    # base select avec JOIN et colonnes de la grille (tuples, sans objets ORM)
     q = select(
-        Entry,
-        Account.accnum.label("accnum"),
-        Account.acclib.label("acclib"),
+        Entry.id,
+        Entry.date,
+        Entry.jnl,
+        Entry.piece_ref,
+        Entry.account_id,
+        Account.accnum,
+        Account.acclib,
+        Entry.lib,
+        Entry.debit_minor,
+        Entry.credit_minor,
     )
-    if join_account:
-        q = q.join(Account, Account.id == Entry.account_id)
-    else:
-        # pour récupérer quand même accnum/acclib sans forcer le JOIN dans SQLite, on joint quand même (léger)
-        q = q.join(Account, Account.id == Entry.account_id)
+    q = _join_accounts(q, db, exercice_id, key, entry_filtered)
 
-    q = _apply_filters(q, exercice_id, journal, piece_ref, compte, min_date, max_date, amount_like, search, join_account)
+    q = _apply_filters(q, exercice_id, journal, piece_ref, compte, min_date, max_date, amount_like, search, join_account, db)
 
     primary_col = _primary_expr(key)
 
@@ -194,19 +254,12 @@ def list_entries_keyset(
             raise HTTPException(400, "token invalide (filtres/tri ont changé)")
         before_cursor = c["cur"]
 
-    cur_pred = _cursor_predicate(primary_col, desc, after_cursor, before_cursor)
-    if cur_pred is not None:
-        q = q.where(cur_pred)
-
-    # Ordre d'affichage normal
-    order_cols = [primary_col.desc() if desc else primary_col.asc(), Entry.id.asc()]
-    # Si on navigue "before", on inverse pour prendre la page précédente puis on renversera
+    # Ordre d'affichage normal ; si on navigue "before", on inverse pour prendre la
+    # page précédente puis on renversera
     reversed_fetch = bool(before_cursor)
-    if reversed_fetch:
-        order_cols = [primary_col.asc() if desc else primary_col.desc(), Entry.id.desc()]
-    q = q.order_by(*order_cols).limit(page_size + 1)
-
-    rows = db.execute(q).all()  # liste de tuples (Entry, accnum, acclib)
+    parts = _keyset_parts(q, key, desc, after_cursor or before_cursor, forward=not reversed_fetch)
+    # tuples dans l'ordre de GRID_FIELDS
+    rows = _fetch_parts(db, parts, _order_cols(primary_col, desc, reversed_fetch), page_size + 1)
 
     # Déterminer s'il y a une page suivante/précédente
     has_extra = len(rows) > page_size
@@ -217,51 +270,134 @@ def list_entries_keyset(
     if reversed_fetch:
         rows = list(reversed(rows))
 
-    # Construire payloads
-    out_rows = []
-    for e, accnum, acclib in rows:
-        out_rows.append(EntryOut(
-            id=e.id,
-            date=e.date,
-            jnl=e.jnl,
-            piece_ref=e.piece_ref,
-            account_id=e.account_id,
-            accnum=accnum or "",
-            acclib=acclib or "",
-            lib=e.lib,
-            debit_minor=e.debit_minor,
-            credit_minor=e.credit_minor,
-        ))
-
     # next/prev tokens
-    def _pv_from_row(e: Entry, accnum_val: Optional[str]):
-        if key == "date": return e.date.isoformat()
-        if key == "id": return e.id
-        if key == "jnl": return e.jnl
-        if key == "piece_ref": return e.piece_ref
-        if key == "accnum": return accnum_val or ""
-        if key == "debit": return e.debit_minor or 0
-        if key == "credit": return e.credit_minor or 0
-        return e.date.isoformat()
+    def _pv_from_row(row):
+        pv = row[_SORT_FIELD[key]]
+        return pv.isoformat() if key == "date" else pv
 
     next_token = prev_token = None
-    if out_rows:
-        first_e, first_accnum = rows[0][0], rows[0][1]
-        last_e, last_accnum = rows[-1][0], rows[-1][1]
-        cur_first = {"pv": _pv_from_row(first_e, first_accnum), "id": first_e.id}
-        cur_last = {"pv": _pv_from_row(last_e, last_accnum), "id": last_e.id}
+    if rows:
+        cur_first = {"pv": _pv_from_row(rows[0]), "id": rows[0][0]}
+        cur_last = {"pv": _pv_from_row(rows[-1]), "id": rows[-1][0]}
         base_payload = {"v": 1, "key": key, "desc": desc, "filt": filt_sig}
         prev_token = _encode_token({**base_payload, "cur": cur_first})
         next_token = _encode_token({**base_payload, "cur": cur_last})
 
-    has_prev = bool(before or after) if out_rows else False
+    has_prev = bool(before or after) if rows else False
     if reversed_fetch:
         # on venait de 'before' => has_prev dépend du "has_extra"
         has_prev = has_extra
     has_next = has_extra if not reversed_fetch else True  # en backward, il existe toujours une "page suivante" vers l'avant
 
-    page_info = PageInfo(next=next_token, prev=prev_token, has_next=bool(has_next), has_prev=bool(has_prev))
-    return {"rows": out_rows, "page_info": page_info}
+    page_info = {"next": next_token, "prev": prev_token, "has_next": bool(has_next), "has_prev": bool(has_prev)}
+    return {"rows": rows_payload(rows, GRID_FIELDS, layout), "page_info": page_info}
+
+
+# -------- SEEK : aller à une date, une pièce ou une position --------
+@router.get("/seek")
+def seek_entries(
+    request: Request,
+    exercice_id: int = Query(...),
+    journal: Optional[str] = None,
+    compte: Optional[str] = None,
+    piece_ref: Optional[str] = None,
+    min_date: Optional[str] = None,
+    max_date: Optional[str] = None,
+    amount_like: Optional[str] = None,
+    search: Optional[str] = None,
+    sort: Optional[str] = "date,id",
+    page_size: int = Query(100, ge=1, le=500),
+    at_position: Optional[int] = Query(None, ge=0),
+    at_date: Optional[str] = None,
+    at_piece_ref: Optional[str] = None,
+    layout: Layout = "rows",
+    db: Session = Depends(get_db),
+):
+    """
+    Page de la grille (mêmes filtres et tri) qui commence à la cible : une
+    position (0 = première ligne, ramenée à la dernière si au-delà), ou la
+    première ligne à partir d'une date (tri par date) / d'une référence de pièce
+    (tri par pièce). Les tokens after/before de la page servent ensuite à la
+    navigation habituelle ; position et total situent la page.
+    """
+    etag = exercice_etag(db, exercice_id)
+    if (cached := not_modified(request, etag)) is not None:
+        return cached
+    page = _seek_page(db, exercice_id, journal, compte, piece_ref, min_date, max_date, amount_like, search,
+                      sort, page_size, at_position, at_date, at_piece_ref, layout)
+    return json_response(request, page, etag=etag)
+
+def _seek_page(db: Session, exercice_id: int, journal=None, compte=None, piece_ref=None, min_date=None,
+               max_date=None, amount_like=None, search=None, sort="date,id", page_size=100,
+               at_position=None, at_date=None, at_piece_ref=None, layout: Layout = "rows") -> dict:
+    if sum(t is not None for t in (at_position, at_date, at_piece_ref)) != 1:
+        raise HTTPException(400, "Une seule cible : at_position, at_date ou at_piece_ref")
+    key, desc = _parse_sort(sort)
+    if at_date is not None and key != "date":
+        raise HTTPException(400, "at_date : la grille doit être triée par date")
+    if at_piece_ref is not None and key != "piece_ref":
+        raise HTTPException(400, "at_piece_ref : la grille doit être triée par pièce")
+    version = db.execute(select(Exercice.data_version).where(Exercice.id == exercice_id)).scalar_one_or_none()
+
+    # clés (valeur de tri, id) des lignes filtrées, lues dans l'index du tri
+    primary_col = _primary_expr(key)
+    entry_filtered = any((journal, piece_ref, min_date, max_date, amount_like, search))
+    keys_q = select(primary_col, Entry.id)
+    if key == "accnum" or compte:
+        keys_q = _join_accounts(keys_q, db, exercice_id, key, entry_filtered)
+    keys_q = _apply_filters(keys_q, exercice_id, journal, piece_ref, compte, min_date, max_date, amount_like, search,
+                            True, db)
+
+    order = _order_cols(primary_col, desc)
+
+    def after(mark):
+        return _keyset_parts(keys_q, key, desc, mark and {"pv": mark[0], "id": mark[1]})
+
+    def step(mark, n):
+        rows = _fetch_parts(db, after(mark), order, 1, offset=n)
+        return tuple(rows[0]) if rows else None
+
+    def count(mark, until):
+        # au plus STRIDE lignes entre un repère et la clé suivante (ou la fin)
+        keys = [tuple(r) for r in _fetch_parts(db, after(mark), order, seek_index.STRIDE)]
+        if until is None:
+            return len(keys)
+        return sum(1 for k in keys if (k > until if desc else k < until))
+
+    filt_sig = _filters_signature(exercice_id, journal, piece_ref, compte, min_date, max_date, amount_like, search)
+    index = seek_index.get((key, desc, *filt_sig.values()), version or 0, step, count)
+
+    target = None
+    if at_position is not None:
+        position = min(at_position, max(index.total - 1, 0))
+        mark, skip = index.mark_for(position)
+        target = step(mark, skip)
+    else:
+        if at_date is not None:
+            try:
+                pv = _parse_date(at_date)
+            except ValueError:
+                raise HTTPException(400, f"Date invalide : {at_date}")
+        else:
+            pv = at_piece_ref
+        # première ligne de clé >= pv (<= en tri décroissant) : id hors bornes ; sinon la dernière
+        target = step((pv, 2 ** 63 - 1 if desc else 0), 0)
+        if target is not None:
+            position = index.position_of(target, desc, count)
+        else:
+            position = max(index.total - 1, 0)
+            target = step(*index.mark_for(position)) if index.total else None
+
+    # page ouverte juste avant la cible (même id décalé d'un cran dans le sens du tri)
+    after_token = None
+    if target is not None:
+        pv, entry_id = target
+        cur = {"pv": pv.isoformat() if key == "date" else pv, "id": entry_id + 1 if desc else entry_id - 1}
+        after_token = _encode_token({"v": 1, "key": key, "desc": desc, "filt": filt_sig, "cur": cur})
+    page = _entries_page(db, exercice_id, journal, compte, piece_ref, min_date, max_date, amount_like, search,
+                         sort, page_size, after_token, None, layout)
+    page["page_info"]["has_prev"] = position > 0
+    return {**page, "position": position, "total": index.total}
 
 
 # -------- SUGGEST piece_ref --------
@@ -273,30 +409,86 @@ def suggest_piece(
     db: Session = Depends(get_db),
 ):
     q = (q or "").strip()
+    items = piece_index.suggest(db, exercice_id, q, limit)
+    if items is not None:
+        return {"items": items}
     stmt = select(Entry.piece_ref).where(Entry.exercice_id == exercice_id)
     if q:
         like = f"%{q}%"
-        stmt = stmt.where(Entry.piece_ref.ilike(like))
+        stmt = stmt.where(substring_filter(
+            db, Entry.piece_ref.ilike(like), Entry.id, q, "entries_piece_fts", "piece_ref",
+        ))
     stmt = stmt.group_by(Entry.piece_ref).order_by(Entry.piece_ref).limit(limit)
     items = [r[0] for r in db.execute(stmt).all() if r[0]]
     return {"items": items}
 
 
 # -------- EXPORT CSV --------
-@router.get("/export")
-def export_entries_csv(
-    exercice_id: int = Query(...),
-    journal: Optional[str] = None,
-    compte: Optional[str] = None,
-    piece_ref: Optional[str] = None,
-    min_date: Optional[str] = None,
-    max_date: Optional[str] = None,
-    amount_like: Optional[str] = None,
-    search: Optional[str] = None,
-    sort: Optional[str] = "date,id",
-    db: Session = Depends(get_db),
-):
+# Lignes lues (et écrites) par lot pendant l'export en flux
+EXPORT_BATCH_ROWS = 5000
+
+EXPORT_HEADER = [
+    "id","exercice_id","date","jnl","piece_ref","account_id","accnum","acclib","lib",
+    "debit","credit","piece_date","valid_date","montant","i_devise"
+]
+
+def _export_csv_chunks(q, compress: bool):
+    """
+    Produit le CSV par morceaux (un par lot de EXPORT_BATCH_ROWS lignes), gzip à
+    la volée si `compress`. Session propre : celle de la requête est fermée
+    avant l'envoi du corps d'une StreamingResponse.
+    """
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = format gzip
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=";", quoting=csv.QUOTE_MINIMAL)
+
+    def flush() -> bytes:
+        data = output.getvalue().encode("utf-8")
+        output.seek(0)
+        output.truncate()
+        return gz.compress(data) if gz else data
+
+    writer.writerow(EXPORT_HEADER)
+    db = SessionLocal()
+    try:
+        # exécution Core (colonnes seules : rien à charger côté ORM)
+        result = db.connection().execute(q.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        for rows in result.partitions():
+            for r in rows:
+                (
+                    _id, _exo, _date, _jnl, _piece, _acc_id, _accnum, _acclib, _lib,
+                    _debit_minor, _credit_minor, _pdate, _vdate, _montant_minor, _idev
+                ) = r
+                writer.writerow([
+                    _id, _exo, (_date.isoformat() if _date else ""),
+                    _jnl or "", _piece or "", _acc_id, _accnum or "", _acclib or "", (_lib or "").replace("\n", " "),
+                    fmt_cents_fr(_debit_minor or 0), fmt_cents_fr(_credit_minor or 0),
+                    (_pdate.isoformat() if _pdate else ""), (_vdate.isoformat() if _vdate else ""),
+                    (fmt_cents_fr(_montant_minor) if _montant_minor is not None else ""),
+                    _idev or "",
+                ])
+            chunk = flush()
+            if chunk:
+                yield chunk
+    finally:
+        db.close()
+    chunk = flush()
+    if gz:
+        chunk += gz.flush()
+    if chunk:
+        yield chunk
+
+# Export colonnes : même sélection, montants en centimes et dates natives
+EXPORT_FIELDS = [
+    ("id", "int"), ("exercice_id", "int"), ("date", "date"), ("jnl", "str"), ("piece_ref", "str"),
+    ("account_id", "int"), ("accnum", "str"), ("acclib", "str"), ("lib", "str"),
+    ("debit_minor", "int"), ("credit_minor", "int"), ("piece_date", "date"), ("valid_date", "date"),
+    ("montant_minor", "int"), ("i_devise", "str"),
+]
+
+def _export_query(db: Session, exercice_id, journal, compte, piece_ref, min_date, max_date, amount_like, search, sort):
     key, desc = _parse_sort(sort)
+    entry_filtered = any((journal, piece_ref, min_date, max_date, amount_like, search))
     # On joint Account pour accnum/acclib
     q = select(
         Entry.id,
@@ -314,39 +506,57 @@ def export_entries_csv(
         Entry.valid_date,
         Entry.montant_minor,
         Entry.i_devise,
-    ).join(Account, Account.id == Entry.account_id)
-
-    q = _apply_filters(q, exercice_id, journal, piece_ref, compte, min_date, max_date, amount_like, search, True)
+    )
+    # ordre d'index (voir _join_accounts) : les premières lignes partent sans attendre un tri complet
+    q = _join_accounts(q, db, exercice_id, key, entry_filtered)
 
-    primary_col = _primary_expr(key)
-    order_cols = [primary_col.desc() if desc else primary_col.asc(), Entry.id.asc()]
-    q = q.order_by(*order_cols)
+    # les filtres sont résolus ici (candidats d'index), sur la session de la requête
+    q = _apply_filters(q, exercice_id, journal, piece_ref, compte, min_date, max_date, amount_like, search, True, db)
 
-    rows = db.execute(q).all()
+    return q.order_by(*_order_cols(_primary_expr(key), desc))
 
-    output = io.StringIO()
-    writer = csv.writer(output, delimiter=";", quoting=csv.QUOTE_MINIMAL)
-    writer.writerow([
-        "id","exercice_id","date","jnl","piece_ref","account_id","accnum","acclib","lib",
-        "debit","credit","piece_date","valid_date","montant","i_devise"
-    ])
-    for r in rows:
-        (
-            _id, _exo, _date, _jnl, _piece, _acc_id, _accnum, _acclib, _lib,
-            _debit_minor, _credit_minor, _pdate, _vdate, _montant_minor, _idev
-        ) = r
-        writer.writerow([
-            _id, _exo, (_date.isoformat() if _date else ""),
-            _jnl or "", _piece or "", _acc_id, _accnum or "", _acclib or "", (_lib or "").replace("\n", " "),
-            fmt_cents_fr(_debit_minor or 0), fmt_cents_fr(_credit_minor or 0),
-            (_pdate.isoformat() if _pdate else ""), (_vdate.isoformat() if _vdate else ""),
-            (fmt_cents_fr(_montant_minor) if _montant_minor is not None else ""),
-            _idev or "",
-        ])
-
-    content = output.getvalue()
+@router.get("/export")
+def export_entries_csv(
+    exercice_id: int = Query(...),
+    journal: Optional[str] = None,
+    compte: Optional[str] = None,
+    piece_ref: Optional[str] = None,
+    min_date: Optional[str] = None,
+    max_date: Optional[str] = None,
+    amount_like: Optional[str] = None,
+    search: Optional[str] = None,
+    sort: Optional[str] = "date,id",
+    gzip: bool = False,
+    db: Session = Depends(get_db),
+):
+    """
+    Export CSV des écritures filtrées, dans l'ordre de `sort` (comme la grille).
+    Les ex aequo de la clé sont rangés par id dans le même sens que le tri :
+    avec `-date`, les écritures d'un même jour sortent de la plus récente à la
+    plus ancienne saisie (id décroissant, et non plus croissant).
+    """
+    q = _export_query(db, exercice_id, journal, compte, piece_ref, min_date, max_date, amount_like, search, sort)
     headers = {
-        "Content-Type": "text/csv; charset=utf-8",
         "Content-Disposition": f'attachment; filename="entries_{exercice_id}.csv"',
     }
-    return Response(content=content, media_type="text/csv", headers=headers)
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(_export_csv_chunks(q, gzip), media_type="text/csv; charset=utf-8", headers=headers)
+
+@router.get("/export/columnar")
+def export_entries_columnar(
+    exercice_id: int = Query(...),
+    format: Literal["parquet", "arrow"] = "parquet",
+    journal: Optional[str] = None,
+    compte: Optional[str] = None,
+    piece_ref: Optional[str] = None,
+    min_date: Optional[str] = None,
+    max_date: Optional[str] = None,
+    amount_like: Optional[str] = None,
+    search: Optional[str] = None,
+    sort: Optional[str] = "date,id",
+    db: Session = Depends(get_db),
+):
+    """Export Parquet / Arrow des écritures filtrées ; même ordre que l'export CSV (ex aequo par id dans le sens du tri)."""
+    q = _export_query(db, exercice_id, journal, compte, piece_ref, min_date, max_date, amount_like, search, sort)
+    return columnar_response(q, EXPORT_FIELDS, format, f"entries_{exercice_id}")
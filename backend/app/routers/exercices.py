@@ -2,9 +2,10 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func, or_, select
 
-from ..crud import find_or_create_account
+from .. import balances, piece_index
+from ..crud import begin_batch, bump_data_version, bump_sequence, find_or_create_account
 from ..database import get_db
-from ..models import Account, Entry, Exercice, HistoryEvent, JournalSequence
+from ..models import Account, AccountBalance, Entry, Exercice
 from ..schemas import ANRequest, ANResponse, ExerciceCreate, ExerciceOut
 
 router = APIRouter(prefix="/api/exercices", tags=["exercices"])
@@ -30,6 +31,7 @@ def update_exercice(id: int, payload: ExerciceCreate, db: Session = Depends(get_
         raise HTTPException(404)
     for k, v in payload.model_dump().items():
         setattr(e, k, v)
+    bump_data_version(db, id)
     db.commit(); db.refresh(e)
     return e
 
@@ -72,24 +74,19 @@ def generate_a_n(req: ANRequest, db: Session = Depends(get_db)):
         if not req.overwrite:
             raise HTTPException(409, f"Des à-nouveaux existent déjà ({piece_ref}). Utilisez overwrite=true.")
         # delete existants
-        db.execute(
-            Entry.__table__.delete().where(
-                Entry.exercice_id == target.id,
-                Entry.jnl == journal,
-                Entry.piece_ref == piece_ref,
-            )
-        )
+        where = (Entry.exercice_id == target.id, Entry.jnl == journal, Entry.piece_ref == piece_ref)
+        balances.subtract(db, *where)
+        db.execute(Entry.__table__.delete().where(*where))
         db.flush()
 
-    # 3) Construire la balance 1–5 du source
+    # 3) Construire la balance 1–5 du source (cumuls par compte tenus à jour)
     sub = (
         select(
-            Entry.account_id.label("account_id"),
-            func.sum(Entry.debit_minor).label("debit_minor"),
-            func.sum(Entry.credit_minor).label("credit_minor"),
+            AccountBalance.account_id.label("account_id"),
+            AccountBalance.debit_minor.label("debit_minor"),
+            AccountBalance.credit_minor.label("credit_minor"),
         )
-        .where(Entry.exercice_id == source.id)
-        .group_by(Entry.account_id)
+        .where(AccountBalance.exercice_id == source.id)
         .subquery()
     )
 
@@ -187,34 +184,23 @@ def generate_a_n(req: ANRequest, db: Session = Depends(get_db)):
     print(total_credit, total_debit)
     assert total_debit == total_credit, "Pièce AN non équilibrée (bug interne)"
 
-    # 6) Insertion + HistoryEvent + JournalSequence
+    # 6) HistoryEvent (lot) + Insertion + JournalSequence
     try:
+        # Historisation sur exercice cible ; son id sert de batch_id aux lignes AN
+        he = begin_batch(db, target.id, f"AN {source.label} → {target.label} (jnl {journal}, pièce {piece_ref})")
+        he.counts_json = f"{{\"added\":{len(to_insert)},\"modified\":{0},\"deleted\":{existing_count}}}"
+        deltas = balances.new_deltas()
         for e in to_insert:
+            e.batch_id = he.id
             db.add(e)
+            balances.add(deltas, target.id, e.account_id, e.date, e.jnl, e.debit_minor, e.credit_minor)
         db.flush()
-
-        # Historisation sur exercice cible
-        he = HistoryEvent(
-            exercice_id=target.id,
-            description=f"AN {source.label} → {target.label} (jnl {journal}, pièce {piece_ref})",
-            counts_json=f"{{\"added\":{len(to_insert)},\"modified\":{0},\"deleted\":{0}}}"
-        )
-        db.add(he)
-        db.flush()
+        balances.apply(db, deltas)
+        # l'écrasement supprime puis recrée la même référence
+        piece_index.note_added(db, target.id, [piece_ref])
 
         # Séquence : fixer à 1 minimum
-        seq = db.execute(
-            select(JournalSequence).where(
-                JournalSequence.exercice_id == target.id,
-                JournalSequence.jnl == journal,
-            )
-        ).scalar_one_or_none()
-        if seq is None:
-            seq = JournalSequence(exercice_id=target.id, jnl=journal, last_number=1)
-            db.add(seq)
-        else:
-            if seq.last_number < 1:
-                seq.last_number = 1
+        bump_sequence(db, target.id, journal, 1)
 
         db.commit()
     except Exception:
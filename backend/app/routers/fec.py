@@ -1,15 +1,19 @@
 # routers/fec.py
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Response, UploadFile
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 from datetime import date
+from functools import lru_cache
+from typing import BinaryIO
 import io, zipfile, re
 from collections import defaultdict
 
 from ..helpers import FS_ROOT, fmt_cents_fec
 from ..database import get_db
 from ..models import Client, Entry, Account, Journal, Exercice
-from ..crud import get_exercice
+from ..crud import get_exercice, list_unbalanced_pieces
+from ..importer import CHUNK_SIZE, ImportTimer, import_stream, parse_amount_minor, parse_date, record_import
+from ..validators import ValidationError
 
 router = APIRouter(prefix="/api", tags=["fec"])
 
@@ -294,3 +298,130 @@ def export_fec(exercice_id: int, db: Session = Depends(get_db)):
     desc_path.write_bytes(desc_data)
 
     return {"saved_to": [str(fec_path), str(desc_path)]}
+
+
+# --------- import FEC ----------
+# Colonnes indispensables ; les autres champs de FEC_FIELDS sont facultatifs
+FEC_REQUIRED = ("JournalCode", "EcritureDate", "CompteNum", "PieceRef", "EcritureLib", "Debit", "Credit")
+
+@lru_cache(maxsize=8192)
+def _parse_fec_date(s: str) -> date:
+    s = s.strip()
+    if len(s) == 8 and s.isdigit():  # AAAAMMJJ
+        return date(int(s[:4]), int(s[4:6]), int(s[6:]))
+    return parse_date(s)
+
+def _iter_fec_chunks(binary: BinaryIO, encoding: str, ex: Exercice, chunk_size: int = CHUNK_SIZE):
+    """
+    Lecture en flux d'un FEC (séparateur '|' ou tabulation, détecté sur l'en-tête)
+    et production de lots de lignes normalisées pour importer.load_chunks.
+    Les champs FEC ne sont jamais entre guillemets : un split suffit.
+    """
+    binary.seek(0)
+    text = io.TextIOWrapper(binary, encoding=encoding, newline="")
+    try:
+        header = text.readline()
+        if not header.strip():
+            raise ValidationError("Fichier vide")
+        sep = "\t" if header.count("\t") > header.count(PIPE) else PIPE
+        # noms comparés sans casse (Montantdevise / MontantDevise…)
+        names = [h.strip().lstrip("\ufeff").lower() for h in header.rstrip("\r\n").split(sep)]
+        missing = [f for f in FEC_REQUIRED if f.lower() not in names]
+        if missing:
+            raise ValidationError(f"Colonnes FEC manquantes: {', '.join(missing)}")
+        # lignes complétées à width+1 champs : une colonne absente pointe sur la case vide finale
+        width = len(names)
+        pad = [""] * (width + 1)
+        (c_jnl, c_jlib, c_date, c_acc, c_acclib, c_ref, c_pdate, c_lib, c_debit, c_credit,
+         c_vdate, c_montant, c_idev) = (
+            names.index(f.lower()) if f.lower() in names else width
+            for f in ("JournalCode", "JournalLib", "EcritureDate", "CompteNum", "CompteLib", "PieceRef",
+                      "PieceDate", "EcritureLib", "Debit", "Credit", "ValidDate", "Montantdevise", "Idevise")
+        )
+
+        date_start = ex.date_start
+        chunk: list[dict] = []
+        for i, line in enumerate(text, start=2):
+            if not line.strip():
+                continue
+            values = line.rstrip("\r\n").split(sep)
+            if len(values) <= width:
+                values += pad[len(values):]
+            try:
+                jnl = values[c_jnl].strip()
+                d = _parse_fec_date(values[c_date])
+                accnum = values[c_acc].strip()
+                debit = parse_amount_minor(values[c_debit] or "0")
+                credit = parse_amount_minor(values[c_credit] or "0")
+                piece_date_raw = values[c_pdate].strip()
+                valid_date_raw = values[c_vdate].strip()
+                piece_date = _parse_fec_date(piece_date_raw) if piece_date_raw else d
+                valid_date = _parse_fec_date(valid_date_raw) if valid_date_raw else d
+                if jnl == "AN":
+                    piece_date = valid_date = date_start
+                montant_raw = values[c_montant].strip()
+                montant = parse_amount_minor(montant_raw) if montant_raw else None
+            except Exception as e:
+                raise ValidationError(f"Erreur parsing ligne {i}: {e}")
+
+            if debit < 0 or credit < 0:
+                raise ValidationError(f"Ligne {i}: montants négatifs interdits")
+            if (debit != 0 and credit != 0) or (debit == 0 and credit == 0):
+                raise ValidationError(f"Ligne {i}: chaque ligne doit avoir soit un débit soit un crédit (exclusif)")
+
+            chunk.append({
+                "exercice_id": ex.id,
+                "date": d,
+                "jnl": jnl,
+                "jnl_lib": values[c_jlib].strip() or None,
+                "piece_ref": values[c_ref].strip(),
+                "accnum": accnum,
+                "acclib": values[c_acclib].strip() or accnum,
+                "lib": values[c_lib].strip(),
+                "debit_minor": debit,
+                "credit_minor": credit,
+                "piece_date": piece_date,
+                "valid_date": valid_date,
+                "montant_minor": montant,
+                "i_devise": values[c_idev].strip() or None,
+            })
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        text.detach()
+
+@router.post("/imports/fec", summary="Import FEC (séparateur | ou tabulation)")
+def import_fec(
+    exercice_id: int = Form(...),
+    file: UploadFile = File(...),
+    skip_existing: bool = Form(False),
+    delete_missing: bool = Form(False),
+    db: Session = Depends(get_db),
+):
+    try:
+        ex = get_exercice(db, exercice_id)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    timer = ImportTimer()
+
+    # Comptes (CompteNum/CompteLib) et journaux (JournalCode/JournalLib) créés en masse,
+    # écritures insérées par lots, dans une seule transaction
+    try:
+        counts = import_stream(
+            db, ex, lambda encoding: _iter_fec_chunks(file.file, encoding, ex),
+            skip_existing=skip_existing, delete_missing=delete_missing,
+        )
+        record_import(db, counts, f"Importer FEC ({counts['added']} écritures)")
+        db.commit()
+    except ValidationError as ve:
+        db.rollback()
+        raise HTTPException(400, str(ve))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(500, f"Erreur lors de l'insertion: {e}")
+
+    warnings = {"unbalanced_pieces": list_unbalanced_pieces(db, exercice_id, limit=50)}
+    return {**counts, "warnings": warnings, "stats": timer.stats(counts["added"] + counts["unchanged"])}
@@ -4,12 +4,18 @@ from sqlalchemy import select
 from typing import Literal
 import json
 
+from .. import balances
 from ..helpers import FS_ROOT
+from ..crud import begin_batch
 from ..database import get_db
-from ..models import Client, Exercice, HistoryEvent
+from ..models import Client, Entry, Exercice, HistoryEvent
+from ..search import analyze
 
 router = APIRouter(prefix="/api/history", tags=["history"])
 
+# Taille des DELETE successifs lors de l'annulation d'un lot
+UNDO_CHUNK_SIZE = 50_000
+
 def _parse_counts(s: str | None) -> dict:
     if not s:
         return {}
@@ -22,11 +28,11 @@ def _counts_human(d: dict) -> str:
     if not d:
         return "—"
     parts = []
-    nature = ["Ajoutée", "Modifiée", "Supprimée"]
-    for k in ("added", "modified", "deleted"):
+    nature = ["Ajoutée", "Modifiée", "Supprimée", "Inchangée"]
+    for k in ("added", "modified", "deleted", "unchanged"):
         parts.append(d[k] if k in d else 0)
     ret = ""
-    for i in range(3):
+    for i in range(len(nature)):
         ret += f"{nature[i]}{'s' if parts[i] > 1 else ''}: {parts[i]} | " if parts[i] else ""
     return ret[:-2] if len(ret) > 2 else ""
 
@@ -70,6 +76,41 @@ def update_history_description(id: int, description: str, db: Session = Depends(
         "counts_human": _counts_human(counts),
     }
 
+@router.post("/{id}/undo")
+def undo_batch(id: int, db: Session = Depends(get_db)):
+    """
+    Annule un lot (import, AN, saisie) : supprime les écritures portant son
+    batch_id, par DELETE successifs sur l'index, dans une seule transaction.
+    Impossible si le lot a modifié ou supprimé des écritures existantes.
+    """
+    he = db.get(HistoryEvent, id)
+    if not he:
+        raise HTTPException(404)
+    counts = _parse_counts(he.counts_json)
+    if counts.get("modified") or counts.get("deleted"):
+        raise HTTPException(409, "Lot non annulable : il a modifié ou supprimé des écritures existantes")
+
+    table = Entry.__table__
+    deleted = 0
+    try:
+        balances.subtract(db, table.c.batch_id == id)
+        while True:
+            ids = select(table.c.id).where(table.c.batch_id == id).limit(UNDO_CHUNK_SIZE)
+            n = db.execute(table.delete().where(table.c.id.in_(ids))).rowcount
+            deleted += n
+            if n < UNDO_CHUNK_SIZE:
+                break
+        if deleted == 0:
+            raise HTTPException(400, "Aucune écriture à annuler pour ce lot")
+        undo = begin_batch(db, he.exercice_id, f"Annulation : {he.description or he.id}")
+        undo.counts_json = f"{{\"added\":0,\"modified\":0,\"deleted\":{deleted}}}"
+        analyze(db.connection(), deleted)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return {"batch_id": id, "deleted": deleted, "history_id": undo.id}
+
 @router.get("/export")
 def export_history_txt(
     exercice_id: int = Query(...),
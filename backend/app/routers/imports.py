@@ -1,39 +1,22 @@
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form
 from sqlalchemy.orm import Session
-from sqlalchemy import select
-from decimal import ROUND_HALF_UP, Decimal
-from datetime import datetime
-import csv, io, re
+from typing import BinaryIO
+import posixpath, shutil, tempfile, zipfile
 from ..database import get_db
-from ..models import Entry, HistoryEvent, Account
-from ..validators import ensure_batch_balanced, ensure_dates_in_exercice, ValidationError
-from ..crud import find_or_create_account, find_or_create_journal, get_next_ref, list_unbalanced_pieces, get_exercice
+from ..validators import ValidationError
+from ..crud import list_unbalanced_pieces, get_exercice
+from ..importer import ImportTimer, import_csv_files, import_csv_stream, record_import, validate_csv_stream
+from ..jobs import get_job, submit_import
 
 router = APIRouter(prefix="/api/imports", tags=["imports"])
 
-_amount_clean_re = re.compile(r"[\s\u00A0]\s*")
-
-def to_minor(d: Decimal | int | str | float) -> int:
-    d = Decimal(str(d)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    return int((d * 100).to_integral_value())
-
-def parse_amount(s: str) -> Decimal:
-    s = s.strip()
-    s = _amount_clean_re.sub("", s)
-    s = s.replace("\u00A0", "").replace(" ", "")
-    s = s.replace(",", ".")
-    return Decimal(s)
-
-def parse_date(s: str):
-    s = s.strip()
-    if "/" in s:
-        return datetime.strptime(s, "%d/%m/%Y").date()
-    return datetime.strptime(s, "%Y-%m-%d").date()
-
 @router.post("/csv")
-async def import_csv(
+def import_csv(
     exercice_id: int = Form(...),
     file: UploadFile = File(...),
+    dry_run: bool = Form(False),
+    skip_existing: bool = Form(False),
+    delete_missing: bool = Form(False),
     db: Session = Depends(get_db),
 ):
     # 1) Exercice
@@ -41,171 +24,143 @@ async def import_csv(
         ex = get_exercice(db, exercice_id)
     except ValueError as e:
         raise HTTPException(400, str(e))
-    client_id = ex.client_id
+    timer = ImportTimer()
 
-    # 2) Lecture fichier
-    raw = await file.read()
-    try:
-        text = raw.decode("utf-8")
-    except UnicodeDecodeError:
-        text = raw.decode("latin-1")
-    if not text.strip():
-        raise HTTPException(400, "Fichier vide")
-
-    # 3) Détection dialecte (échantillon un peu plus large que 1 ligne)
-    sample = "\n".join(text.splitlines()[:10])
-    try:
-        dialect = csv.Sniffer().sniff(sample)
-    except Exception:
-        dialect = csv.excel
-        dialect.delimiter = "\t"  # par défaut FR
-
-    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
-    reader.fieldnames = [(h or "").strip() for h in (reader.fieldnames or [])]
-
-    required = {
-        "jnl", "accnum", "acclib", "date", "lib", "pieceRef",
-        "debit", "credit", "pieceDate", "validDate", "montant", "iDevise"
-    }
-    missing = required - set(reader.fieldnames or [])
-    if missing:
-        raise HTTPException(400, f"Colonnes manquantes: {', '.join(sorted(missing))}")
-
-    def cell(row, key):
-        return (row.get(key) or "").strip()
-
-    # 4) Un seul passage : parse + normalisation + collecte vues
-    rows: list[dict] = []
-    delta_rows: list[dict] = []
-    seen_acc: dict[str, bool] = {}
-    seen_jnl: set[str] = set()
-
-    for i, row in enumerate(reader, start=2):
+    # Validation à blanc : rapport complet, aucune écriture
+    if dry_run:
         try:
-            jnl = cell(row, "jnl")
-            accnum = cell(row, "accnum")
-            acclib = cell(row, "acclib") or accnum
-
-            date_obj = parse_date(cell(row, "date"))
-            # logique hors-exercice: tu marquais JNL="DATE" et remplaçais la date
-            if not (ex.date_start <= date_obj <= ex.date_end):
-                date_obj = parse_date("1/1/2022")  # garde ta logique existante
-                jnl = "DATE"
-
-            lib = cell(row, "lib")
-            piece_ref = cell(row, "pieceRef")
-
-            debit = parse_amount(cell(row, "debit") or "0")
-            credit = parse_amount(cell(row, "credit") or "0")
-
-            piece_date_raw = cell(row, "pieceDate")
-            valid_date_raw = cell(row, "validDate")
-            piece_date = parse_date(piece_date_raw) if piece_date_raw else date_obj
-            valid_date = parse_date(valid_date_raw) if valid_date_raw else date_obj
-            if jnl == "AN":
-                piece_date = ex.date_start
-                valid_date = ex.date_start
-
-            montant_raw = cell(row, "montant")
-            montant = parse_amount(montant_raw) if montant_raw else None
-
-            i_devise = cell(row, "iDevise") or None
-        except Exception as e:
-            raise HTTPException(400, f"Erreur parsing ligne {i}: {e}")
-
-        if debit < 0 or credit < 0:
-            raise HTTPException(400, f"Ligne {i}: montants négatifs interdits")
-
-        if (debit != 0 and credit != 0) or (debit == 0 and credit == 0):
-            raise HTTPException(400, f"Ligne {i}: chaque ligne doit avoir soit un débit soit un crédit (exclusif)")
-
-        # Génération de réf pièce si manquante (avec le JNL normalisé!)
-        if piece_ref == "":
-            piece_ref = get_next_ref(db, exercice_id, jnl).get("next_ref", "NC")
-
-        # Collecte vues (basée sur les valeurs normalisées !)
-        if accnum:
-            seen_acc.setdefault(accnum, True)
-        if jnl:
-            seen_jnl.add(jnl)
-
-        # Stocke la ligne normalisée
-        norm = {
-            "exercice_id": exercice_id,
-            "date": date_obj,
-            "jnl": jnl,
-            "piece_ref": piece_ref,
-            "accnum": accnum,      # pour résolution account_id ensuite
-            "acclib": acclib,      # pour création si besoin
-            "lib": lib,
-            "debit": debit,
-            "credit": credit,
-            "piece_date": piece_date,
-            "valid_date": valid_date,
-            "montant": montant,
-            "i_devise": i_devise,
-        }
-        rows.append(norm)
-        delta_rows.append({"date": date_obj, "debit": debit, "credit": credit})
-
-    # 5) Validations (sur les données normalisées)
+            report = validate_csv_stream(db, ex, file.file)
+        except ValidationError as ve:
+            raise HTTPException(400, str(ve))
+        report["stats"] = timer.stats(report["summary"]["lines"])
+        return report
+
+    # 2) Lecture en flux + validation + insertion par lots, dans une seule transaction
+    #    (le fichier reçu est déjà spoolé sur disque par Starlette)
+    #    skip_existing / delete_missing : ré-import idempotent par empreinte de ligne
     try:
-        ensure_dates_in_exercice(rows, ex.date_start, ex.date_end)
-        ensure_batch_balanced(delta_rows)
+        counts = import_csv_stream(
+            db, ex, file.file, skip_existing=skip_existing, delete_missing=delete_missing,
+        )
     except ValidationError as ve:
+        db.rollback()
         raise HTTPException(400, str(ve))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(500, f"Erreur lors de l'insertion: {e}")
 
-    # 6) Pré-création/synchro à partir des ensembles vus NORMALISÉS (plus de 2e lecture)
+    # 3) Historique + commit
     try:
-        # Comptes
-        for accnum in seen_acc.keys():
-            # find_or_create ne modifie pas un compte existant
-            find_or_create_account(db, client_id, accnum, accnum)
-        # Journaux
-        for j in seen_jnl:
-            find_or_create_journal(db, client_id, j, None)
-        db.flush()  # assure les IDs générés si nécessaire avant insert
+        record_import(db, counts)
+        db.commit()
     except Exception as e:
         db.rollback()
-        raise HTTPException(500, f"Erreur lors de la pré-création comptes/journaux: {e}")
+        raise HTTPException(500, f"Erreur lors de l'insertion: {e}")
 
-    # 7) Insertion des écritures (depuis EXACTEMENT rows)
+    warnings = {"unbalanced_pieces": list_unbalanced_pieces(db, exercice_id, limit=50)}
+    return {**counts, "warnings": warnings, "stats": timer.stats(counts["added"] + counts["unchanged"])}
+
+
+# -------- Import multi-fichiers / archive ZIP --------
+ARCHIVE_SUFFIXES = (".csv", ".txt")
+# Membres extraits en mémoire jusqu'à cette taille, sur disque au-delà
+MEMBER_SPOOL_BYTES = 8 * 1024 * 1024
+
+def _upload_members(uploads: list[UploadFile]) -> list[tuple[str, BinaryIO]]:
+    """Fichiers à importer : chaque upload tel quel, ou les CSV d'une archive ZIP (triés par nom)."""
+    members: list[tuple[str, BinaryIO]] = []
+    for up in uploads:
+        name = up.filename or "fichier"
+        if not zipfile.is_zipfile(up.file):
+            up.file.seek(0)
+            members.append((name, up.file))
+            continue
+        up.file.seek(0)
+        with zipfile.ZipFile(up.file) as zf:
+            for info in sorted(zf.infolist(), key=lambda i: i.filename):
+                base = posixpath.basename(info.filename)
+                if info.is_dir() or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+                    continue
+                if not base.lower().endswith(ARCHIVE_SUFFIXES):
+                    continue
+                tmp = tempfile.SpooledTemporaryFile(max_size=MEMBER_SPOOL_BYTES)
+                with zf.open(info) as src:
+                    shutil.copyfileobj(src, tmp)
+                members.append((f"{name}/{info.filename}", tmp))
+    return members
+
+@router.post("/archive")
+def import_archive(
+    exercice_id: int = Form(...),
+    files: list[UploadFile] = File(...),
+    skip_existing: bool = Form(False),
+    delete_missing: bool = Form(False),
+    db: Session = Depends(get_db),
+):
+    """
+    Import d'un ensemble de CSV (plusieurs fichiers et/ou archives ZIP) en un
+    seul lot : parsing concurrent, comptes/journaux résolus une fois, une
+    transaction, un seul contrôle des pièces déséquilibrées. Détail par fichier.
+    """
     try:
-        for r in rows:
-            acc = db.execute(
-                select(Account).where(
-                    Account.client_id == client_id,
-                    Account.accnum == r["accnum"]
-                )
-            ).scalar_one_or_none()
-            if acc is None:
-                acc = find_or_create_account(db, client_id, r["accnum"], r["acclib"] or r["accnum"])
-
-            db.add(Entry(
-                exercice_id=exercice_id,
-                date=r["date"],
-                jnl=r["jnl"],
-                piece_ref=r["piece_ref"],
-                account_id=acc.id,
-                lib=r["lib"],
-                debit_minor=to_minor(r["debit"]),
-                credit_minor=to_minor(r["credit"]),
-                piece_date=r["piece_date"],
-                valid_date=r["valid_date"],
-                montant_minor=to_minor(r["montant"]) if r["montant"] is not None else None,
-                i_devise=r["i_devise"],
-            ))
-
-        he = HistoryEvent(
-            exercice_id=exercice_id,
-            description=f"Importer {len(rows)} écritures",
-            counts_json=f'{{"added":{len(rows)}}}',
+        ex = get_exercice(db, exercice_id)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    timer = ImportTimer()
+
+    try:
+        members = _upload_members(files)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(400, f"Archive ZIP invalide: {e}")
+    if not members:
+        raise HTTPException(400, "Aucun fichier CSV à importer")
+
+    try:
+        counts = import_csv_files(
+            db, ex, members, skip_existing=skip_existing, delete_missing=delete_missing,
         )
-        db.add(he)
+        record_import(db, counts, f"Importer {len(members)} fichiers ({counts['added']} écritures)")
         db.commit()
+    except ValidationError as ve:
+        db.rollback()
+        raise HTTPException(400, str(ve))
     except Exception as e:
         db.rollback()
         raise HTTPException(500, f"Erreur lors de l'insertion: {e}")
+    finally:
+        for _, f in members:
+            if isinstance(f, tempfile.SpooledTemporaryFile):
+                f.close()
 
     warnings = {"unbalanced_pieces": list_unbalanced_pieces(db, exercice_id, limit=50)}
-    return {"added": len(rows), "warnings": warnings}
+    return {**counts, "warnings": warnings, "stats": timer.stats(counts["added"] + counts["unchanged"])}
+
+
+# -------- Imports en tâche de fond --------
+@router.post("/jobs")
+def submit_import_job(
+    exercice_id: int = Form(...),
+    file: UploadFile = File(...),
+    skip_existing: bool = Form(False),
+    delete_missing: bool = Form(False),
+    db: Session = Depends(get_db),
+):
+    try:
+        get_exercice(db, exercice_id)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    # Copie sur disque : le worker relit le fichier après la fin de la requête
+    with tempfile.NamedTemporaryFile(prefix="import_", suffix=".csv", delete=False) as tmp:
+        shutil.copyfileobj(file.file, tmp)
+    job = submit_import(
+        exercice_id, tmp.name, file.filename, skip_existing=skip_existing, delete_missing=delete_missing,
+    )
+    return job.snapshot()
+
+@router.get("/jobs/{job_id}")
+def import_job_status(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(404, "Job introuvable")
+    return job.snapshot()
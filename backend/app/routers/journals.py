@@ -1,24 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from sqlalchemy import select
 
 from ..schemas import JournalOut
 from ..database import get_db
+from ..crud import bump_data_version
 from ..models import Journal
+from ..responses import Layout, json_response, rows_payload
 
 router = APIRouter(prefix="/api/journals", tags=["journals"])
 
 @router.get("", response_model=list[JournalOut])
-def list_journals(client_id: int, db: Session = Depends(get_db)):
-    rows = db.execute(select(Journal).where(Journal.client_id==client_id).order_by(Journal.jnl)).scalars().all()
-    return rows
+def list_journals(request: Request, client_id: int, layout: Layout = "rows", db: Session = Depends(get_db)):
+    rows = db.execute(select(Journal.id, Journal.jnl, Journal.jnl_lib).where(Journal.client_id==client_id).order_by(Journal.jnl)).all()
+    return json_response(request, rows_payload(rows, ("id", "jnl", "jnl_lib"), layout))
 
 @router.post("", response_model=JournalOut)
 def create_journal(client_id: int, jnl: str, jnl_lib: str, db: Session = Depends(get_db)):
     if db.execute(select(Journal).where(Journal.client_id==client_id, Journal.jnl==jnl)).scalar_one_or_none():
         raise HTTPException(400, "Journal déjà existant")
     j = Journal(client_id=client_id, jnl=jnl, jnl_lib=jnl_lib)
-    db.add(j); db.commit(); db.refresh(j)
+    db.add(j)
+    bump_data_version(db, client_id=client_id)
+    db.commit(); db.refresh(j)
     return j
 
 @router.patch("/{id}", response_model=JournalOut)
@@ -27,6 +31,7 @@ def update_journal(id: int, jnl_lib: str, db: Session = Depends(get_db)):
     if not j:
         raise HTTPException(404)
     j.jnl_lib = jnl_lib
+    bump_data_version(db, client_id=j.client_id)
     db.commit()
     return j
 
@@ -35,5 +40,7 @@ def delete_journal(id: int, db: Session = Depends(get_db)):
     j = db.get(Journal, id)
     if not j:
         raise HTTPException(404)
-    db.delete(j); db.commit()
+    db.delete(j)
+    bump_data_version(db, client_id=j.client_id)
+    db.commit()
     return {"ok": True}
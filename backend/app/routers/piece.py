@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import func, select
+from sqlalchemy import select
+from .. import balances, piece_index
 from ..database import get_db
-from ..models import Entry, HistoryEvent, Account, JournalSequence
+from ..models import Entry, Account
 from ..schemas import PieceCommitRequest, PieceCommitResponse, PieceGetResponse
 from ..validators import ensure_batch_balanced_minor, ensure_dates_in_exercice, check_one_side
-from ..crud import get_next_ref, list_unbalanced_pieces, get_exercice, find_or_create_account
+from ..crud import begin_batch, bump_sequence, format_ref, get_next_ref, list_unbalanced_pieces, get_exercice, find_or_create_account, ref_number, reserve_refs
 
 router = APIRouter(prefix="/api", tags=["piece"])
 
@@ -48,6 +49,10 @@ def commit_piece(req: PieceCommitRequest, db: Session = Depends(get_db)):
     ex = get_exercice(db, req.exercice_id)
     client_id = ex.client_id
 
+    # Référence vide : nouvelle pièce, numéro réservé sur la séquence du journal
+    if not req.piece_ref.strip():
+        req.piece_ref = format_ref(req.journal, reserve_refs(db, req.exercice_id, req.journal))
+
     # Construire le lot (delta) pour validation
     delta_rows = []
     to_add = []
@@ -99,7 +104,11 @@ def commit_piece(req: PieceCommitRequest, db: Session = Depends(get_db)):
     ensure_batch_balanced_minor(delta_rows)
 
     added = modified = deleted = 0
+    deltas = balances.new_deltas()
     try:
+        # HistoryEvent d'abord : son id sert de batch_id aux lignes ajoutées
+        he = begin_batch(db, req.exercice_id, req.description or "")
+
         # Adds
         for ch in to_add:
             # Résoudre ou créer le compte. N'update JAMAIS acclib si existe déjà.
@@ -118,14 +127,17 @@ def commit_piece(req: PieceCommitRequest, db: Session = Depends(get_db)):
                 debit_minor=ch.debit_minor or 0,
                 credit_minor=ch.credit_minor or 0,
                 piece_date=ch.date,
-                valid_date=ch.date
+                valid_date=ch.date,
+                batch_id=he.id,
             )
             db.add(e)
+            balances.add(deltas, req.exercice_id, acc.id, e.date, e.jnl, e.debit_minor, e.credit_minor)
             added += 1
 
         # Mods
         for ch in to_mod:
             e = existing[ch.entry_id]
+            balances.add(deltas, req.exercice_id, e.account_id, e.date, e.jnl, e.debit_minor, e.credit_minor, sign=-1)
             if ch.date is not None:
                 e.date = ch.date
             if ch.accnum is not None:
@@ -141,48 +153,34 @@ def commit_piece(req: PieceCommitRequest, db: Session = Depends(get_db)):
                 e.debit_minor = ch.debit_minor
             if ch.credit_minor is not None:
                 e.credit_minor = ch.credit_minor
+            balances.add(deltas, req.exercice_id, e.account_id, e.date, e.jnl, e.debit_minor, e.credit_minor)
             modified += 1
 
         # Dels
         for ch in to_del:
             e = existing[ch.entry_id]
+            balances.add(deltas, req.exercice_id, e.account_id, e.date, e.jnl, e.debit_minor, e.credit_minor, sign=-1)
             db.delete(e)
             deleted += 1
 
         db.flush()
-
-        he = HistoryEvent(
-            exercice_id=req.exercice_id,
-            description=req.description or "",
-            counts_json=f"{{\"added\":{added},\"modified\":{modified},\"deleted\":{deleted}}}"
-        )
-        db.add(he)
+        balances.apply(db, deltas)
+        if added:
+            piece_index.note_added(db, req.exercice_id, [req.piece_ref])
+        if deleted:
+            piece_index.note_removed(db, req.exercice_id)
+
+        # Séquence : une référence "{jnl}-{n}" remonte le high-water mark
+        n = ref_number(req.journal, req.piece_ref)
+        if n is not None and added > 0:
+            bump_sequence(db, req.exercice_id, req.journal, n)
+
+        he.counts_json = f"{{\"added\":{added},\"modified\":{modified},\"deleted\":{deleted}}}"
         db.commit()
 
-        is_new_piece = (len(existing) == 0 and added > 0)
-
-        if is_new_piece:
-            seq = db.execute(
-                select(JournalSequence).where(
-                    JournalSequence.exercice_id == req.exercice_id,
-                    JournalSequence.jnl == req.journal
-                )
-            ).scalar_one_or_none()
-
-            if seq is None:
-                seq = JournalSequence(exercice_id=req.exercice_id, jnl=req.journal, last_number=0)
-                db.add(seq)
-                db.flush()
-            else:
-                start = seq.last_number + 1
-                cand = f"{req.journal}-{start:05d}"
-                if req.piece_ref == cand:
-                    seq.last_number = start
-            db.commit()
-
     except Exception:
         db.rollback()
         raise
 
     warnings = {"unbalanced_pieces": list_unbalanced_pieces(db, req.exercice_id, limit=50)}
-    return {"added": added, "modified": modified, "deleted": deleted, "warnings": warnings}
+    return {"piece_ref": req.piece_ref, "added": added, "modified": modified, "deleted": deleted, "warnings": warnings}
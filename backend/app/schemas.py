@@ -32,6 +32,7 @@ class BalanceRow(BaseModel):
     credit_minor: int
     solde_minor: int
     count: int
+    level: Optional[int] = None  # balance hiérarchique : profondeur du sous-total
 
 
 
@@ -40,6 +41,37 @@ class BalanceResponse(BaseModel):
     total_accounts: int
 
 
+class BalanceAt(BalanceResponse):
+    date_to: datetime.date
+
+
+class BalanceCutoffsResponse(BaseModel):
+    balances: List[BalanceAt]
+
+
+class CompareExercice(BaseModel):
+    id: int
+    label: str
+
+
+class BalanceCompareRow(BaseModel):
+    accnum: str
+    acclib: str
+    # une valeur par exercice, dans l'ordre de la requête
+    debit_minor: List[int]
+    credit_minor: List[int]
+    solde_minor: List[int]
+    count: List[int]
+    # solde du premier exercice moins celui de chacun des suivants
+    variance_minor: List[int]
+
+
+class BalanceCompareResponse(BaseModel):
+    exercices: List[CompareExercice]
+    rows: List[BalanceCompareRow]
+    total_accounts: int
+
+
 # ----------- Pièce -----------
 class PieceEntryOut(BaseModel):
     id: int
@@ -79,6 +111,7 @@ class PieceCommitRequest(BaseModel):
 
 
 class PieceCommitResponse(BaseModel):
+    piece_ref: str  # référence réservée si la requête l'a laissée vide
     added: int
     modified: int
     deleted: int
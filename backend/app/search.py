@@ -0,0 +1,278 @@
+"""
+Index de recherche de la grille des écritures et des suggestions.
+Sous SQLite (FTS5), des tables virtuelles sans contenu sont tenues à jour par
+triggers sur `entries` / `accounts` : saisie, AN, modifications et suppressions les
+maintiennent sans code applicatif. Seules les insertions en masse de
+l'importeur (empreinte non nulle) échappent au trigger d'insertion et sont
+indexées par lot via index_bulk_inserted, bien moins coûteux qu'un trigger par
+ligne. Ailleurs, ou si FTS5 manque, les filtres retombent sur ILIKE.
+"""
+from typing import NamedTuple
+import re
+
+from sqlalchemy import Connection, and_, false, func, literal, or_, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import column, table
+
+from .models import Entry
+
+# Montant affiché/recherché : 'euros,cents' sans séparateur de milliers (735600 -> '7356,00')
+AMOUNT_SQL = "printf('%d,%02d', abs({p}debit_minor - {p}credit_minor) / 100, abs({p}debit_minor - {p}credit_minor) % 100)"
+
+# Au-delà, un montant avec virgule passe par l'index trigramme plutôt que par des lookups
+AMOUNT_MAX_LOOKUPS = 64
+# Longueur minimale d'une requête servie par un index trigramme
+TRIGRAM_MIN = 3
+# Au-delà de ce nombre de candidats, un motif est jugé peu sélectif : parcours
+# ordinaire (qui s'arrête vite au LIMIT, les correspondances étant denses)
+CANDIDATE_LIMIT = 2000
+
+
+class FtsIndex(NamedTuple):
+    name: str
+    columns: tuple[str, ...]
+    values: tuple[str, ...]   # expressions SQL sur la ligne ({p} = "new." / "old.")
+    tokenize: str
+    watched: tuple[str, ...]  # colonnes de la source dont la mise à jour réindexe
+    options: str = ""         # options fts5 supplémentaires
+    source: str = "entries"
+
+
+ENTRY_INDEXES: list[FtsIndex] = [
+    FtsIndex("entries_amount_fts", ("amount",), (AMOUNT_SQL,), "trigram", ("debit_minor", "credit_minor")),
+    # libellés : mots sans accents ni casse, index de préfixes pour la saisie au fil de l'eau
+    FtsIndex("entries_lib_fts", ("lib",), ("{p}lib",), "unicode61 remove_diacritics 2", ("lib",), "prefix='2 3'"),
+    # sous-chaînes de références de pièce et de comptes (filtres + suggestions)
+    FtsIndex("entries_piece_fts", ("piece_ref",), ("{p}piece_ref",), "trigram", ("piece_ref",)),
+    FtsIndex("accounts_fts", ("accnum", "acclib"), ("{p}accnum", "{p}acclib"), "trigram", ("accnum", "acclib"),
+             source="accounts"),
+]
+
+# Index effectivement installés (voir install)
+_installed: set[str] = set()
+
+
+def _fts5_trigram_supported(conn: Connection) -> bool:
+    if conn.dialect.name != "sqlite":
+        return False
+    version = tuple(int(x) for x in conn.exec_driver_sql("SELECT sqlite_version()").scalar().split("."))
+    fts5 = conn.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar()
+    return bool(fts5) and version >= (3, 34, 0)  # tokenizer trigram
+
+
+def _values(idx: FtsIndex, prefix: str) -> str:
+    return ", ".join(v.format(p=prefix) for v in idx.values)
+
+
+def _create(conn: Connection, idx: FtsIndex):
+    cols = ", ".join(idx.columns)
+    options = f", {idx.options}" if idx.options else ""
+    conn.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {idx.name} USING fts5({cols}, content='', tokenize='{idx.tokenize}'{options})"
+    )
+    # table sans contenu : la suppression rejoue les anciennes valeurs (commande 'delete')
+    insert = f"INSERT INTO {idx.name}(rowid, {cols}) VALUES (new.id, {_values(idx, 'new.')});"
+    delete = f"INSERT INTO {idx.name}({idx.name}, rowid, {cols}) VALUES ('delete', old.id, {_values(idx, 'old.')});"
+    src = idx.source
+    bulk = " WHEN new.fingerprint IS NULL" if src == "entries" else ""  # voir index_bulk_inserted
+    conn.exec_driver_sql(f"CREATE TRIGGER {idx.name}_ai AFTER INSERT ON {src}{bulk} BEGIN {insert} END")
+    conn.exec_driver_sql(f"CREATE TRIGGER {idx.name}_ad AFTER DELETE ON {src} BEGIN {delete} END")
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER {idx.name}_au AFTER UPDATE OF {', '.join(idx.watched)} ON {src} "
+        f"BEGIN {delete} {insert} END"
+    )
+    conn.exec_driver_sql(f"INSERT INTO {idx.name}(rowid, {cols}) SELECT id, {_values(idx, '')} FROM {src}")
+
+
+def install(conn: Connection):
+    """Crée (et remplit) les index manquants ; appelé au démarrage par migrations.upgrade."""
+    _installed.clear()
+    if not _fts5_trigram_supported(conn):
+        return
+    existing = {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for idx in ENTRY_INDEXES:
+        if idx.name not in existing:
+            _create(conn, idx)
+        _installed.add(idx.name)
+    analyze(conn)
+
+
+def analyze(conn: Connection, changed: int | None = None):
+    """
+    Statistiques du planificateur (sqlite_stat1). Sans elles, SQLite préfère
+    les index ordonnés de la grille aux candidats trigrammes ou au compte filtré,
+    même très sélectifs. `changed` : écritures ajoutées / supprimées par le lot ;
+    le recalcul (complet : ~2 s pour 1M d'écritures, un échantillon fausse la
+    cardinalité de exercice_id) n'a lieu que si la volumétrie a bougé de plus
+    de 10 % ou si les statistiques manquent.
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    has_stats = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).scalar()
+    known = conn.exec_driver_sql(
+        "SELECT max(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = 'entries'"
+    ).scalar() if has_stats else None
+    if known is None or (changed is not None and changed * 10 > known):
+        conn.exec_driver_sql("ANALYZE")
+
+
+def index_bulk_inserted(conn: Connection, after_id: int):
+    """Indexe les lignes importées (empreinte non nulle) d'id > after_id, en une requête par index."""
+    for idx in ENTRY_INDEXES:
+        if idx.name in _installed and idx.source == "entries":
+            conn.exec_driver_sql(
+                f"INSERT INTO {idx.name}(rowid, {', '.join(idx.columns)}) "
+                f"SELECT id, {_values(idx, '')} FROM entries WHERE id > ? AND fingerprint IS NOT NULL",
+                (after_id,),
+            )
+
+
+def fts_enabled(name: str) -> bool:
+    return name in _installed
+
+
+def fts_phrase(s: str) -> str:
+    """Chaîne littérale en requête FTS5 (phrase entre guillemets)."""
+    return '"' + s.replace('"', '""') + '"'
+
+
+def fts_rowids(name: str, col: str | None, query: str):
+    """SELECT rowid FROM <name> WHERE <col> MATCH :query (col=None : toutes les colonnes)"""
+    col = col or name
+    t = table(name, column("rowid"), column(col))
+    return select(t.c.rowid).where(t.c[col].op("MATCH")(query))
+
+
+# ---- sous-chaînes (trigrammes) ----
+
+def substring_candidates(db: Session, index: str, pattern: str, col: str | None = None) -> list[int] | None:
+    """
+    rowids dont `col` (ou une colonne quelconque) contient `pattern`, sans
+    tenir compte de la casse, d'après l'index trigramme ; None si l'index ne
+    peut pas servir (motif court, FTS5 absent) ou si le motif est peu sélectif.
+    Les jokers LIKE (% et _) du motif ne sont pas cherchés : seuls ses
+    morceaux littéraux d'au moins TRIGRAM_MIN caractères, tous requis.
+    """
+    runs = [run for run in re.split(r"[%_]", pattern) if len(run) >= TRIGRAM_MIN]
+    if not runs or not fts_enabled(index):
+        return None
+    query = " AND ".join(fts_phrase(run) for run in runs)
+    ids = db.scalars(fts_rowids(index, col, query).limit(CANDIDATE_LIMIT + 1)).all()
+    return None if len(ids) > CANDIDATE_LIMIT else ids
+
+
+def substring_filter(db: Session, predicate, id_col, pattern: str, index: str, col: str | None = None):
+    """
+    `predicate` (le vrai filtre, ILIKE '%pattern%') précédé quand c'est utile
+    d'un id IN (candidats trigrammes) : la recherche part alors de l'index de
+    clé primaire au lieu d'un parcours complet.
+    """
+    ids = substring_candidates(db, index, pattern, col)
+    if ids is None:
+        return predicate
+    return and_(id_col.in_(ids), predicate)
+
+
+# ---- libellés ----
+
+_WORD = re.compile(r"\w", re.UNICODE)
+
+
+def text_predicate(search: str):
+    """
+    Recherche dans les libellés : chaque mot saisi est un préfixe de mot du
+    libellé (sans accents ni casse), tous les mots doivent être présents.
+    Sans index FTS5 (ou sans mot exploitable) : ILIKE sur la chaîne entière.
+    """
+    terms = [t for t in search.split() if _WORD.search(t)]
+    if terms and fts_enabled("entries_lib_fts"):
+        query = " ".join(f"{fts_phrase(t)}*" for t in terms)
+        return Entry.id.in_(fts_rowids("entries_lib_fts", "lib", query))
+    return Entry.lib.ilike(f"%{search}%")
+
+
+# ---- montants ----
+
+def amount_expr():
+    return func.abs(Entry.debit_minor - Entry.credit_minor)
+
+
+def formatted_amount_expr():
+    """
+    Expression SQL 'euros,cents' de ABS(debit_minor - credit_minor) (en cents).
+    Ex: 735600 -> '7356,00', 5 -> '0,05', 3550 -> '35,50'
+    """
+    digits2 = func.printf('%02d', amount_expr())
+    euros_raw = func.substr(digits2, 1, func.length(digits2) - 2)
+    euros = func.coalesce(func.nullif(euros_raw, ''), literal('0'))
+    cents = func.substr(digits2, -2, 2)
+    return euros + literal(',') + cents
+
+
+_AMOUNT_WITH_COMMA = re.compile(r"(\d*),(\d{0,2})")
+
+
+def _amount_ranges(needle: str, max_amount: int) -> list[tuple[int, int]] | None:
+    """
+    Montants |débit - crédit| dont la forme 'euros,cents' contient `needle`
+    (qui comporte une virgule), en plages [lo, hi] de cents, ou None si le
+    motif n'est pas de cette forme.
+    La virgule ancre le motif : les chiffres qui la suivent sont le début des
+    cents, ceux qui la précèdent la fin des euros. Avec d = ceux-ci + ceux-là
+    (k chiffres) et s = 2 - nb de décimales saisies, un montant x convient si
+    q = x // 10**s se termine par d, en écriture complétée à 3 - s chiffres
+    (les euros valent au moins '0') : q ≡ d (mod 10**k), et q ≥ 10**(k-1)
+    si d a plus de chiffres que cette écriture minimale.
+    """
+    m = _AMOUNT_WITH_COMMA.fullmatch(needle)
+    if not m:
+        return None
+    euros, cents = m.groups()
+    digits = euros + cents
+    s = 2 - len(cents)
+    unit = 10 ** s
+    k = len(digits)
+    v = int(digits) if digits else 0
+    step = 10 ** k
+    q_max = max_amount // unit
+    q = v
+    if k > 3 - s:
+        while q < 10 ** (k - 1):
+            q += step
+    ranges = []
+    while q <= q_max:
+        ranges.append((q * unit, q * unit + unit - 1))
+        if len(ranges) > AMOUNT_MAX_LOOKUPS:
+            return None
+        q += step
+    return ranges
+
+
+def amount_predicate(db: Session, exercice_id: int, needle: str):
+    """
+    Filtre 'montant contient `needle`' (sur 'euros,cents') adossé à un index :
+    - avec virgule : égalités / plages sur |débit - crédit| (index d'expression
+      par exercice) tant que les candidats sont peu nombreux ;
+    - sinon, à partir de 3 caractères : index trigramme du montant formaté ;
+    - motif plus court, ou autre que chiffres et une virgule (jokers LIKE...) :
+      ILIKE sur l'expression, ligne à ligne, comme avant l'index.
+    """
+    if not re.fullmatch(r"[\d,]+", needle) or needle.count(",") > 1:
+        return formatted_amount_expr().ilike(f"%{needle}%")
+    if "," in needle:
+        max_amount = db.execute(
+            select(func.max(amount_expr())).where(Entry.exercice_id == exercice_id)
+        ).scalar() or 0
+        ranges = _amount_ranges(needle, max_amount)
+        if ranges is not None:
+            if not ranges:
+                return false()
+            amount = amount_expr()
+            if all(lo == hi for lo, hi in ranges):
+                return amount.in_([lo for lo, _ in ranges])
+            return or_(*(and_(amount >= lo, amount <= hi) for lo, hi in ranges))
+    if len(needle) >= TRIGRAM_MIN and fts_enabled("entries_amount_fts"):
+        return Entry.id.in_(fts_rowids("entries_amount_fts", "amount", fts_phrase(needle)))
+    return formatted_amount_expr().like(f"%{needle}%")
@@ -0,0 +1,78 @@
+"""
+Index de positions clairsemé de la grille des écritures (GET /api/entries/seek).
+
+Pour un exercice, un tri et des filtres : la clé (valeur de tri, id) d'une ligne
+toutes les STRIDE lignes de l'ordre d'affichage, et le nombre total de lignes.
+- position -> ligne : repère p // STRIDE puis moins de STRIDE lignes sautées ;
+- ligne -> position : bisection sur les repères puis moins de STRIDE lignes comptées.
+Chaque lecture part d'une clé (parcours borné de l'index du tri) : le coût ne
+dépend pas de la taille de l'exercice. Construit à la demande, pas à pas
+(OFFSET STRIDE - 1 depuis le repère précédent), rattaché à Exercice.data_version
+(reconstruit après toute écriture), au plus MAX_INDEXES en mémoire (LRU).
+"""
+from collections import OrderedDict
+from typing import Callable, Optional
+import threading
+
+# Lignes entre deux repères
+STRIDE = 1024
+# Index (exercice, tri, filtres) gardés en mémoire
+MAX_INDEXES = 32
+
+Key = tuple  # (valeur de tri, id)
+# step(repère, n) : clé de la n-ième ligne après le repère (None : depuis le début), ou None
+Step = Callable[[Optional[Key], int], Optional[Key]]
+# count(repère, jusqu'à) : lignes après le repère (None : depuis le début), avant la clé (None : jusqu'à la fin)
+Count = Callable[[Optional[Key], Optional[Key]], int]
+
+
+class PositionIndex:
+    def __init__(self, version: int, marks: list[Key], total: int):
+        self.version = version
+        self.marks = marks  # marks[k] : clé de la ligne (k + 1) * STRIDE - 1
+        self.total = total
+
+    def mark_for(self, position: int) -> tuple[Optional[Key], int]:
+        """Repère qui précède la position, et le nombre de lignes à sauter ensuite."""
+        k = min(position // STRIDE, len(self.marks))
+        return (self.marks[k - 1] if k else None), position - k * STRIDE
+
+    def position_of(self, key: Key, desc: bool, count: Count) -> int:
+        """Position (0 = première ligne) de la ligne de clé `key`."""
+        lo, hi = 0, len(self.marks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            m = self.marks[mid]
+            if (m > key) if desc else (m < key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo * STRIDE + count(self.marks[lo - 1] if lo else None, key)
+
+
+_lock = threading.Lock()
+_cache: OrderedDict[tuple, PositionIndex] = OrderedDict()
+
+
+def _build(version: int, step: Step, count: Count) -> PositionIndex:
+    marks: list[Key] = []
+    mark = None
+    while (mark := step(mark, STRIDE - 1)) is not None:
+        marks.append(mark)
+    total = len(marks) * STRIDE + count(marks[-1] if marks else None, None)
+    return PositionIndex(version, marks, total)
+
+
+def get(cache_key: tuple, version: int, step: Step, count: Count) -> PositionIndex:
+    with _lock:
+        idx = _cache.get(cache_key)
+        if idx is not None and idx.version == version:
+            _cache.move_to_end(cache_key)
+            return idx
+    idx = _build(version, step, count)
+    with _lock:
+        _cache[cache_key] = idx
+        _cache.move_to_end(cache_key)
+        while len(_cache) > MAX_INDEXES:
+            _cache.popitem(last=False)
+    return idx
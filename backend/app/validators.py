@@ -5,8 +5,10 @@ from typing import Iterable
 from fastapi import HTTPException
 
 class ValidationError(Exception):
-    def __init__(self, message: str):
+    def __init__(self, message: str, code: str | None = None, line: int | None = None):
         super().__init__(message)
+        self.code = code
+        self.line = line
 
 
 def ensure_dates_in_exercice(rows: Iterable[dict], start: date, end: date):
@@ -30,6 +32,12 @@ def ensure_batch_balanced_minor(rows: Iterable[dict]):
     if total != 0:
         raise ValidationError(f"Lot non équilibré (Δ={total} cents)")
 
+def ensure_totals_balanced_minor(total_debit_minor: int, total_credit_minor: int):
+    # variante "totaux courants" pour les imports en flux
+    total = total_debit_minor - total_credit_minor
+    if total != 0:
+        raise ValidationError(f"Lot non équilibré (Δ={total} cents)")
+
 def check_one_side(debit_m: int | None, credit_m: int | None):
     d = debit_m or 0
     c = credit_m or 0
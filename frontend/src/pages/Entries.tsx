@@ -190,6 +190,7 @@ export default function Entries() {
         Object.entries(queryParams).forEach(([k, v]) => {
             if (v !== undefined && v !== null && v !== '') p.append(k, String(v))
         })
+        p.append('gzip', 'true') // décompressé par le navigateur (Content-Encoding)
         window.location.href = `/api/entries/export?${p.toString()}`
     }, [queryParams])
 
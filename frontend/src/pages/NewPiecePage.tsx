@@ -15,7 +15,9 @@ export default function NewPiecePage() {
     const qc = useQueryClient();
 
     const [journal, setJournal] = useState("");
+    // Vide : numéro réservé par le serveur à la validation (next_ref n'est qu'un aperçu)
     const [pieceRef, setPieceRef] = useState("");
+    const [nextRef, setNextRef] = useState("");
     const [rows, dispatch] = useReducer(rowsReducer, [makeRow()]);
     const [banner, setBanner] = useState<{ type: "success" | "error"; message: string } | null>(null);
 
@@ -30,7 +32,7 @@ export default function NewPiecePage() {
             const r = await api.get("/api/piece/next_ref", {
                 params: { exercice_id: exerciceId, journal, width: 5 },
             });
-            setPieceRef(r.data.next_ref);
+            setNextRef(r.data.next_ref);
             return r.data;
         },
         enabled: false,
@@ -62,7 +64,7 @@ export default function NewPiecePage() {
 
     const totals = useTotals(rows);
     const canSubmit =
-        !!journal && !!pieceRef && rows.length > 0 && totals.isBalanced && !totals.hasAmountErrors && !totals.bothSidesFilled;
+        !!journal && rows.length > 0 && totals.isBalanced && !totals.hasAmountErrors && !totals.bothSidesFilled;
 
     const mutate = useMutation({
         mutationFn: async () =>
@@ -70,7 +72,7 @@ export default function NewPiecePage() {
                 await api.post("/api/piece/commit", {
                     exercice_id: exerciceId,
                     journal,
-                    piece_ref: pieceRef,
+                    piece_ref: pieceRef.trim(),
                     changes: rows
                         .filter((r) => !r.markedDeleted)
                         .map((r) => ({
@@ -84,11 +86,12 @@ export default function NewPiecePage() {
                         })),
                 })
             ).data,
-        onSuccess: async () => {
+        onSuccess: async (data) => {
             qc.invalidateQueries({ queryKey: ["entries"] });
             qc.invalidateQueries({ queryKey: ["balance"] });
-            setBanner({ type: "success", message: "Pièce enregistrée." });
+            setBanner({ type: "success", message: `Pièce ${data.piece_ref} enregistrée.` });
             dispatch({ type: "set", rows: [makeRow()] });
+            setPieceRef("");
             await refetchNext();
         },
         onError: (err: any) => {
@@ -122,7 +125,7 @@ export default function NewPiecePage() {
                 </div>
                 <div>
                     <label htmlFor="pieceRef" className="block text-sm">Numéro de pièce</label>
-                    <input id="pieceRef" className="border px-2 py-1" value={pieceRef} onChange={(e) => setPieceRef(e.target.value)} />
+                    <input id="pieceRef" className="border px-2 py-1" value={pieceRef} onChange={(e) => setPieceRef(e.target.value)} placeholder={nextRef ? `auto (${nextRef})` : "auto"} />
                 </div>
                 <div className="ml-auto text-sm">
                     <div>Total Débit: {totals.debit.toFixed(2)}</div>